@@ -0,0 +1 @@
+"""Benchmarks for issue-expander. Run them with python -m benchmarks run --help."""
@@ -0,0 +1,177 @@
+"""Generate synthetic Markdown full of issue references, for benchmarking."""
+import random
+import re
+
+OWNER = "octo"
+REPOSITORY = "widgets"
+
+WORDS = (
+    "the a an of to and in is for on with that this it as be by from was are fix bug release add remove "
+    "update refactor parser cache token request response markdown link issue pull review test build "
+    "deploy crash error warning docs readme config option flag default output input stream thread "
+    "regression performance latency memory timeout retry network server client api endpoint"
+).split()
+
+OTHER_REPOSITORIES = [("octo", "gadgets"), ("acme", "rockets"), ("example", "project.js")]
+
+# where a reference goes in a template
+PLACEHOLDER = "\0"
+
+# how many different paragraphs of prose there are
+TEMPLATES = 500
+
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parseSize(size: str) -> int:
+    """Turn sizes like 1K, 64M or 1G into numbers of bytes."""
+    match = re.fullmatch(r"(\d+)([KMG]?)B?", size.strip().upper())
+    if not match:
+        raise ValueError(f"Not a size: {size!r}")
+    return int(match.group(1)) * SIZE_SUFFIXES[match.group(2)]
+
+
+def formatReference(style, owner, repository, number):
+    if style == "number":
+        return f"#{number}"
+    if style == "gh":
+        return f"GH-{number}"
+    if style == "url":
+        return f"https://github.com/{owner}/{repository}/issues/{number}"
+    return f"{owner}/{repository}#{number}"
+
+
+class CorpusGenerator:
+    """Makes Markdown with about `density` references per kilobyte.
+
+    `duplicates` is the fraction of references to an issue that has already been referenced.
+    References to other repositories are spelled out. References to the default repository,
+    octo/widgets, are often just #123 or GH-123, so expand with --default-source octo/widgets.
+    `code` is the fraction of paragraphs that are code blocks, or have their references in code spans
+    and links, where they shouldn't be expanded. The same seed always gives the same text."""
+
+    def __init__(self, density=5.0, duplicates=0.5, seed=0, code=0.0):
+        self.density = density
+        self.duplicates = duplicates
+        self.code = code
+        self.random = random.Random(seed)
+        self.seen = []
+        self.next_number = 1
+        self.references = 0
+        # Making up prose word by word is slow, so reuse some, with new references in it each time.
+        self.templates = [self._template() for _ in range(TEMPLATES)]
+
+    def reference(self) -> str:
+        rng = self.random
+        self.references += 1
+        if self.seen and rng.random() < self.duplicates:
+            owner, repository, number = rng.choice(self.seen)
+        else:
+            if rng.random() < 0.7:
+                owner, repository = OWNER, REPOSITORY
+            else:
+                owner, repository = rng.choice(OTHER_REPOSITORIES)
+            number = self.next_number
+            self.next_number += 1
+            self.seen.append((owner, repository, number))
+        if (owner, repository) == (OWNER, REPOSITORY):
+            style = rng.choice(("number", "number", "gh", "url", "full"))
+        else:
+            style = rng.choice(("url", "full", "full"))
+        return formatReference(style, owner, repository, number)
+
+    def _template(self) -> list:
+        """A heading, list or paragraph of prose, split where references go."""
+        rng = self.random
+        # each word is about 6 bytes, so this is the chance a word is followed by a reference
+        chance = min(self.density * 6 / 1024, 1.0)
+        words = []
+        for _ in range(rng.randint(20, 120)):
+            words.append(rng.choice(WORDS))
+            if rng.random() < chance:
+                words.append(PLACEHOLDER)
+        # (only ask for another random number with code, so corpora without it stay the same)
+        if self.code and rng.random() < self.code:
+            return self._codeTemplate(words)
+        kind = rng.random()
+        if kind < 0.1:
+            text = "## " + " ".join(words[:8]).capitalize() + "\n\n"
+        elif kind < 0.4:
+            text = "\n".join(
+                "- " + " ".join(words[start : start + 12]) for start in range(0, len(words), 12)
+            )
+            text += "\n\n"
+        else:
+            text = " ".join(words).capitalize() + "."
+            # wrap at about 80 columns, like most Markdown
+            lines, line, width = [], [], 0
+            for word in text.split(" "):
+                if line and width + len(word) > 80:
+                    lines.append(" ".join(line))
+                    line, width = [], 0
+                line.append(word)
+                width += len(word) + 1
+            lines.append(" ".join(line))
+            text = "\n".join(lines) + "\n\n"
+        return text.split(PLACEHOLDER)
+
+    def _codeTemplate(self, words) -> list:
+        """A code block, or a paragraph with its references in code spans and links, split where references go."""
+        rng = self.random
+        if rng.random() < 0.5:
+            lines = [" ".join(words[start : start + 10]) for start in range(0, len(words), 10)]
+            text = "```\n" + "\n".join("# " + line for line in lines) + "\n```\n\n"
+        else:
+            pieces = []
+            for word in words:
+                if word != PLACEHOLDER:
+                    pieces.append(word)
+                elif rng.random() < 0.5:
+                    pieces.append(f"`{PLACEHOLDER}`")
+                else:
+                    # like a reference we expanded before
+                    url = f"https://github.com/{OWNER}/{REPOSITORY}/issues/{rng.randint(1, 1000)}"
+                    pieces.append(f"[{rng.choice(WORDS)} {PLACEHOLDER}]({url})")
+            text = " ".join(pieces).capitalize() + ".\n\n"
+        return text.split(PLACEHOLDER)
+
+    def paragraph(self) -> str:
+        """A heading, list or paragraph of prose, with references sprinkled in."""
+        parts = self.random.choice(self.templates)
+        pieces = [parts[0]]
+        for part in parts[1:]:
+            pieces.append(self.reference())
+            pieces.append(part)
+        return "".join(pieces)
+
+    def write(self, f, size: int) -> int:
+        """Write size bytes of Markdown to the text file f, and return how many that was."""
+        written = 0
+        while written < size:
+            paragraph = self.paragraph()
+            if written + len(paragraph) > size:
+                # end on a whole word, and pad to exactly size with newlines
+                paragraph = paragraph[: size - written]
+                paragraph = paragraph[: paragraph.rfind(" ") + 1]
+                paragraph += "\n" * (size - written - len(paragraph))
+            f.write(paragraph)
+            written += len(paragraph)
+        return written
+
+
+def generateCorpus(path, size: int, density=5.0, duplicates=0.5, seed=0, code=0.0) -> dict:
+    """Write a corpus of size bytes to path, returning a description of it.
+
+    The reference counts are of references generated, a few of which may have been cut off the end."""
+    generator = CorpusGenerator(density, duplicates, seed, code)
+    with open(path, "w", encoding="ascii", newline="\n") as f:
+        generator.write(f, size)
+    return {
+        "bytes": size,
+        "density": density,
+        "duplicates": duplicates,
+        "seed": seed,
+        "code": code,
+        "references": generator.references,
+        "unique_references": len(generator.seen),
+    }
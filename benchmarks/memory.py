@@ -0,0 +1,49 @@
+"""How much memory looked up issues take to keep, as Issues, or as the whole JSON GitHub sends, like we used to."""
+import json
+from email.message import Message
+
+from benchmarks.corpus import OWNER, REPOSITORY
+
+# what to keep of each issue
+KINDS = ("json", "issues")
+
+
+def issueJSON(number: int, body_size: int) -> bytes:
+    """Return an answer like GitHub's to a request for an issue, with a body of about body_size characters."""
+    html_url = f"https://github.com/{OWNER}/{REPOSITORY}/issues/{number}"
+    user = {"login": "octocat", "id": 1, "avatar_url": "https://github.com/images/error/octocat_happy.gif"}
+    return json.dumps(
+        {
+            "url": f"https://api.github.com/repos/{OWNER}/{REPOSITORY}/issues/{number}",
+            "html_url": html_url,
+            "id": 1000000 + number,
+            "number": number,
+            "title": f"Issue {number} in {OWNER}/{REPOSITORY}",
+            "user": user,
+            "labels": [{"id": 208045946, "name": "bug", "color": "f29513", "default": True}],
+            "state": "open",
+            "assignees": [user],
+            "comments": number % 17,
+            "created_at": "2011-04-22T13:33:48Z",
+            "updated_at": "2011-04-22T13:33:48Z",
+            "body": (f"Issue {number} is about this. " * (body_size // 20 + 1))[:body_size],
+            "reactions": {"total_count": 0, "+1": 0, "-1": 0, "laugh": 0, "heart": 0, "hooray": 0},
+        }
+    ).encode("utf-8")
+
+
+def keepIssues(kind: str, count: int, body_size: int) -> dict:
+    """Read count answers from GitHub, keeping what kind says of each, like getIssue's memo does."""
+    from issue_expander import expander
+    from issue_expander.client import Response
+
+    kept = {}
+    for number in range(1, count + 1):
+        body = issueJSON(number, body_size)
+        key = (OWNER, REPOSITORY, number)
+        if kind == "json":
+            kept[key] = json.loads(body)
+        else:
+            response = Response(200, Message(), body, "")
+            kept[key] = expander.readIssueResponse(None, *key, None, None, response)
+    return kept
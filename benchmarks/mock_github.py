@@ -0,0 +1,188 @@
+"""A stand-in for api.github.com, served locally, with as much latency, failure and rate limiting as you like."""
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ISSUE_PATH = re.compile(r"/repos/([^/]+)/([^/]+)/issues/(\d+)")
+
+
+class MockGitHub:
+    """Answers issue lookups (REST and GraphQL) for every issue, like a GitHub where everything exists.
+
+    - latency: seconds to wait before answering each request
+    - error_rate: the fraction of requests answered with a 502
+    - rate_limit: how many requests are allowed per rate_limit_window seconds, or None for no limit
+    - missing: issue numbers at or above this are 404s
+    - certfile and keyfile: serve HTTPS with this certificate, instead of HTTP
+
+    Use it as a context manager. While it's running, its base URL is in .url."""
+
+    def __init__(
+        self,
+        latency=0.0,
+        error_rate=0.0,
+        rate_limit=None,
+        rate_limit_window=60,
+        missing=None,
+        certfile=None,
+        keyfile=None,
+        seed=None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.missing = missing
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._remaining = rate_limit
+        self._reset_at = time.time() + rate_limit_window
+        self._server = None
+        self.url = None
+
+    def resetCounts(self):
+        with self._lock:
+            self.requests = self.errors = self.rate_limited = self.not_modified = 0
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "not_modified": self.not_modified,
+            }
+
+    def _admit(self):
+        """Count a request, and return (status to fail it with or None, rate limit headers)."""
+        with self._lock:
+            self.requests += 1
+            headers = {}
+            if self.rate_limit is not None:
+                now = time.time()
+                if now >= self._reset_at:
+                    self._remaining = self.rate_limit
+                    self._reset_at = now + self.rate_limit_window
+                headers = {
+                    "X-RateLimit-Limit": self.rate_limit,
+                    "X-RateLimit-Remaining": max(self._remaining - 1, 0),
+                    "X-RateLimit-Reset": int(self._reset_at),
+                }
+                if self._remaining <= 0:
+                    self.rate_limited += 1
+                    return 403, headers
+                self._remaining -= 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return 502, headers
+        return None, headers
+
+    def _issue(self, owner, repository, number):
+        if self.missing is not None and number >= self.missing:
+            return None
+        return {
+            "html_url": f"https://github.com/{owner}/{repository}/issues/{number}",
+            "title": f"Issue {number} in {owner}/{repository}",
+            "number": number,
+        }
+
+    def _answerGraphQL(self, query):
+        data = {}
+        repositories = list(re.finditer(r'(\w+): repository\(owner: ("[^"]*"), name: ("[^"]*")\)', query))
+        for n, repository in enumerate(repositories):
+            end = repositories[n + 1].start() if n + 1 < len(repositories) else len(query)
+            owner, name = json.loads(repository.group(2)), json.loads(repository.group(3))
+            found = data[repository.group(1)] = {}
+            for issue in re.finditer(
+                r"(\w+): issueOrPullRequest\(number: (\d+)\)", query[repository.end() : end]
+            ):
+                known = self._issue(owner, name, int(issue.group(2)))
+                found[issue.group(1)] = (
+                    {"url": known["html_url"], "title": known["title"]} if known else None
+                )
+        return {"data": data}
+
+    def __enter__(self):
+        github = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, so without this, Nagle's algorithm and
+            # delayed ACKs add tens of milliseconds to every response, and that's all we'd measure.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, headers = github._admit()
+                if github.latency:
+                    time.sleep(github.latency)
+                if status:
+                    self.reply(status, {"message": "Nope"}, headers)
+                    return
+                match = ISSUE_PATH.fullmatch(self.path.split("?")[0])
+                issue = match and github._issue(match.group(1), match.group(2), int(match.group(3)))
+                if not issue:
+                    self.reply(404, {"message": "Not Found"}, headers)
+                    return
+                etag = f'"{match.group(1)}/{match.group(2)}/{match.group(3)}"'
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    with github._lock:
+                        github.not_modified += 1
+                    self.reply(304, None, headers)
+                    return
+                self.reply(200, dict(issue, body="A long description... " * 50), headers)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                status, headers = github._admit()
+                if github.latency:
+                    time.sleep(github.latency)
+                if status:
+                    self.reply(status, {"message": "Nope"}, headers)
+                elif self.path != "/graphql":
+                    self.reply(404, {"message": "Not Found"}, headers)
+                else:
+                    self.reply(200, github._answerGraphQL(json.loads(body)["query"]), headers)
+
+            def reply(self, status, j, headers):
+                body = json.dumps(j).encode("utf-8") if j is not None else b""
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, str(value))
+                if j is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        scheme = "http"
+        if self.certfile:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            scheme = "https"
+        threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        ).start()
+        self.url = f"{scheme}://127.0.0.1:{self._server.server_address[1]}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,523 @@
+"""Run issue-expander against a local mock GitHub, and record how it does.
+
+Each measurement runs in its own process, so peak RSS belongs to that measurement alone."""
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from functools import partial
+from pathlib import Path
+
+import click
+
+from benchmarks.corpus import OWNER, REPOSITORY, generateCorpus, parseSize
+from benchmarks.mock_github import MockGitHub
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TARGETS = ("cli", "expandRefsToMarkdown")
+
+# mock GitHub doesn't check tokens, but GraphQL lookups need one
+TOKEN = "benchmark"
+
+
+def peakRSS():
+    """Return this process's peak resident set size, in kilobytes, or None if we can't tell."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measureTarget(
+    target, corpus, api_url, cache_dir, concurrency, use_graphql, min_interval, cafile, markdown=True
+) -> dict:
+    """Expand corpus with target, talking to api_url, and return what happened."""
+    import ssl
+
+    from issue_expander import cache, client, expander, graphql, ratelimit
+
+    expander.API_URL = api_url
+    graphql.GRAPHQL_URL = api_url + "/graphql"
+    shared_client = client.sharedClient()
+    if cafile:
+        shared_client._ssl_context = ssl.create_default_context(cafile=cafile)
+    # The CLI makes its own rate limiter, so change the default pacing for every one.
+    ratelimit.RateLimiter = partial(ratelimit.RateLimiter, min_interval=min_interval)
+    shared_client.rate_limiter = ratelimit.RateLimiter()
+
+    cache_counts = {"lookups": 0, "hits": 0}
+    get, isFresh = cache.IssueCache.get, cache.IssueCache.isFresh
+
+    def countingGet(self, *args):
+        cache_counts["lookups"] += 1
+        return get(self, *args)
+
+    def countingIsFresh(self, entry):
+        fresh = isFresh(self, entry)
+        cache_counts["hits"] += fresh
+        return fresh
+
+    cache.IssueCache.get, cache.IssueCache.isFresh = countingGet, countingIsFresh
+
+    start = time.perf_counter()
+    if target == "cli":
+        args = [str(corpus), "--default-source", f"{OWNER}/{REPOSITORY}", "-p", TOKEN]
+        args += ["--concurrency", str(concurrency)]
+        args += ["--cache-dir", str(cache_dir)] if cache_dir else ["--no-cache"]
+        if use_graphql:
+            args.append("--graphql")
+        if not markdown:
+            args.append("--plain-text")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            expander.cli.main(args, standalone_mode=False)
+    else:
+        with open(corpus) as f:
+            text = f.read()
+        issue_cache = cache.IssueCache(cache_dir) if cache_dir else None
+        with expander.useIssueCache(issue_cache):
+            expander.expandRefsToMarkdown(
+                text, TOKEN, OWNER, REPOSITORY, concurrency, use_graphql, markdown=markdown
+            )
+    wall_time = time.perf_counter() - start
+
+    return {
+        "wall_time": wall_time,
+        "cache_lookups": cache_counts["lookups"],
+        "cache_hits": cache_counts["hits"],
+        "cache_hit_ratio": cache_counts["hits"] / cache_counts["lookups"]
+        if cache_counts["lookups"]
+        else None,
+        "peak_rss_kb": peakRSS(),
+    }
+
+
+def measurementEnvironment() -> dict:
+    """Return the environment to measure in, where issue_expander and benchmarks are importable."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT / "src"), str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+
+def runMeasurement(github, target, corpus, cache_dir, options) -> dict:
+    """Measure target in a new process, against github, adding github's request counts."""
+    env = measurementEnvironment()
+    command = [sys.executable, "-m", "benchmarks", "measure", target, str(corpus), github.url]
+    command += [
+        "--concurrency",
+        str(options["concurrency"]),
+        "--min-interval",
+        str(options["min_interval"]),
+    ]
+    if cache_dir:
+        command += ["--cache-dir", str(cache_dir)]
+    if options["graphql"]:
+        command.append("--graphql")
+    if options["cafile"]:
+        command += ["--cafile", options["cafile"]]
+    if options["plain_text"]:
+        command.append("--plain-text")
+
+    github.resetCounts()
+    finished = subprocess.run(command, env=env, cwd=str(ROOT), stdout=subprocess.PIPE, check=True)
+    result = json.loads(finished.stdout)
+    result.update(github.counts())
+    return result
+
+
+def gitRevision():
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=str(ROOT),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group()
+def main():
+    """Benchmark issue-expander against a local mock GitHub."""
+
+
+@main.command()
+@click.option("--sizes", default="1K,64K,1M", show_default=True, help="Corpus sizes, like 1K,1M,1G.")
+@click.option("--density", type=float, default=5.0, show_default=True, help="References per kilobyte.")
+@click.option(
+    "--duplicates",
+    type=click.FloatRange(0, 1),
+    default=0.5,
+    show_default=True,
+    help="Fraction of references to issues referenced before.",
+)
+@click.option(
+    "--code",
+    type=click.FloatRange(0, 1),
+    default=0.0,
+    show_default=True,
+    help="Fraction of paragraphs with their references in code blocks, code spans and links.",
+)
+@click.option(
+    "--plain-text",
+    is_flag=True,
+    help="Expand references everywhere, code and links too, like before issue-expander understood Markdown.",
+)
+@click.option(
+    "--targets",
+    default=",".join(TARGETS),
+    show_default=True,
+    help="What to run: cli, expandRefsToMarkdown.",
+)
+@click.option(
+    "--latency", type=float, default=0.05, show_default=True, help="Seconds mock GitHub waits per request."
+)
+@click.option(
+    "--error-rate",
+    type=click.FloatRange(0, 1),
+    default=0.0,
+    show_default=True,
+    help="Fraction of requests that 502.",
+)
+@click.option(
+    "--rate-limit",
+    type=int,
+    default=None,
+    help="Requests allowed per --rate-limit-window. (Default: no limit)",
+)
+@click.option(
+    "--rate-limit-window",
+    type=float,
+    default=60,
+    show_default=True,
+    help="Seconds until the limit resets.",
+)
+@click.option("--concurrency", type=int, default=8, show_default=True)
+@click.option("--graphql", is_flag=True, help="Look up references with GraphQL.")
+@click.option("--no-cache", is_flag=True, help="Run without the on-disk issue cache.")
+@click.option(
+    "--repeat",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Runs per target, sharing a cache. The first is cold.",
+)
+@click.option(
+    "--min-interval",
+    type=float,
+    default=0.0,
+    show_default=True,
+    help="Seconds the rate limiter leaves between requests. 0 measures issue-expander, not its pacing.",
+)
+@click.option("--certfile", help="Serve HTTPS with this certificate (for 127.0.0.1) instead of HTTP.")
+@click.option("--keyfile", help="The private key for --certfile.")
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Where to write results. (Default: benchmarks/results/)",
+)
+def run(**options):
+    """Generate corpora, expand them, and write what happened as JSON."""
+    sizes = [parseSize(size) for size in options["sizes"].split(",")]
+    targets = options["targets"].split(",")
+    for target in targets:
+        if target not in TARGETS:
+            raise click.BadParameter(f"unknown target {target!r}", param_hint="--targets")
+    options["cafile"] = options["certfile"]
+
+    results = []
+    github = MockGitHub(
+        latency=options["latency"],
+        error_rate=options["error_rate"],
+        rate_limit=options["rate_limit"],
+        rate_limit_window=options["rate_limit_window"],
+        certfile=options["certfile"],
+        keyfile=options["keyfile"],
+        seed=options["seed"],
+    )
+    with github, tempfile.TemporaryDirectory(prefix="issue-expander-bench-") as scratch:
+        scratch = Path(scratch)
+        for size in sizes:
+            corpus = scratch / f"corpus-{size}.md"
+            description = generateCorpus(
+                corpus, size, options["density"], options["duplicates"], options["seed"], options["code"]
+            )
+            for target in targets:
+                cache_dir = None if options["no_cache"] else scratch / f"cache-{size}-{target}"
+                for n in range(options["repeat"]):
+                    result = dict(target=target, run=n, corpus=description)
+                    result.update(runMeasurement(github, target, corpus, cache_dir, options))
+                    results.append(result)
+                    click.echo(
+                        f"{target:>20} {size:>12,} bytes  run {n}: {result['wall_time']:8.3f}s "
+                        f"{result['requests']:7,} requests  peak RSS {result['peak_rss_kb'] or 0:9,} KB",
+                        err=True,
+                    )
+            corpus.unlink()
+
+    output = options.pop("output")
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = ROOT / "benchmarks" / "results" / f"{stamp}.json"
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_revision": gitRevision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+    }
+    output.write_text(json.dumps({"meta": meta, "results": results}, indent=2) + "\n")
+    click.echo(f"Wrote {output}", err=True)
+
+
+@main.command(hidden=True)
+@click.argument("target", type=click.Choice(TARGETS))
+@click.argument("corpus")
+@click.argument("api_url")
+@click.option("--cache-dir")
+@click.option("--concurrency", type=int, default=8)
+@click.option("--graphql", "use_graphql", is_flag=True)
+@click.option("--min-interval", type=float, default=0.0)
+@click.option("--cafile")
+@click.option("--plain-text", is_flag=True)
+def measure(target, corpus, api_url, cache_dir, concurrency, use_graphql, min_interval, cafile, plain_text):
+    """Measure one run, printing the result as JSON. (run uses this.)"""
+    result = measureTarget(
+        target, corpus, api_url, cache_dir, concurrency, use_graphql, min_interval, cafile, not plain_text
+    )
+    print(json.dumps(result))
+
+
+@main.command("worst-case")
+@click.option("--sizes", default="16K,64K,256K,1M", show_default=True, help="Input sizes, like 1K,1M.")
+@click.option(
+    "--old",
+    is_flag=True,
+    help="Time the regex references used to be found with too. It's very slow, so keep the sizes small.",
+)
+def worstCase(sizes, old):
+    """Time finding references in inputs made to be slow to scan, like long hashes and base64 blobs."""
+    from benchmarks.worst_case import INPUTS, timeScan
+
+    sizes = [parseSize(size) for size in sizes.split(",")]
+    click.echo(
+        f"{'input':>14} {'characters':>12} {'seconds':>10}" + (f" {'old seconds':>12}" if old else "")
+    )
+    for name, make in INPUTS.items():
+        for size in sizes:
+            text = make(size)
+            line = f"{name:>14} {len(text):>12,} {timeScan(text):10.4f}"
+            if old:
+                line += f" {timeScan(text, old=True):12.4f}"
+            click.echo(line)
+
+
+@main.command()
+@click.option("--issues", type=int, default=50000, show_default=True, help="How many issues to keep.")
+@click.option(
+    "--body-size", default="2K", show_default=True, help="How long each issue's body is, like 2K."
+)
+def memory(issues, body_size):
+    """Compare the memory it takes to keep looked up issues as Issues, and as GitHub's whole answers."""
+    from benchmarks.memory import KINDS
+
+    click.echo(f"{'kept as':>10} {'issues':>10} {'RSS KB':>12} {'bytes per issue':>16}")
+    for kind in KINDS:
+        command = [sys.executable, "-m", "benchmarks", "measure-memory", kind, str(issues), body_size]
+        finished = subprocess.run(
+            command, env=measurementEnvironment(), cwd=str(ROOT), stdout=subprocess.PIPE, check=True
+        )
+        rss_kb = json.loads(finished.stdout)["rss_kb"]
+        if rss_kb is None:
+            raise click.ClickException("Unable to measure RSS on this platform.")
+        click.echo(f"{kind:>10} {issues:>10,} {rss_kb:>12,} {rss_kb * 1024 // max(issues, 1):>16,}")
+
+
+@main.command("measure-memory", hidden=True)
+@click.argument("kind")
+@click.argument("issues", type=int)
+@click.argument("body_size")
+def measureMemory(kind, issues, body_size):
+    """Keep issues, printing how much peak RSS grew as JSON. (memory uses this.)"""
+    from benchmarks.memory import keepIssues
+
+    before = peakRSS()
+    kept = keepIssues(kind, issues, parseSize(body_size))
+    after = peakRSS()
+    print(json.dumps({"issues": len(kept), "rss_kb": None if before is None else after - before}))
+
+
+@main.command()
+@click.option(
+    "--runs", type=click.IntRange(min=1), default=20, show_default=True, help="Cold starts to time."
+)
+@click.option(
+    "--executable",
+    multiple=True,
+    help="Time this issue-expander too, like the one `pyoxidizer build` makes in build/. Can be given more than "
+    "once.",
+)
+@click.option(
+    "--top", type=int, default=15, show_default=True, help="How many of the slowest imports to show."
+)
+def startup(runs, executable, top):
+    """Time issue-expander starting up and expanding input with no references, and show what it imports."""
+    from benchmarks.startup import PYTHON_COMMAND, coldStarts, importTimes
+
+    with tempfile.TemporaryDirectory() as cache_home:
+        env = measurementEnvironment()
+        env["XDG_CACHE_HOME"] = cache_home
+        commands = [("python -m issue_expander", PYTHON_COMMAND)] + [(path, [path]) for path in executable]
+        click.echo(f"{'command':>40} {'median':>10} {'min':>10} {'max':>10}")
+        for name, command in commands:
+            # once to create the issue cache, so it isn't counted
+            coldStarts(command, ["-"], 1, env)
+            seconds = coldStarts(command, ["-"], runs, env)
+            click.echo(
+                f"{name[-40:]:>40} {seconds['median']:9.3f}s {seconds['min']:9.3f}s {seconds['max']:9.3f}s"
+            )
+
+        times = importTimes(PYTHON_COMMAND, ["-"], env)
+    total = sum(self_us for _, self_us, _, _ in times)
+    click.echo(
+        f"\nImported {len(times)} modules in {total / 1000:.1f}ms. The slowest, with what they imported:"
+    )
+    for module, self_us, cumulative_us, depth in sorted(times, key=lambda t: -t[2])[:top]:
+        click.echo(f"{cumulative_us / 1000:8.1f}ms {self_us / 1000:8.1f}ms  {'  ' * depth}{module}")
+
+
+@main.command("list-refs")
+@click.option(
+    "--size", default="256M", show_default=True, help="How big a corpus to list the references in."
+)
+@click.option(
+    "--jobs",
+    default=",".join(str(n) for n in (1, 2, 4, 8, 16, 32) if n <= (os.cpu_count() or 1)),
+    help="Numbers of processes to list them with, like 1,2,4. (Default: powers of two up to one per CPU)",
+)
+def listRefs(size, jobs):
+    """Time --list-refs on a generated corpus with more and more processes."""
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Path(directory) / "corpus.md"
+        description = generateCorpus(corpus, parseSize(size), code=0.1)
+        click.echo(f"{description['references']:,} references in {description['bytes']:,} bytes")
+        click.echo(f"{'jobs':>6} {'seconds':>10} {'MB/s':>10} {'speedup':>8}")
+        first = None
+        for n in jobs.split(","):
+            command = [sys.executable, "-m", "issue_expander", "--list-refs", "--jobs", n, str(corpus)]
+            start = time.perf_counter()
+            subprocess.run(command, env=measurementEnvironment(), stdout=subprocess.DEVNULL, check=True)
+            seconds = time.perf_counter() - start
+            first = first or seconds
+            click.echo(
+                f"{n:>6} {seconds:10.3f} {description['bytes'] / seconds / 1024**2:10.1f} {first / seconds:7.2f}x"
+            )
+
+
+@main.command()
+@click.option("--size", default="64M", show_default=True, help="How big a corpus to expand.")
+@click.option(
+    "--density",
+    default="0.05,5",
+    show_default=True,
+    help="Reference densities, in references per kilobyte, to generate corpora with, like 0.05,5.",
+)
+def throughput(size, density):
+    """Compare expanding a single input as text, with expandStream, and as bytes, with rewrite.expandBytes, from a
+    file, which is memory-mapped, and streamed, like stdin, in MB/s.
+
+    Lookups are answered at once, without any GitHub, so this measures scanning and rewriting, and nothing else.
+    Last, it's all done again with an input without any whitespace to end chunks at."""
+    from issue_expander import cache, expander, rewrite
+
+    def fakeIssue(owner, repository, number, token):
+        return cache.Issue(f"Issue {number}", f"https://github.com/{owner}/{repository}/issues/{number}")
+
+    expander.getIssue = fakeIssue
+
+    def expandText(corpus, markdown):
+        with open(corpus, encoding="utf-8", newline="") as f, open(os.devnull, "w") as devnull:
+            expander.expandStream(f, devnull, None, OWNER, REPOSITORY, markdown=markdown)
+
+    def expandBytes(corpus, markdown):
+        with open(corpus, "rb") as f, open(os.devnull, "wb") as devnull:
+            rewrite.expandBytes(f, devnull, None, OWNER, REPOSITORY, markdown=markdown)
+
+    def streamBytes(corpus, markdown):
+        with open(corpus, "rb") as f, open(os.devnull, "wb") as devnull:
+            # without a fileno, so it isn't memory-mapped
+            rewrite.expandBytes(
+                types.SimpleNamespace(read=f.read), devnull, None, OWNER, REPOSITORY, markdown=markdown
+            )
+
+    def withoutWhitespace(corpus, size):
+        with open(corpus, "wb") as f:
+            for written in range(0, size, 1024**2):
+                f.write(b"x" * min(1024**2, size - written))
+        return {"bytes": os.path.getsize(corpus)}
+
+    paths = {"text": expandText, "bytes": expandBytes, "stream": streamBytes}
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Path(directory) / "corpus.md"
+        click.echo(f"{'density':>8} {'mode':>10} {'path':>6} {'seconds':>10} {'MB/s':>10} {'speedup':>8}")
+        for references_per_kb in density.split(",") + ["no space"]:
+            if references_per_kb == "no space":
+                description = withoutWhitespace(corpus, parseSize(size))
+            else:
+                description = generateCorpus(
+                    corpus, parseSize(size), density=float(references_per_kb), code=0.1
+                )
+            for markdown in (True, False):
+                first = None
+                for name, expand in paths.items():
+                    start = time.perf_counter()
+                    expand(corpus, markdown)
+                    seconds = time.perf_counter() - start
+                    first = first or seconds
+                    click.echo(
+                        f"{references_per_kb:>8} {'markdown' if markdown else 'plain':>10} {name:>6} {seconds:10.3f}"
+                        f" {description['bytes'] / seconds / 1024**2:10.1f} {first / seconds:7.2f}x"
+                    )
+
+
+@main.command()
+@click.argument("before", type=click.File("r"))
+@click.argument("after", type=click.File("r"))
+def compare(before, after):
+    """Compare two runs' results, side by side."""
+    before, after = json.load(before)["results"], json.load(after)["results"]
+
+    def key(result):
+        return (result["target"], result["corpus"]["bytes"], result["run"])
+
+    earlier = {key(result): result for result in before}
+    click.echo(f"{'target':>20} {'bytes':>12} run {'wall time':>20} {'requests':>16} {'peak RSS KB':>24}")
+    for result in after:
+        old = earlier.get(key(result))
+        if old is None:
+            continue
+        ratio = result["wall_time"] / old["wall_time"] if old["wall_time"] else float("inf")
+        click.echo(
+            f"{result['target']:>20} {result['corpus']['bytes']:>12,} {result['run']:>3} "
+            f"{old['wall_time']:7.3f}→{result['wall_time']:7.3f}s ({ratio:4.2f}x) "
+            f"{old['requests']:7,}→{result['requests']:<7,} "
+            f"{old['peak_rss_kb'] or 0:10,}→{result['peak_rss_kb'] or 0:<10,}"
+        )
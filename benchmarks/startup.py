@@ -0,0 +1,51 @@
+"""How long issue-expander takes to start, and what it imports along the way."""
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# a line of python -X importtime's output: microseconds for the module itself, and with what it imported
+_import_time = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+# input that's typical of what a pre-commit hook sees: no references at all
+NO_REFERENCES = "Nothing to see here, just words and `code`.\n" * 200
+
+PYTHON_COMMAND = [sys.executable, "-m", "issue_expander"]
+
+
+def importTimes(command, args, env=None) -> list:
+    """Run a Python command with -X importtime, returning (module, microseconds, cumulative microseconds, depth)
+    for every module it imported, in the order they finished importing."""
+    finished = subprocess.run(
+        [command[0], "-X", "importtime"] + command[1:] + args,
+        input=NO_REFERENCES.encode("utf-8"),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    times = []
+    for line in finished.stderr.decode("utf-8").splitlines():
+        match = _import_time.match(line)
+        if match:
+            times.append(
+                (match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2)
+            )
+    return times
+
+
+def coldStarts(command, args, runs: int, env=None) -> dict:
+    """Run command with args runs times, each expanding NO_REFERENCES, and return how long they took, in seconds."""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            command + args,
+            input=NO_REFERENCES.encode("utf-8"),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        seconds.append(time.perf_counter() - start)
+    return {"median": statistics.median(seconds), "min": min(seconds), "max": max(seconds)}
@@ -0,0 +1,50 @@
+"""Inputs that are as hard as we know how to make them for finding references in, and timing it."""
+import base64
+import random
+import re
+import time
+
+from issue_expander.expander import findRefs
+
+# how references were found before issue_expander.references, for comparison
+OLD_MEGAREGEX = re.compile(
+    "|".join(
+        [
+            r"https://github.com/(?P<owner_x>[a-zA-Z0-9.-]+)/(?P<repository_x>[a-zA-Z0-9.-]+)/(issues|pull)/"
+            r"(?P<number_x>\d+)",
+            r"(?<![a-zA-Z0-9#-])#(?P<number_y>\d+)(?![a-zA-Z0-9#])",
+            r"\bGH-(?P<number_z>\d+)",
+            r"(?P<owner_n>[a-zA-Z0-9.-]+)/(?P<repository_n>[a-zA-Z0-9.-]+)#(?P<number_n>\d+)",
+        ]
+    )
+)
+
+
+def _base64(size):
+    rng = random.Random(0)
+    return base64.b64encode(bytes(rng.getrandbits(8) for _ in range(size * 3 // 4))).decode()[:size]
+
+
+# name -> function making an input of about size characters
+INPUTS = {
+    # a long hash, or a line of minified JavaScript
+    "run": lambda size: "a" * size,
+    "base64": _base64,
+    # runs that each look like they might be an owner, or a repository, but aren't
+    "owners": lambda size: ("a" * 1000 + "/") * (size // 1001),
+    "repositories": lambda size: "/" + "a" * (size - 1),
+    "gh": lambda size: "GH-" * (size // 3),
+    "hashes": lambda size: "#" * size,
+    "slashes": lambda size: "a/" * (size // 2),
+}
+
+
+def timeScan(text: str, old: bool = False) -> float:
+    """Return how many seconds it takes to find the references in text, the old way or the new."""
+    start = time.perf_counter()
+    if old:
+        for _ in OLD_MEGAREGEX.finditer(text):
+            pass
+    else:
+        findRefs(text, "foo", "bar")
+    return time.perf_counter() - start
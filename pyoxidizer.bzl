@@ -15,7 +15,7 @@ def make_exe():
 
     python_config = dist.make_python_interpreter_config()
 
-    python_config.run_module = "issue-expander"
+    python_config.run_module = "issue_expander"
 
     exe = dist.to_python_executable(
         name="issue-expander",
@@ -0,0 +1,374 @@
+"""Expand issue references from asyncio code, like an async web service, without blocking its event loop.
+
+    text = await aio.expandRefsToMarkdownAsync(text, token, "foo", "bar")
+
+Lookups go through the same issue cache as the rest of issue-expander, and the same rate limiter."""
+import asyncio
+import http.client
+import sys
+import time
+import weakref
+from email.parser import BytesParser
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from issue_expander import client, expander, stats
+from issue_expander.markdown import proseRegions
+from issue_expander.ratelimit import MAX_RETRIES, RateLimitExceeded
+
+# What can go wrong talking to a server, short of it answering with an error status.
+CONNECTION_ERRORS = (OSError, EOFError, ValueError, asyncio.LimitOverrunError, asyncio.TimeoutError)
+
+
+async def readResponse(reader: asyncio.StreamReader, method: str = "GET"):
+    """Read one HTTP/1.x response from reader.
+
+    Returns (status, headers, body, will_close), where will_close says the connection can't be reused."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, _, header_block = head.partition(b"\r\n")
+    version, status = status_line.decode("iso-8859-1").split(" ", 2)[:2]
+    status = int(status)
+    headers = BytesParser(_class=http.client.HTTPMessage).parsebytes(header_block)
+
+    connection = (headers.get("Connection") or "").lower()
+    will_close = connection == "close" or (version == "HTTP/1.0" and connection != "keep-alive")
+
+    if (
+        method == "HEAD"
+        or status in (204, 304)
+        or 100 <= status < 200
+        or (method == "CONNECT" and status == 200)
+    ):
+        body = b""
+    elif "chunked" in (headers.get("Transfer-Encoding") or "").lower():
+        body = await _readChunked(reader)
+    elif headers.get("Content-Length") is not None:
+        body = await reader.readexactly(int(headers["Content-Length"]))
+    else:
+        # The body runs until the server closes the connection.
+        body = await reader.read()
+        will_close = True
+    return status, headers, body, will_close
+
+
+async def _readChunked(reader):
+    chunks = []
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+        if size == 0:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)  # the CRLF after each chunk
+    # skip any trailers, up to the blank line that ends the response
+    while await reader.readuntil(b"\r\n") != b"\r\n":
+        pass
+    return b"".join(chunks)
+
+
+class AsyncHTTPClient:
+    """Makes HTTP/1.1 requests from asyncio over a pool of keep-alive connections per host, like HTTPClient.
+
+    Its connections belong to the event loop they were opened in, so use one client per loop. Connecting, or
+    waiting for a response, for longer than timeout seconds raises asyncio.TimeoutError."""
+
+    def __init__(
+        self,
+        max_idle_connections=client.DEFAULT_MAX_IDLE_CONNECTIONS,
+        rate_limiter=None,
+        ssl_context=None,
+        timeout=client.DEFAULT_TIMEOUT,
+    ):
+        self.max_idle_connections = max_idle_connections
+        self.rate_limiter = rate_limiter
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self._idle = {}
+
+    async def _connect(self, scheme, netloc):
+        parts = urlsplit(f"//{netloc}")
+        if scheme not in ("https", "http"):
+            raise ValueError(f"Unsupported URL scheme {scheme!r}")
+        ssl_context = None
+        if scheme == "https":
+            # Loading the CA bundle is slow, so share the shared client's SSL context unless we were given one.
+            ssl_context = self.ssl_context or client.sharedClient().sslContext
+        port = parts.port or (443 if scheme == "https" else 80)
+        proxy = client.proxyFor(scheme, netloc)
+        if proxy is None:
+            return await asyncio.open_connection(parts.hostname, port, ssl=ssl_context)
+
+        reader, writer = await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+        if scheme == "http":
+            return reader, writer
+        # Tunnel through the proxy, like HTTPClient does, and talk TLS to GitHub through that.
+        try:
+            lines = [f"CONNECT {parts.hostname}:{port} HTTP/1.1", f"Host: {parts.hostname}:{port}"]
+            lines.extend(f"{name}: {value}" for name, value in client.proxyHeaders(proxy).items())
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1"))
+            await writer.drain()
+            status, _, _, _ = await readResponse(reader, "CONNECT")
+            if status != 200:
+                raise OSError(f"Tunnel connection failed: {status}")
+            if hasattr(writer, "start_tls"):
+                await writer.start_tls(ssl_context, server_hostname=parts.hostname)
+            else:  # pragma: no cover
+                # Before Python 3.11, streams can't start TLS themselves.
+                loop = asyncio.get_running_loop()
+                protocol = writer.transport.get_protocol()
+                transport = await loop.start_tls(
+                    writer.transport, protocol, ssl_context, server_hostname=parts.hostname
+                )
+                writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    def _checkin(self, host, connection):
+        idle = self._idle.setdefault(host, [])
+        if len(idle) < self.max_idle_connections:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def _send(self, method, url, headers, body) -> client.Response:
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        proxy = parts.scheme == "http" and client.proxyFor(*host)
+        if proxy:
+            # Through a proxy, plain HTTP requests are for the whole URL.
+            path = urlunsplit(parts._replace(fragment=""))
+            headers = dict(headers, **client.proxyHeaders(proxy))
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}", "Accept-Encoding: identity"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + (body or b"")
+
+        idle = self._idle.get(host)
+        reused = bool(idle)
+        try:
+            # One timeout for the lot, since cancelling asyncio.wait_for just as what it waits on finishes
+            # loses the cancellation, before Python 3.12.
+            reader, writer, response, elapsed = await asyncio.wait_for(
+                self._exchange(host, idle.pop() if reused else None, request, method), self.timeout
+            )
+        except CONNECTION_ERRORS as e:
+            # Like HTTPClient, a timeout isn't down to a stale connection, so don't wait all over again.
+            if not reused or isinstance(e, asyncio.TimeoutError):
+                raise
+            # The server closed the idle connection before we used it. Try once more, on a new one.
+            stats.count("http.stale_connections")
+            return await self._send(method, url, headers, body)
+        status, response_headers, data, will_close = response
+
+        client.countResponse(status, data, reused, elapsed)
+
+        if will_close:
+            writer.close()
+        else:
+            self._checkin(host, (reader, writer))
+        return client.Response(status, response_headers, data, url)
+
+    async def _exchange(self, host, connection, request, method):
+        """Send request over connection, or a new one, and read the response.
+
+        Returns the connection's reader and writer, the response, and how long it took to come."""
+        reader, writer = connection or await self._connect(*host)
+        start = time.perf_counter()
+        try:
+            writer.write(request)
+            await writer.drain()
+            response = await readResponse(reader, method)
+        except BaseException:
+            # Failed, timed out, or cancelled partway through a response, so nobody else can use this connection.
+            writer.close()
+            raise
+        return reader, writer, response, time.perf_counter() - start
+
+    async def request(self, method: str, url: str, headers=None, body=None) -> client.Response:
+        """Make a request, following redirects and waiting on the rate limiter, like HTTPClient.request."""
+        headers = dict(headers or {})
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            if limiter is not None:
+                wait = limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            response = await self._follow(method, url, headers, body)
+            if limiter is None or attempt >= MAX_RETRIES or not limiter.update(response, attempt):
+                return response
+            attempt += 1
+
+    async def _follow(self, method, url, headers, body) -> client.Response:
+        for _ in range(client.MAX_REDIRECTS):
+            response = await self._send(method, url, headers, body)
+            location = response.headers.get("Location")
+            if response.status not in client.REDIRECT_CODES or not location:
+                return response
+            url = urljoin(url, location)
+            if response.status == 303:
+                method, body = "GET", None
+        return response
+
+    async def close(self):
+        """Close every idle connection."""
+        idle, self._idle = self._idle, {}
+        writers = [writer for connections in idle.values() for _, writer in connections]
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            await writer.wait_closed()
+
+
+class _LoopState:
+    """What the lookups running in one event loop share."""
+
+    def __init__(self):
+        self.client = AsyncHTTPClient(
+            rate_limiter=client.sharedClient().rate_limiter, timeout=client.sharedClient().timeout
+        )
+        # lookups in flight, so concurrent lookups of the same issue can share one request
+        self.lookups = {}
+
+
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def _loopState() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+async def getIssueAsync(owner: str, repository: str, number, token, semaphore=None):
+    """Look up an issue like getIssue does, without blocking the event loop, and sharing what getIssue remembers.
+
+    If the same issue is already being looked up, wait for that lookup instead of making another
+    request. With a semaphore, the request is only made while holding it."""
+    key = (owner, repository, number, token)
+    found, issue = expander.getIssue.recall(key)
+    if found:
+        expander.retry_queue.forget((owner, repository, number))
+        return issue
+
+    state = _loopState()
+    task = state.lookups.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetchIssue(state.client, owner, repository, number, token, semaphore))
+        state.lookups[key] = task
+        task.add_done_callback(lambda _: state.lookups.pop(key, None))
+    # If this caller is cancelled, other callers may still be waiting on the lookup, so leave it running.
+    return await asyncio.shield(task)
+
+
+def _prepareLookup(cache, owner, repository, number, token):
+    """Check the issue cache, like getIssue does. Returns (issue, entry, request), where request is the
+    (url, headers) to look the issue up with, or None if there's no need."""
+    issue, entry = expander.checkIssueCache(cache, owner, repository, number)
+    if issue is not None or expander.offline or expander.knownMissing(cache, owner, repository, number):
+        return issue, entry, None
+    return issue, entry, expander.issueRequest(owner, repository, number, token, entry, cache)
+
+
+async def _fetchIssue(http_client, owner, repository, number, token, semaphore):
+    # The issue cache is SQLite, which can block for a while, so it's only used from the default executor.
+    loop = asyncio.get_running_loop()
+    cache = expander.issue_cache
+    if expander.open_issue_cache is not None:
+        # and so is opening it.
+        cache = await loop.run_in_executor(None, expander.issueCache)
+    issue, entry, request = await loop.run_in_executor(
+        None, _prepareLookup, cache, owner, repository, number, token
+    )
+    if request is None:
+        expander.getIssue.remember((owner, repository, number, token), issue)
+        return issue
+
+    url, headers = request
+    try:
+        try:
+            if semaphore is None:
+                response = await http_client.request("GET", url, headers)
+            else:
+                async with semaphore:
+                    response = await http_client.request("GET", url, headers)
+        except RateLimitExceeded:
+            expander.reportRateLimited(token)
+            raise expander.LookupFailed(retry=False) from None
+        except CONNECTION_ERRORS as e:
+            # asyncio's timeouts don't say what happened.
+            print(
+                f"Unable to look up {owner}/{repository}#{number}: {str(e) or 'timed out'}", file=sys.stderr
+            )
+            raise expander.LookupFailed() from None
+        issue = await loop.run_in_executor(
+            None, expander.readIssueResponse, cache, owner, repository, number, token, entry, response
+        )
+    except expander.LookupFailed as e:
+        expander.lookupFailed(owner, repository, number, e)
+        return None
+    expander.retry_queue.forget((owner, repository, number))
+    expander.getIssue.remember((owner, repository, number, token), issue)
+
+    # Like getIssue, only the first time we find it's moved.
+    rename = entry is None and await loop.run_in_executor(
+        None, expander.possibleRename, cache, owner, repository, number, issue
+    )
+    if rename:
+        url, headers = expander.renameRequest(owner, repository, token)
+        try:
+            if semaphore is None:
+                response = await http_client.request("GET", url, headers)
+            else:
+                async with semaphore:
+                    response = await http_client.request("GET", url, headers)
+        except (RateLimitExceeded, *CONNECTION_ERRORS):
+            return issue
+        await loop.run_in_executor(
+            None, expander.readRenameResponse, cache, owner, repository, *rename, response
+        )
+    return issue
+
+
+async def resolveRefsAsync(keys, token=None, concurrency: int = expander.DEFAULT_CONCURRENCY) -> dict:
+    """Look up every key, with up to `concurrency` requests at once, like resolveRefs does."""
+    keys = list(keys)
+    semaphore = asyncio.Semaphore(concurrency)
+    issues = await asyncio.gather(*(getIssueAsync(*key, token, semaphore=semaphore) for key in keys))
+    issues = dict(zip(keys, issues))
+
+    retry, wait = expander.retry_queue.take(keys)
+    if retry:
+        stats.count("lookups.retried", len(retry))
+        await asyncio.sleep(wait)
+        issues.update(await resolveRefsAsync(retry, token, concurrency))
+    return issues
+
+
+async def expandRefsToMarkdownAsync(
+    text: str,
+    token: object = None,
+    default_owner: object = None,
+    default_repository: object = None,
+    concurrency: int = expander.DEFAULT_CONCURRENCY,
+    markdown: bool = True,
+) -> str:
+    """Expand references in text, like expandRefsToMarkdown does. It's safe to run many of these at once."""
+    regions = proseRegions(text) if markdown else None
+    keys = expander.findRefs(text, default_owner, default_repository, regions)
+    issues = await resolveRefsAsync(keys, token, concurrency)
+    return expander.substituteRefs(text, issues, default_owner, default_repository, regions)
+
+
+async def closeConnections():
+    """Close the connections lookups in the running event loop have kept open. Call it before the loop ends."""
+    state = _loop_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.client.close()
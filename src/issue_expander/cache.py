@@ -0,0 +1,470 @@
+"""An on-disk cache of issue lookups, so separate runs of issue-expander can share them.
+
+Runs can share it at the same time, too: it's in SQLite's write-ahead log mode, so reading doesn't wait for
+writing, and a run about to look an issue up claims it first, so others that want it too wait for the answer,
+instead of all asking GitHub for it at once."""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# How long, in seconds, a cached issue is used before we look it up again.
+DEFAULT_TTL = 24 * 60 * 60
+
+# How long, in seconds, we remember that an issue doesn't exist. It might be made soon, so not long.
+DEFAULT_MISSING_TTL = 60 * 60
+
+# How long, in seconds, we remember that an issue moved, or its repository was renamed. That rarely changes.
+DEFAULT_MOVED_TTL = 30 * 24 * 60 * 60
+
+# How many issues we keep before throwing away the least recently used ones.
+DEFAULT_MAX_ENTRIES = 50000
+
+# How long, in seconds, others wait for whoever claimed an issue to look it up, before doing it themselves.
+DEFAULT_CLAIM_TIMEOUT = 30
+
+# How often, in seconds, to check whether a claimed issue has been looked up yet.
+CLAIM_POLL_INTERVAL = 0.05
+
+# How long, in seconds, to wait for another run to finish writing to the cache.
+BUSY_TIMEOUT = 30
+
+CACHE_FILENAME = "issues.sqlite3"
+
+# The machine we're on, to tell which claims were made here, or None where we can't check whether the process
+# that made one is still running, as on Windows, where os.kill would kill it.
+_HOST = os.uname().nodename if hasattr(os, "uname") else None
+
+# Bump this when the table changes. Caches from other versions are thrown away and rebuilt.
+SCHEMA_VERSION = 2
+
+
+def defaultCacheDir() -> Path:
+    """Return the directory the cache lives in, following the XDG base directory spec."""
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base / "issue-expander"
+
+
+class Issue(NamedTuple):
+    """What we keep of an issue: just what it takes to link to it.
+
+    GitHub sends a lot more, like the issue's body, which can be huge, so we don't hang on to the rest."""
+
+    title: str
+    html_url: str
+
+
+class CacheEntry(NamedTuple):
+    title: str
+    html_url: str
+    fetched_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class IssueCache:
+    """Issue titles and URLs, stored in SQLite, keyed by (owner, repository, number).
+
+    Entries older than `ttl` seconds are stale, but they're kept around (along with their ETag and
+    Last-Modified validators, so they can be revalidated cheaply) until they are evicted, which
+    happens to the least recently used entries once there are more than `max_entries` of them. (So getting
+    an entry doesn't cost a write, when it was used is only written down when the cache evicts, or closes.)
+
+    Issues GitHub told us don't exist are remembered too, for `missing_ttl` seconds, and so are issues that
+    have moved, to another repository or because their repository was renamed, for `moved_ttl` seconds.
+
+    Before looking an issue up, claim it, and release it once it's cached. Other processes sharing the cache
+    then wait for it, rather than looking it up too, unless it's been claimed for `claim_timeout` seconds, or
+    the process that claimed it has exited, when they give up on whoever claimed it."""
+
+    def __init__(
+        self,
+        directory,
+        ttl=DEFAULT_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        clock=time.time,
+        missing_ttl=DEFAULT_MISSING_TTL,
+        claim_timeout=DEFAULT_CLAIM_TIMEOUT,
+        sleep=time.sleep,
+        moved_ttl=DEFAULT_MOVED_TTL,
+    ):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / CACHE_FILENAME
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.moved_ttl = moved_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.claim_timeout = claim_timeout
+        self.sleep = sleep
+
+        # getIssue is called from several threads at once, so share one connection behind a lock.
+        self._lock = threading.Lock()
+        # when we last got each issue, since we last wrote that down
+        self._used = {}
+        self._db = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        with self._db:
+            # so two processes opening a new cache at once don't both set it up
+            self._db.execute("BEGIN IMMEDIATE")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS issues")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS issues (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    number TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    html_url TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (owner, repository, number)
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS issues_by_last_used ON issues (last_used)")
+            # when we last cached every issue in a repository at once
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS warmed (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    warmed_at REAL NOT NULL,
+                    PRIMARY KEY (owner, repository)
+                )"""
+            )
+            # issues that GitHub said don't exist, and when it said so
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS missing (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    number TEXT NOT NULL,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (owner, repository, number)
+                )"""
+            )
+            # issues transferred to another repository, and where to
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS moved (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    number TEXT NOT NULL,
+                    new_owner TEXT NOT NULL,
+                    new_repository TEXT NOT NULL,
+                    new_number TEXT NOT NULL,
+                    moved_at REAL NOT NULL,
+                    PRIMARY KEY (owner, repository, number)
+                )"""
+            )
+            # repositories that were renamed, or moved to another owner, and what they're called now
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS renamed (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    new_owner TEXT NOT NULL,
+                    new_repository TEXT NOT NULL,
+                    renamed_at REAL NOT NULL,
+                    PRIMARY KEY (owner, repository)
+                )"""
+            )
+            # issues someone is looking up right now, who, and since when
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS claims (
+                    owner TEXT NOT NULL,
+                    repository TEXT NOT NULL,
+                    number TEXT NOT NULL,
+                    claimant TEXT NOT NULL,
+                    claimed_at REAL NOT NULL,
+                    PRIMARY KEY (owner, repository, number)
+                )"""
+            )
+
+    def get(self, owner: str, repository: str, number) -> Optional[CacheEntry]:
+        """Return the cached entry for an issue, fresh or not, or None if we don't have one."""
+        key = (owner, repository, str(number))
+        with self._lock:
+            row = self._db.execute(
+                "SELECT title, html_url, fetched_at, etag, last_modified FROM issues "
+                "WHERE owner = ? AND repository = ? AND number = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            # Writing this down every time would make every lookup a write, so save them up until we evict.
+            self._used[key] = self.clock()
+        return CacheEntry(*row)
+
+    def isFresh(self, entry: CacheEntry) -> bool:
+        return self.clock() - entry.fetched_at < self.ttl
+
+    def put(
+        self, owner: str, repository: str, number, title: str, html_url: str, etag=None, last_modified=None
+    ):
+        now = self.clock()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO issues "
+                "(owner, repository, number, title, html_url, fetched_at, etag, last_modified, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, repository, str(number), title, html_url, now, etag, last_modified, now),
+            )
+            self._db.execute(
+                "DELETE FROM missing WHERE owner = ? AND repository = ? AND number = ?",
+                (owner, repository, str(number)),
+            )
+
+    def putMissing(self, owner: str, repository: str, number):
+        """Remember that an issue doesn't exist, forgetting anything we had cached for it."""
+        key = (owner, repository, str(number))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO missing (owner, repository, number, checked_at) VALUES (?, ?, ?, ?)",
+                key + (self.clock(),),
+            )
+            self._db.execute("DELETE FROM issues WHERE owner = ? AND repository = ? AND number = ?", key)
+
+    def isMissing(self, owner: str, repository: str, number) -> bool:
+        """Return whether GitHub told us an issue doesn't exist, less than missing_ttl seconds ago."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT checked_at FROM missing WHERE owner = ? AND repository = ? AND number = ?",
+                (owner, repository, str(number)),
+            ).fetchone()
+        return row is not None and self.clock() - row[0] < self.missing_ttl
+
+    def refresh(self, owner: str, repository: str, number):
+        """Mark an entry as fresh again, because GitHub told us it hasn't changed."""
+        now = self.clock()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE issues SET fetched_at = ?, last_used = ? "
+                "WHERE owner = ? AND repository = ? AND number = ?",
+                (now, now, owner, repository, str(number)),
+            )
+
+    def putMany(self, owner: str, repository: str, issues):
+        """Cache many (number, title, html_url) issues from one repository at once.
+
+        Issues we didn't have before are added as the least recently used, so warming up a big repository
+        doesn't push out the issues that are actually being looked up."""
+        now = self.clock()
+        rows = [
+            (title, html_url, now, owner, repository, str(number)) for number, title, html_url in issues
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE issues SET title = ?, html_url = ?, fetched_at = ? "
+                "WHERE owner = ? AND repository = ? AND number = ?",
+                rows,
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO issues "
+                "(title, html_url, fetched_at, owner, repository, number, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                rows,
+            )
+            self._db.executemany(
+                "DELETE FROM missing WHERE owner = ? AND repository = ? AND number = ?",
+                [row[3:] for row in rows],
+            )
+
+    def putMove(self, owner: str, repository: str, number, new_owner: str, new_repository: str, new_number):
+        """Remember that an issue is now new_owner/new_repository#new_number.
+
+        Even if its number is the same, only this issue is remembered as moved, since issues transferred to
+        another repository can keep their numbers. Use putRename once we know the whole repository moved."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO moved "
+                "(owner, repository, number, new_owner, new_repository, new_number, moved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (owner, repository, str(number), new_owner, new_repository, str(new_number), self.clock()),
+            )
+
+    def putRename(self, owner: str, repository: str, new_owner: str, new_repository: str):
+        """Remember that a repository is now new_owner/new_repository, so all its issues are too."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO renamed (owner, repository, new_owner, new_repository, renamed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (owner, repository, new_owner, new_repository, self.clock()),
+            )
+
+    def renamedTo(self, owner: str, repository: str) -> Optional[tuple]:
+        """Return what a repository was renamed to, as (owner, repository), if it was less than moved_ttl
+        seconds ago, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT new_owner, new_repository FROM renamed "
+                "WHERE owner = ? AND repository = ? AND renamed_at > ?",
+                (owner, repository, self.clock() - self.moved_ttl),
+            ).fetchone()
+        return row and tuple(row)
+
+    def movedTo(self, owner: str, repository: str, number) -> Optional[tuple]:
+        """Return where an issue moved to, as (owner, repository, number), if it was less than moved_ttl seconds
+        ago, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT new_owner, new_repository, new_number FROM moved "
+                "WHERE owner = ? AND repository = ? AND number = ? AND moved_at > ?",
+                (owner, repository, str(number), self.clock() - self.moved_ttl),
+            ).fetchone()
+        if row is not None:
+            return tuple(row)
+        renamed = self.renamedTo(owner, repository)
+        return renamed and renamed + (str(number),)
+
+    @staticmethod
+    def _claimant() -> str:
+        # The machine and process, so others can tell when it's gone, and, since threads in a process share a
+        # connection, the thread.
+        return f"{_HOST}:{os.getpid()}:{threading.get_ident()}"
+
+    def claim(self, owner: str, repository: str, number) -> bool:
+        """Claim an issue, to look it up, and return True, or return False if someone else has already, or it's
+        since been cached, or found not to exist, by someone else."""
+        key = (owner, repository, str(number))
+        now = self.clock()
+        with self._lock, self._db:
+            # So nobody can cache it between us checking the cache and claiming it.
+            self._db.execute("BEGIN IMMEDIATE")
+            if self._db.execute(
+                "SELECT 1 FROM issues WHERE owner = ? AND repository = ? AND number = ? AND fetched_at > ? "
+                "UNION ALL "
+                "SELECT 1 FROM missing WHERE owner = ? AND repository = ? AND number = ? AND checked_at > ?",
+                key + (now - self.ttl,) + key + (now - self.missing_ttl,),
+            ).fetchone():
+                return False
+            row = self._db.execute(
+                "SELECT claimed_at, claimant FROM claims WHERE owner = ? AND repository = ? AND number = ?",
+                key,
+            ).fetchone()
+            if row is not None and (row[0] <= now - self.claim_timeout or _claimantExited(row[1])):
+                self._db.execute(
+                    "DELETE FROM claims WHERE owner = ? AND repository = ? AND number = ?", key
+                )
+            claimed = self._db.execute(
+                "INSERT OR IGNORE INTO claims (owner, repository, number, claimant, claimed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                key + (self._claimant(), now),
+            )
+        return claimed.rowcount == 1
+
+    def release(self, owner: str, repository: str, number):
+        """Release our claim on an issue, if we have one."""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM claims WHERE owner = ? AND repository = ? AND number = ? AND claimant = ?",
+                (owner, repository, str(number), self._claimant()),
+            )
+
+    def waitForClaim(self, owner: str, repository: str, number, until: float = None):
+        """Wait until nobody has an issue claimed, it's been claimed for claim_timeout seconds, or whoever
+        claimed it has exited, but not past until, a time.monotonic() time."""
+        key = (owner, repository, str(number))
+        while until is None or time.monotonic() < until:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT claimed_at, claimant FROM claims WHERE owner = ? AND repository = ? AND number = ?",
+                    key,
+                ).fetchone()
+            if row is None or self.clock() - row[0] >= self.claim_timeout or _claimantExited(row[1]):
+                return
+            self.sleep(CLAIM_POLL_INTERVAL)
+
+    def warmedAt(self, owner: str, repository: str) -> Optional[float]:
+        """Return when every issue in a repository was last cached, or None if it hasn't been."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT warmed_at FROM warmed WHERE owner = ? AND repository = ?", (owner, repository)
+            ).fetchone()
+        return row and row[0]
+
+    def markWarmed(self, owner: str, repository: str, warmed_at: float, since: Optional[float] = None):
+        """Note that every issue in a repository was cached at warmed_at.
+
+        If only the issues updated since `since` were fetched, everything fetched since then is
+        as good as new, so mark it fresh as of warmed_at too."""
+        with self._lock, self._db:
+            if since is not None:
+                self._db.execute(
+                    "UPDATE issues SET fetched_at = ? "
+                    "WHERE owner = ? AND repository = ? AND fetched_at >= ? AND fetched_at < ?",
+                    (warmed_at, owner, repository, since, warmed_at),
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO warmed (owner, repository, warmed_at) VALUES (?, ?, ?)",
+                (owner, repository, warmed_at),
+            )
+
+    def issues(self) -> list:
+        """Return every cached issue, fresh or not, as (owner, repository, number, title, html_url)."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT owner, repository, number, title, html_url FROM issues"
+            ).fetchall()
+
+    def evict(self):
+        """Throw away the least recently used entries beyond max_entries, and expired missing and moved issues."""
+        with self._lock, self._db:
+            self._writeUsed()
+            self._db.execute(
+                "DELETE FROM issues WHERE rowid IN "
+                "(SELECT rowid FROM issues ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.execute(
+                "DELETE FROM missing WHERE checked_at <= ?", (self.clock() - self.missing_ttl,)
+            )
+            self._db.execute("DELETE FROM moved WHERE moved_at <= ?", (self.clock() - self.moved_ttl,))
+            self._db.execute("DELETE FROM renamed WHERE renamed_at <= ?", (self.clock() - self.moved_ttl,))
+
+    def _writeUsed(self):
+        """Write down when we last got each entry, holding the lock, inside a transaction."""
+        used, self._used = self._used, {}
+        # They could have been put or refreshed since, so don't make them any less recently used.
+        self._db.executemany(
+            "UPDATE issues SET last_used = max(last_used, ?) WHERE owner = ? AND repository = ? AND number = ?",
+            [(last_used,) + key for key, last_used in used.items()],
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
+
+    def close(self):
+        """Close the cache, releasing every claim this process still has, like those of lookups given up on.
+
+        If we haven't changed anything, there's nothing new to evict, so only write down what we got."""
+        # (Rows we've inserted, updated or deleted. Setting the cache up doesn't count.)
+        written = self._db.total_changes > 0
+        if written:
+            self.evict()
+        ours = f"{_HOST}:{os.getpid()}:"
+        with self._lock:
+            with self._db:
+                if not written:
+                    self._writeUsed()
+                self._db.execute("DELETE FROM claims WHERE substr(claimant, 1, ?) = ?", (len(ours), ours))
+            self._db.close()
+
+
+def _claimantExited(claimant: str) -> bool:
+    """Return whether the process that made a claim has exited, if it was on this machine, and we can tell."""
+    host, _, rest = claimant.partition(":")
+    pid = rest.partition(":")[0]
+    if _HOST is None or host != _HOST or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:  # like PermissionError, when it's someone else's
+        return False
+    return False
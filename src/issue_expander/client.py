@@ -0,0 +1,231 @@
+"""A small HTTP client that sets up TLS once and keeps connections to GitHub open between requests.
+
+http.client, ssl and certifi take a while to import, so they aren't until the first connection is made.
+Runs that find nothing to look up never import them at all."""
+import threading
+import time
+from typing import TYPE_CHECKING, NamedTuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from issue_expander import stats
+from issue_expander.ratelimit import MAX_RETRIES, RateLimiter
+
+if TYPE_CHECKING:  # pragma: no cover
+    import http.client
+    import ssl
+
+# How many idle connections we keep open to each host. More may be open at once while busy.
+DEFAULT_MAX_IDLE_CONNECTIONS = 8
+
+# How long, in seconds, to wait for a connection to be made, or for a response to arrive, before giving up.
+DEFAULT_TIMEOUT = 30
+
+# How many redirects we follow before giving up, like urllib does.
+MAX_REDIRECTS = 10
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class Response(NamedTuple):
+    status: int
+    headers: "http.client.HTTPMessage"
+    body: bytes
+    url: str
+
+
+def countResponse(status, data, reused, seconds):
+    """Note a response in the stats."""
+    if stats.enabled():
+        stats.count("http.requests")
+        stats.count(f"http.status.{status}")
+        stats.count("http.bytes", len(data))
+        stats.count("http.connections.reused" if reused else "http.connections.new")
+        stats.observe("http.request", seconds)
+
+
+def proxyFor(scheme, netloc):
+    """Return the split URL of the proxy to reach scheme://netloc through, found in the environment, in
+    https_proxy, http_proxy and no_proxy, the way urlopen finds it, or None to connect directly."""
+    import urllib.request
+
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(netloc):
+        return None
+    return urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+
+
+def proxyHeaders(proxy) -> dict:
+    """Return the headers that log in to proxy, if its URL has a username and password in it, or none."""
+    if proxy.username is None:
+        return {}
+    import base64
+    from urllib.parse import unquote
+
+    credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}".encode("utf-8")
+    return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials).decode("ascii")}
+
+
+class HTTPClient:
+    """Makes HTTP/1.1 requests over a pool of keep-alive connections per host.
+
+    The SSL context (and so the certifi CA bundle) is loaded once, the first time it's needed,
+    and shared by every connection. It's safe to use from several threads at once.
+
+    If it has a rate_limiter, every request waits for its turn, and rate limited requests are retried.
+    Connections that go quiet for timeout seconds raise socket.timeout, an OSError. Like urlopen, it goes
+    through the proxies in the environment: HTTPS through a tunnel, and plain HTTP with full URLs."""
+
+    def __init__(
+        self, max_idle_connections=DEFAULT_MAX_IDLE_CONNECTIONS, rate_limiter=None, timeout=DEFAULT_TIMEOUT
+    ):
+        self.max_idle_connections = max_idle_connections
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self._ssl_context = None
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sslContext(self) -> "ssl.SSLContext":
+        import ssl
+
+        import certifi
+
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+            return self._ssl_context
+
+    def _connect(self, scheme, netloc):
+        import http.client
+
+        if scheme not in ("https", "http"):
+            raise ValueError(f"Unsupported URL scheme {scheme!r}")
+        proxy = proxyFor(scheme, netloc)
+        if proxy is None and scheme == "https":
+            return http.client.HTTPSConnection(netloc, context=self.sslContext, timeout=self.timeout)
+        if proxy is None:
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(
+                proxy.hostname, proxy.port or 80, context=self.sslContext, timeout=self.timeout
+            )
+            connection.set_tunnel(netloc, headers=proxyHeaders(proxy))
+            return connection
+        return http.client.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+
+    def _checkout(self, host):
+        """Return an idle connection to host, or None if there aren't any."""
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _checkin(self, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.max_idle_connections:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _send(self, method, url, headers, body) -> Response:
+        import http.client
+
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        proxy = parts.scheme == "http" and proxyFor(*host)
+        if proxy:
+            # Through a proxy, plain HTTP requests are for the whole URL.
+            path = urlunsplit(parts._replace(fragment=""))
+            headers = dict(headers, **proxyHeaders(proxy))
+
+        connection = self._checkout(host)
+        reused = connection is not None
+        if not reused:
+            connection = self._connect(*host)
+
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (
+            ConnectionResetError,
+            BrokenPipeError,
+        ):  # and RemoteDisconnected, which is a ConnectionResetError
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection before we used it. Try once more, on a new one.
+            stats.count("http.stale_connections")
+            return self._send(method, url, headers, body)
+        except (http.client.HTTPException, OSError):
+            # Anything else, like a timeout, isn't down to a stale connection, and sending the request again
+            # would only double how long we wait, or send a POST twice.
+            connection.close()
+            raise
+        countResponse(response.status, data, reused, time.perf_counter() - start)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(host, connection)
+        return Response(response.status, response.headers, data, url)
+
+    def request(self, method: str, url: str, headers=None, body=None) -> Response:
+        """Make a request, following redirects, and return the final response.
+
+        Unlike urlopen, HTTP error statuses are returned, not raised. If the rate limiter
+        gives up on the request, it raises RateLimitExceeded."""
+        headers = dict(headers or {})
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            response = self._follow(method, url, headers, body)
+            if limiter is None or attempt >= MAX_RETRIES or not limiter.update(response, attempt):
+                return response
+            attempt += 1
+
+    def _follow(self, method, url, headers, body) -> Response:
+        for _ in range(MAX_REDIRECTS):
+            response = self._send(method, url, headers, body)
+            location = response.headers.get("Location")
+            if response.status not in REDIRECT_CODES or not location:
+                return response
+            url = urljoin(url, location)
+            if response.status == 303:
+                method, body = "GET", None
+        return response
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def sharedClient() -> HTTPClient:
+    """Return the HTTPClient every lookup shares, making it the first time."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = HTTPClient(rate_limiter=RateLimiter())
+        return _shared_client
+
+
+def request(method: str, url: str, headers=None, body=None) -> Response:
+    """Make a request with the shared client."""
+    return sharedClient().request(method, url, headers, body)
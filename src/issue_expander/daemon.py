@@ -0,0 +1,229 @@
+"""Keep issue-expander running, with its caches and connections warm, expanding text for clients over a Unix socket.
+
+Clients and the daemon talk in frames: a length, as a big-endian unsigned 32-bit integer, and then that many
+bytes of UTF-8 JSON. A client sends a request like
+
+    {"text": "See #1", "token": null, "default_source": "foo/bar", "markdown": true, "graphql": false}
+
+and the daemon answers {"text": "See [One #1](https://github.com/foo/bar/issues/1)"}, or {"error": "..."}
+if it can't. Only "text" is needed. A connection can carry any number of requests, one after the other.
+
+The client side only needs the standard library, so it's quick to start."""
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import time
+
+_length = struct.Struct(">I")
+
+# Frames bigger than this, in bytes, are refused, so a confused client can't make the daemon run out of memory.
+MAX_FRAME = 64 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    """A frame that isn't what the protocol says it should be."""
+
+
+class DaemonError(Exception):
+    """The daemon couldn't expand what we sent it."""
+
+
+def encodeFrame(message) -> bytes:
+    """Return message, something JSON can encode, as a frame."""
+    data = json.dumps(message).encode("utf-8")
+    return _length.pack(len(data)) + data
+
+
+def readFrame(stream):
+    """Read a frame from stream, a binary file, and return what's in it, or None if stream ended before it."""
+    header = stream.read(_length.size)
+    if not header:
+        return None
+    if len(header) < _length.size:
+        raise ProtocolError("truncated frame")
+    (length,) = _length.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError(f"frame of {length} bytes is bigger than {MAX_FRAME}")
+    data = stream.read(length)
+    if len(data) < length:
+        raise ProtocolError("truncated frame")
+    try:
+        return json.loads(data.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f"frame isn't JSON: {e}") from None
+
+
+class Expander:
+    """Answers requests, remembering lookups between them for up to memo_ttl seconds.
+
+    (After that, they're forgotten, so the issue cache's own TTL decides when issues are looked up again.)"""
+
+    def __init__(self, concurrency: int, memo_ttl: float, clock=time.monotonic):
+        self.concurrency = concurrency
+        self.memo_ttl = memo_ttl
+        self.clock = clock
+        self.memo_started = clock()
+
+    def answer(self, request) -> dict:
+        from issue_expander import expander, stats
+
+        stats.count("daemon.requests")
+        if not isinstance(request, dict) or not isinstance(request.get("text"), str):
+            return {"error": "a request needs text"}
+        default_owner = default_repository = None
+        if request.get("default_source") is not None:
+            match = expander.source_regex.fullmatch(str(request["default_source"]))
+            if not match:
+                return {"error": "default source must be in the format 'owner/repository'"}
+            default_owner, default_repository = match.group("owner", "repository")
+        token = request.get("token")
+        use_graphql = bool(request.get("graphql"))
+        if use_graphql and not token:
+            return {"error": "--graphql needs a GitHub token"}
+
+        if self.clock() - self.memo_started >= self.memo_ttl:
+            expander.getIssue.cache_clear()
+            self.memo_started = self.clock()
+        text = expander.expandRefsToMarkdown(
+            request["text"],
+            token,
+            default_owner,
+            default_repository,
+            self.concurrency,
+            use_graphql,
+            markdown=request.get("markdown", True) is not False,
+        )
+        return {"text": text}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = readFrame(self.rfile)
+            except ProtocolError as e:
+                self.wfile.write(encodeFrame({"error": str(e)}))
+                return
+            if request is None:
+                return
+            self.wfile.write(encodeFrame(self.server.expander.answer(request)))
+
+
+def _serverClass():
+    server_class = getattr(socketserver, "ThreadingUnixStreamServer", None)
+    if server_class is None:
+        raise OSError("Unix sockets aren't supported here")
+    return server_class
+
+
+def makeServer(path, concurrency: int, memo_ttl: float):
+    """Return a server listening on a Unix socket at path, ready to serve_forever.
+
+    Only we can connect to it. A socket left behind by a daemon that's gone is replaced, but raises OSError if
+    another daemon is listening there, or there's something other than a socket there."""
+    server_class = _serverClass()
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(f"{path} exists, and isn't a socket")
+        if connect(path) is not None:
+            raise OSError(f"issue-expander is already serving on {path}")
+        os.unlink(path)
+    previous_umask = os.umask(0o177)
+    try:
+        server = server_class(path, _Handler)
+    finally:
+        os.umask(previous_umask)
+    server.daemon_threads = True
+    server.expander = Expander(concurrency, memo_ttl)
+    return server
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(path, concurrency: int, memo_ttl: float):
+    """Expand text for clients on a Unix socket at path, until interrupted or terminated."""
+    server = makeServer(path, concurrency, memo_ttl)
+    print(f"Expanding references for clients on {path}.", file=sys.stderr)
+    previous_handler = signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        server.server_close()
+        os.unlink(path)
+
+
+def connect(path):
+    """Return a socket connected to the daemon at path, or None if there isn't one."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(path))
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+class Client:
+    """A connection to a daemon, to send it text to expand."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._reader = connection.makefile("rb")
+
+    def expand(self, text, token=None, default_source=None, markdown=True, use_graphql=False) -> str:
+        """Have the daemon expand text, raising DaemonError if it can't."""
+        request = {
+            "text": text,
+            "token": token,
+            "default_source": default_source,
+            "markdown": markdown,
+            "graphql": use_graphql,
+        }
+        try:
+            self.connection.sendall(encodeFrame(request))
+            answer = readFrame(self._reader)
+        except (OSError, ProtocolError) as e:
+            raise DaemonError(f"lost the daemon: {e}") from None
+        if answer is None:
+            raise DaemonError("lost the daemon: it hung up")
+        if "error" in answer:
+            raise DaemonError(answer["error"])
+        return answer["text"]
+
+    def close(self):
+        self._reader.close()
+        self.connection.close()
+
+
+def expandPaths(client, paths, output, in_place: bool = False, **options) -> int:
+    """Have the daemon expand each file in paths, like expandFiles does. Returns how many files were rewritten.
+
+    options are passed on to Client.expand."""
+    from issue_expander import files
+
+    rewritten = 0
+    for path in paths:
+        try:
+            text = files.readFile(path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Unable to read {path}: {e}", file=sys.stderr)
+            continue
+        expanded = client.expand(text, **options)
+        if not in_place:
+            output.write(expanded)
+        elif expanded != text:
+            files.writeAtomically(path, expanded)
+            rewritten += 1
+    return rewritten
@@ -1,87 +1,743 @@
-import json
+import os
 import re
-import ssl
+import sqlite3
 import sys
-from functools import lru_cache, partial
-from urllib.error import HTTPError
-from urllib.request import Request, urlopen
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import chain
+from typing import NamedTuple
+from urllib.parse import urlencode
 
-import certifi
 import click
 
-# These regexes are really particular, at the moment...
-# When adding regexes, take care to only match if you should--this may mean negative look-ahead and -behind assertions
-# and name the group number, owner, and repository, but append _ and a unique suffix.
+from issue_expander import client, files, graphql, ratelimit, stats
+from issue_expander.cache import DEFAULT_MISSING_TTL, DEFAULT_TTL, Issue, IssueCache, defaultCacheDir
+from issue_expander.index import IssueIndex, readJSONL, writeIndex
+from issue_expander.markdown import MarkdownScanner, proseRegions
+from issue_expander.references import findReferences
 
-# Python's re module doesn't support regexes containing multiple named groups with the same name.
+# like adamwolf/issue-expander, for --default-source and --warm
+source_regex = re.compile(r"(?P<owner>[a-zA-Z0-9.-]+)/(?P<repository>[a-zA-Z0-9.-]+)")
 
-# These regexes are later combined into a megaregex.
-named_regexes = [
-    # like https://github.com/foo/bar/issues/123
-    r"https://github.com/(?P<owner_x>[a-zA-Z0-9.-]+)/(?P<repository_x>[a-zA-Z0-9.-]+)/(issues|pull)/(?P<number_x>\d+)",
-    r"(?<![a-zA-Z0-9#-])#(?P<number_y>\d+)(?![a-zA-Z0-9#])",  # like #123
-    r"\bGH-(?P<number_z>\d+)",  # like GH-123
-    r"(?P<owner_n>[a-zA-Z0-9.-]+)/(?P<repository_n>[a-zA-Z0-9.-]+)#(?P<number_n>\d+)",  # like foo/bar#123
-]
+# the end of an issue's html_url, which says where it is now
+html_url_regex = re.compile(r"/(?P<owner>[^/]+)/(?P<repository>[^/]+)/(?:issues|pull)/(?P<number>\d+)$")
 
-megaregex = re.compile("|".join(named_regexes))
+API_URL = "https://api.github.com"
 
+# How many issue lookups we run at once, by default.
+DEFAULT_CONCURRENCY = 8
 
-@lru_cache()
-def getIssue(owner: str, repository: str, number: int, token: [str]) -> [dict]:
+# When streaming, read input this many characters at a time,
+CHUNK_SIZE = 64 * 1024
+# and look up references this many chunks ahead of the one being written.
+STREAM_WINDOW = 8
+# Streaming Markdown, chunks end between paragraphs, unless a paragraph runs on for longer than this.
+MAX_PARAGRAPH = 1024 * 1024
+
+# Warming up the cache, ask for this many issues a page (GitHub's maximum),
+WARM_PAGE_SIZE = 100
+# and, after the first time, for those updated since a little before the last time, in case our clocks disagree.
+WARM_OVERLAP = 5 * 60
+
+# Lookups that fail for the time being, like when we're rate limited, are tried this many more times,
+LOOKUP_RETRIES = 2
+# the first after this many seconds, and each one after that after twice as long as the one before.
+RETRY_BACKOFF = 1.0
+
+# When set to an IssueCache, getIssue checks it before going to GitHub, and saves what it finds there.
+issue_cache = None
+# When set, a function that opens the issue cache (or returns None), for issueCache() to call when it's first needed.
+open_issue_cache = None
+_open_issue_cache_lock = threading.Lock()
+
+# When set to an IssueIndex, getIssue checks it before the issue cache.
+issue_index = None
+
+# When True, getIssue never goes to GitHub.
+offline = False
+
+# resolveRefsBy's lookups, per thread: the deadline they give up waiting at, and whether the last one failed.
+deadline_lookups = threading.local()
+
+
+@contextmanager
+def useIssueCache(cache):
+    """Use cache as the issue cache inside the with block, then close it and put things back.
+
+    cache can also be a function that opens it, or returns None, to only open it the first time it's needed."""
+    global issue_cache, open_issue_cache
+    previous = issue_cache, open_issue_cache
+    if callable(cache):
+        issue_cache, open_issue_cache = None, cache
+    else:
+        issue_cache, open_issue_cache = cache, None
+    try:
+        yield cache
+    finally:
+        cache = issue_cache
+        issue_cache, open_issue_cache = previous
+        if cache is not None:
+            cache.close()
+
+
+def issueCache():
+    """Return the issue cache, opening it if this is the first time it's needed, or None if there isn't one."""
+    global issue_cache, open_issue_cache
+    if open_issue_cache is not None:
+        with _open_issue_cache_lock:
+            # Another thread could have opened it while we waited.
+            if open_issue_cache is not None:
+                issue_cache = open_issue_cache()
+                open_issue_cache = None
+    return issue_cache
+
+
+@contextmanager
+def useIssueIndex(index):
+    """Use index, an IssueIndex, as the issue index inside the with block, then close it and put things back."""
+    global issue_index
+    previous = issue_index
+    issue_index = index
+    try:
+        yield index
+    finally:
+        issue_index = previous
+        if index is not None:
+            index.close()
+
+
+@contextmanager
+def useOffline(enabled: bool = True):
+    """Inside the with block, never go to GitHub. Only the issue index and the issue cache (stale or not) are used."""
+    global offline
+    previous = offline
+    offline = enabled
+    try:
+        yield
+    finally:
+        offline = previous
+
+
+class LookupFailed(Exception):
+    """Looking up an issue failed for the time being, like when GitHub had trouble, so it's worth trying again.
+
+    Unless retry is False: when the rate limiter gives up on a lookup, trying again soon would only be given
+    up on again. It's still worth trying later on, though."""
+
+    def __init__(self, retry: bool = True):
+        super().__init__(retry)
+        self.retry = retry
+
+
+class RetryQueue:
+    """The keys of lookups that failed for the time being, and when each can be tried again.
+
+    A key that has failed more than `retries` times isn't queued again, until it's looked up after all, and
+    forgotten. It's safe to share between threads."""
+
+    def __init__(self, retries=LOOKUP_RETRIES, backoff=RETRY_BACKOFF, clock=time.monotonic):
+        self.retries = retries
+        self.backoff = backoff
+        self.clock = clock
+        self._failures = {}
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            if failures <= self.retries:
+                self._due[key] = self.clock() + self.backoff * 2 ** (failures - 1)
+
+    def take(self, keys) -> tuple:
+        """Take the queued keys among keys off the queue.
+
+        Returns them, and how many seconds to wait before they can all be tried again."""
+        with self._lock:
+            taken = [key for key in keys if key in self._due]
+            due = max([self._due.pop(key) for key in taken], default=0)
+        return taken, max(due - self.clock(), 0)
+
+    def forget(self, key):
+        """Forget key's failures, now it's been looked up, so they don't count against it next time."""
+        with self._lock:
+            self._failures.pop(key, None)
+            self._due.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+            self._due.clear()
+
+
+retry_queue = RetryQueue()
+
+
+def takeRetries(keys) -> list:
+    """Wait until the lookups of keys that failed for the time being can be tried again, and return their keys."""
+    retry, wait = retry_queue.take(keys)
+    if retry:
+        stats.count("lookups.retried", len(retry))
+        if wait:
+            time.sleep(wait)
+    return retry
+
+
+def rememberAnswers(lookup, maxsize=128):
+    """Like lru_cache, but lookups that fail with LookupFailed aren't remembered.
+
+    They return None, and are queued to be tried again. Lookups made some other way, like getIssueAsync's,
+    can share the answers, with recall(key) and remember(key, answer), where key is the lookup's arguments."""
+    answers = OrderedDict()
+    lock = threading.Lock()
+
+    def recall(key):
+        """(True, the answer) if there's one remembered for key, and (False, None) if not."""
+        with lock:
+            if key not in answers:
+                return False, None
+            answers.move_to_end(key)
+            return True, answers[key]
+
+    def remember(key, answer):
+        with lock:
+            answers[key] = answer
+            answers.move_to_end(key)
+            if len(answers) > maxsize:
+                answers.popitem(last=False)
+
+    def cache_clear():
+        with lock:
+            answers.clear()
+
+    @wraps(lookup)
+    def remembering(owner, repository, number, token):
+        key = (owner, repository, number, token)
+        found, issue = recall(key)
+        if not found:
+            try:
+                issue = lookup(owner, repository, number, token)
+            except LookupFailed as e:
+                deadline_lookups.failed = True
+                lookupFailed(owner, repository, number, e)
+                return None
+            remember(key, issue)
+        retry_queue.forget((owner, repository, number))
+        return issue
+
+    remembering.recall = recall
+    remembering.remember = remember
+    remembering.cache_clear = cache_clear
+    return remembering
+
+
+def lookupFailed(owner, repository, number, error):
+    """Count a lookup that failed with error, a LookupFailed, and queue it to be tried again if it's worth it."""
+    stats.count("lookups.failed")
+    if error.retry:
+        retry_queue.add((owner, repository, number))
+
+
+def reportRateLimited(token):
+    stats.count("lookups.rate_limited")
+    message = "Unable to look up issue due to rate limit error."
+    if not token:
+        message += " Try providing a token with --token."
+    print(message, file=sys.stderr)
+
+
+@rememberAnswers
+def getIssue(owner: str, repository: str, number: int, token: [str]) -> [Issue]:
     # What to do with bad credentials?
 
-    url = f"https://api.github.com/repos/{owner}/{repository}/issues/{number}"
+    cache = issueCache()
+    issue, entry = checkIssueCache(cache, owner, repository, number)
+    if issue is not None or offline or knownMissing(cache, owner, repository, number):
+        return issue
+
+    # Other processes sharing the cache might be looking it up already, so wait for them instead,
+    # but not past resolveRefsBy's deadline.
+    deadline = getattr(deadline_lookups, "deadline", None)
+    while cache is not None and not cache.claim(owner, repository, number):
+        stats.count("cache.waits")
+        cache.waitForClaim(owner, repository, number, deadline)
+        issue, entry = checkIssueCache(cache, owner, repository, number)
+        if issue is not None or knownMissing(cache, owner, repository, number):
+            return issue
+        if deadline is not None and time.monotonic() >= deadline:
+            raise LookupFailed(retry=False)
+
+    import http.client
+
+    try:
+        url, headers = issueRequest(owner, repository, number, token, entry, cache)
+        try:
+            response = client.request("GET", url, headers)
+        except ratelimit.RateLimitExceeded:
+            reportRateLimited(token)
+            raise LookupFailed(retry=False) from None
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Unable to look up {owner}/{repository}#{number}: {e}", file=sys.stderr)
+            raise LookupFailed() from None
+
+        issue = readIssueResponse(cache, owner, repository, number, token, entry, response)
+    finally:
+        if cache is not None:
+            cache.release(owner, repository, number)
 
+    # Only the first time we find it's moved, so an issue that was transferred isn't asked about every time.
+    rename = entry is None and possibleRename(cache, owner, repository, number, issue)
+    if rename:
+        url, headers = renameRequest(owner, repository, token)
+        try:
+            response = client.request("GET", url, headers)
+        except (ratelimit.RateLimitExceeded, OSError, http.client.HTTPException):
+            return issue  # it's still remembered as moved, on its own
+        readRenameResponse(cache, owner, repository, *rename, response)
+    return issue
+
+
+def checkIssueCache(cache, owner, repository, number):
+    """Return (issue, entry): the issue if the issue index has it or cache has it fresh, and whatever entry
+    cache has for it. Offline, stale entries are better than nothing, so they're returned too."""
+    if issue_index is not None:
+        issue = issue_index.get(owner, repository, number)
+        if issue is not None:
+            stats.count("index.hits")
+            return issue, None
+        stats.count("index.misses")
+    if cache is None:
+        return None, None
+    entry = cache.get(owner, repository, number)
+    if entry is None:
+        stats.count("cache.misses")
+    elif cache.isFresh(entry):
+        stats.count("cache.hits")
+        return Issue(entry.title, entry.html_url), entry
+    else:
+        stats.count("cache.stale")
+        if offline:
+            return Issue(entry.title, entry.html_url), entry
+    return None, entry
+
+
+def knownMissing(cache, owner, repository, number) -> bool:
+    """Return whether cache remembers that an issue doesn't exist."""
+    if cache is None or not cache.isMissing(owner, repository, number):
+        return False
+    stats.count("cache.missing")
+    return True
+
+
+def apiHeaders(token) -> dict:
     headers = {"Accept": "application/json"}
     if token:
         headers["Authorization"] = f"Bearer: {token}"
+    return headers
+
+
+def issueRequest(owner, repository, number, token, entry, cache=None):
+    """Return the URL and headers of the request that looks up an issue.
+
+    If cache knows the issue has moved, it's looked up where it is now, instead of following a redirect there."""
+    moved = cache is not None and cache.movedTo(owner, repository, number)
+    if moved:
+        stats.count("cache.moved")
+        owner, repository, number = moved
+    url = f"{API_URL}/repos/{owner}/{repository}/issues/{number}"
 
-    request = Request(url, headers=headers)
+    headers = apiHeaders(token)
+    if entry is not None:
+        # We've seen this issue before, so ask GitHub to only send it if it has changed.
+        # A 304 Not Modified answer doesn't count against our rate limit.
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+    return url, headers
 
-    certifi_context = ssl.create_default_context(cafile=certifi.where())
+
+def readIssueResponse(cache, owner, repository, number, token, entry, response) -> [Issue]:
+    """Return the issue GitHub sent in response to issueRequest, caching it, or None if there isn't one.
+
+    Issues that don't exist are cached as missing. Raises LookupFailed if the lookup failed for the time being,
+    because we were rate limited, or GitHub had trouble, or its answer was garbled."""
+    if response.status == 304 and entry is not None:
+        stats.count("cache.revalidated")
+        cache.refresh(owner, repository, number)
+        return Issue(entry.title, entry.html_url)
+    if response.status in (404, 410):
+        stats.count("lookups.missing")
+        if cache is not None:
+            cache.putMissing(owner, repository, number)
+        return None
+    if response.status in (403, 429):  # "rate limit exceeded"
+        reportRateLimited(token)
+        raise LookupFailed()
+    if response.status >= 500:
+        raise LookupFailed()
+    if not 200 <= response.status < 300:
+        return None
+
+    import json
 
     try:
-        with urlopen(request, context=certifi_context) as response:
-            j = json.load(response)
-            return j
-    except HTTPError as e:
-        if e.code == 403:  # "rate limit exceeded"
-            message = "Unable to look up issue due to rate limit error."
-            if not token:
-                message += " Try providing a token with --token."
-            print(message, file=sys.stderr)
+        with stats.timer("json.parse"):
+            j = json.loads(response.body)
     except json.JSONDecodeError:
-        print(f"Unable to parse response from {url}", file=sys.stderr)
+        print(f"Unable to parse response from {response.url}", file=sys.stderr)
+        raise LookupFailed() from None
+
+    issue = Issue(j["title"], j["html_url"])
+    if cache is not None:
+        cache.put(
+            owner,
+            repository,
+            number,
+            issue.title,
+            issue.html_url,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        noteMove(cache, owner, repository, number, issue.html_url)
+    return issue
+
+
+def noteMove(cache, owner, repository, number, html_url):
+    """Remember in cache where an issue is now, according to its html_url, if it's not where we looked for it.
+
+    GitHub redirects lookups of issues that moved, or are in repositories that were renamed, so next time, we
+    can skip the redirect."""
+    match = html_url_regex.search(html_url)
+    if match is None:
+        return
+    new_owner, new_repository, new_number = match.groups()
+    # Owners and repositories aren't case sensitive, so looking up Foo/Bar#1 isn't redirected to foo/bar#1.
+    if (new_owner.lower(), new_repository.lower(), new_number) != (
+        owner.lower(),
+        repository.lower(),
+        str(number),
+    ):
+        stats.count("lookups.moved")
+        cache.putMove(owner, repository, number, new_owner, new_repository, new_number)
+
+
+def possibleRename(cache, owner, repository, number, issue):
+    """Return (owner, repository) for where an issue is now, if it's in another repository with the same number,
+    so its repository may have been renamed, and cache doesn't know that already, or None.
+
+    Issues transferred to another repository can keep their numbers too, so check with renameRequest."""
+    if cache is None or issue is None:
+        return None
+    match = html_url_regex.search(issue.html_url)
+    if match is None or match.group("number") != str(number):
+        return None
+    new_owner, new_repository = match.group("owner", "repository")
+    if (new_owner.lower(), new_repository.lower()) == (owner.lower(), repository.lower()):
+        return None
+    if cache.renamedTo(owner, repository) is not None:
+        return None
+    return new_owner, new_repository
+
+
+def renameRequest(owner, repository, token):
+    """Return the URL and headers of the request that looks up a repository, to see what it's called now."""
+    return f"{API_URL}/repos/{owner}/{repository}", apiHeaders(token)
+
+
+def readRenameResponse(cache, owner, repository, new_owner, new_repository, response):
+    """Remember in cache that owner/repository was renamed to new_owner/new_repository, if GitHub's response to
+    renameRequest says that's what it's called now."""
+    if response.status != 200:
+        return
+    import json
+
+    try:
+        full_name = json.loads(response.body)["full_name"]
+    except (ValueError, KeyError, TypeError):
+        return
+    if full_name.lower() == f"{new_owner}/{new_repository}".lower():
+        stats.count("lookups.renamed")
+        cache.putRename(owner, repository, new_owner, new_repository)
+
+
+def nextPage(response):
+    """Return the URL of the next page of a paginated response, from its Link header, or None."""
+    match = re.search(r'<([^>]*)>;\s*rel="next"', response.headers.get("Link") or "")
+    return match and match.group(1)
+
+
+def warmRepository(owner: str, repository: str, token: object = None) -> int:
+    """Fill the issue cache with every issue and pull request in owner/repository, a hundred per request.
+
+    After the first time, only issues updated since the last warm-up are fetched, and what we fetched
+    since then is marked fresh again. Returns how many issues were cached. (None, without a cache.)"""
+    import json
+
+    cache = issueCache()
+    if cache is None:
         return None
 
+    started = cache.clock()
+    query = {"state": "all", "per_page": WARM_PAGE_SIZE}
+    since = cache.warmedAt(owner, repository)
+    if since is not None:
+        since -= WARM_OVERLAP
+        query["since"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+    url = f"{API_URL}/repos/{owner}/{repository}/issues?{urlencode(query)}"
+    headers = apiHeaders(token)
+
+    cached = 0
+    while url:
+        try:
+            response = client.request("GET", url, headers)
+        except ratelimit.RateLimitExceeded:
+            reportRateLimited(token)
+            return cached
+        if response.status in (403, 429):  # "rate limit exceeded"
+            reportRateLimited(token)
+        if response.status != 200:
+            print(f"Unable to list issues in {owner}/{repository} ({response.status})", file=sys.stderr)
+            return cached
+
+        try:
+            with stats.timer("json.parse"):
+                page = json.loads(response.body)
+        except json.JSONDecodeError:
+            print(f"Unable to parse response from {response.url}", file=sys.stderr)
+            return cached
+
+        cache.putMany(owner, repository, ((i["number"], i["title"], i["html_url"]) for i in page))
+        stats.count("warm.pages")
+        stats.count("warm.issues", len(page))
+        cached += len(page)
+        url = nextPage(response)
+
+    # Only now that we've seen every page do we know the cache has everything.
+    cache.markWarmed(owner, repository, started, since)
+    return cached
+
+
+def warmBusyRepositories(keys, token, warm_over: int, counts: dict) -> list:
+    """Warm up the cache for repositories with more than warm_over distinct references.
+
+    counts maps (owner, repository) to how many references to it have been seen, and is updated with keys,
+    which should be new. Returns the repositories warmed up."""
+    busy = []
+    for owner, repository, _ in keys:
+        n = counts[(owner, repository)] = counts.get((owner, repository), 0) + 1
+        if n == warm_over + 1:
+            busy.append((owner, repository))
+    for owner, repository in busy:
+        warmRepository(owner, repository, token)
+    return busy
 
-def substituteMatch(match, default_owner, default_repository, token):
-    owner = None
-    repository = None
-    number = None
 
-    for name, value in match.groupdict().items():
-        if name.startswith("number_") and value is not None:
-            number = value
-        elif name.startswith("owner_") and value is not None:
-            owner = value
-        elif name.startswith("repository_") and value is not None:
-            repository = value
+def refKey(reference, default_owner, default_repository):
+    """Return the (owner, repository, number) that a Reference refers to, or None if we can't tell."""
+    owner = reference.owner
+    repository = reference.repository
 
     if not (owner and repository):
         owner = default_owner
         repository = default_repository
 
     if owner and repository:
-        issue = getIssue(owner, repository, number, token)
+        return (owner, repository, reference.number)
+    return None
+
+
+def findMatches(text: str, regions: list = None):
+    """Yield the References in text, or, given (start, end) regions of it, in just those."""
+    if regions is None:
+        yield from findReferences(text)
+        return
+    for start, end in regions:
+        yield from findReferences(text, start, end)
+
+
+def findRefs(
+    text: str, default_owner: object = None, default_repository: object = None, regions: list = None
+) -> set:
+    """Scan text and return the set of unique (owner, repository, number) keys it references.
+
+    Given (start, end) regions of text, like proseRegions returns, only they are scanned."""
+    keys = set()
+    kinds = {} if stats.enabled() else None
+    for reference in findMatches(text, regions):
+        if kinds is not None:
+            kinds[reference.kind] = kinds.get(reference.kind, 0) + 1
+        key = refKey(reference, default_owner, default_repository)
+        if key:
+            keys.add(key)
+    for kind, n in (kinds or {}).items():
+        stats.count(f"matches.{kind}", n)
+    return keys
+
+
+def resolveRefs(
+    keys, token: object = None, concurrency: int = DEFAULT_CONCURRENCY, use_graphql: bool = False
+) -> dict:
+    """Look up every key with getIssue, running up to `concurrency` lookups at once.
+
+    Returns a dict mapping each key to whatever getIssue returned for it (which may be None).
+    With use_graphql, keys are looked up in batches through the GraphQL API instead."""
+    keys = list(keys)
+
+    if use_graphql:
+        return resolveRefsWithGraphQL(keys, token, concurrency)
+
+    def lookup(key):
+        owner, repository, number = key
+        return getIssue(owner, repository, number, token)
+
+    if concurrency <= 1 or len(keys) <= 1:
+        issues = {key: lookup(key) for key in keys}
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(keys))) as pool:
+            issues = dict(zip(keys, pool.map(lookup, keys)))
+
+    retry = takeRetries(keys)
+    if retry:
+        issues.update(resolveRefs(retry, token, concurrency))
+    return issues
+
+
+def resolveRefsWithGraphQL(keys, token: str, concurrency: int = DEFAULT_CONCURRENCY) -> dict:
+    """Look up keys in batches, one GraphQL query per batch, using and filling the issue cache."""
+    cache = issueCache()
+    issues = {}
+    wanted = []
+    for key in keys:
+        issue, _ = checkIssueCache(cache, *key)
+        if issue is not None or knownMissing(cache, *key):
+            issues[key] = issue
+        else:
+            wanted.append(key)
+
+    if offline:
+        issues.update(dict.fromkeys(wanted))
+        return issues
+
+    batches = graphql.batched(wanted)
+    if not batches:
+        return issues
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+        for found, missing, failed in pool.map(lambda batch: graphql.lookUpIssues(batch, token), batches):
+            issues.update(found)
+            for key in found:
+                if failed and key not in missing:
+                    retry_queue.add(key)
+                else:
+                    retry_queue.forget(key)
+            if failed:
+                stats.count("lookups.failed", len(found) - len(missing))
+            if cache is not None:
+                for (owner, repository, number), issue in found.items():
+                    if issue:
+                        cache.put(owner, repository, number, issue.title, issue.html_url)
+                for key in missing:
+                    cache.putMissing(*key)
+
+    retry = takeRetries(wanted)
+    if retry:
+        issues.update(resolveRefsWithGraphQL(retry, token, concurrency))
+    return issues
+
+
+def resolveRefsBy(
+    keys, deadline: float, token: object = None, concurrency: int = DEFAULT_CONCURRENCY
+) -> tuple:
+    """Look up keys with getIssue, like resolveRefs, but only until deadline, a time.monotonic() time.
+
+    Keys in the issue index or fresh in the cache are resolved first, and then the rest are looked up in order,
+    up to `concurrency` at once. Lookups are made in daemon threads, so those still going at the deadline don't
+    hold anything up. They don't wait for other processes past it, and no more are started, but a request
+    already made can't be taken back: it finishes in the background, and what it finds isn't used. If the
+    cache is closed first, which releases its claims, it's dropped.
+
+    Returns a dict like resolveRefs, and a list of the keys that weren't looked up by the deadline, or failed,
+    in order, so they can be tried again later."""
+    cache = issueCache()
+    issues = {}
+    wanted = deque()
+    for key in keys:
+        issue, _ = checkIssueCache(cache, *key)
+        if issue is not None or offline or knownMissing(cache, *key):
+            issues[key] = issue
+        else:
+            wanted.append(key)
+    ordered = list(wanted)
+
+    found = {}
+    failed = set()
+    done = threading.Condition()
+    given_up = threading.Event()
+
+    def lookUp():
+        deadline_lookups.deadline = deadline
+        while True:
+            with done:
+                if not wanted or time.monotonic() >= deadline:
+                    return
+                key = wanted.popleft()
+            deadline_lookups.failed = False
+            try:
+                issue = getIssue(*key, token)
+            except sqlite3.ProgrammingError:
+                if given_up.is_set():
+                    return  # the cache was closed after the deadline, and nobody wants this any more
+                raise
+            with done:
+                found[key] = issue
+                if deadline_lookups.failed:
+                    failed.add(key)
+                done.notify()
+
+    for _ in range(min(concurrency, len(ordered))):
+        threading.Thread(target=lookUp, daemon=True).start()
+    with done:
+        done.wait_for(lambda: len(found) == len(ordered), max(deadline - time.monotonic(), 0))
+        # Lookups still going carry on adding to found, so take what there is now.
+        resolved = {key: issue for key, issue in found.items() if key not in failed}
+        unresolved = list(failed)
+        given_up.set()
+
+    # Whoever we give the failed ones back to tries them again, so they're not queued here too.
+    retry_queue.take(unresolved)
+    issues.update(resolved)
+    skipped = [key for key in ordered if key not in resolved]
+    stats.count("lookups.skipped", len(skipped))
+    return issues, skipped
+
+
+def substituteMatch(reference, default_owner, default_repository, token, issues=None):
+    key = refKey(reference, default_owner, default_repository)
+
+    if key:
+        if issues is not None:
+            issue = issues.get(key)
+        else:
+            owner, repository, number = key
+            issue = getIssue(owner, repository, number, token)
         if issue:
-            html_url = issue["html_url"]
-            title = issue["title"]
-            # TODO do we need to escape [] or anything?
-            return f"[{title} #{number}]({html_url})"
+            return markdownLink(issue, key[2])
     # if we didn't find an issue, return the original text, so we don't change anything
-    return match.group(0)
+    return reference.text
+
+
+def markdownLink(issue, number) -> str:
+    """Return the Markdown link that a reference to issue, by number, is expanded to."""
+    # TODO do we need to escape [] or anything?
+    return f"[{issue.title} #{number}]({issue.html_url})"
 
 
 def expandRefsToMarkdown(
@@ -89,21 +745,394 @@ def expandRefsToMarkdown(
     token: object = None,
     default_owner: object = None,
     default_repository: object = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_graphql: bool = False,
+    markdown: bool = True,
 ) -> str:
+    # With markdown, references in code, links and HTML are left alone.
+    # First, find everything text refers to, so we can look it all up at once,
+    # instead of waiting on each lookup in turn as we substitute.
+    with stats.timer("scan"):
+        regions = proseRegions(text) if markdown else None
+        keys = findRefs(text, default_owner, default_repository, regions)
+    stats.count("keys.unique", len(keys))
+    with stats.timer("resolve"):
+        issues = resolveRefs(keys, token, concurrency, use_graphql)
+    with stats.timer("substitute"):
+        return substituteRefs(text, issues, default_owner, default_repository, regions)
+
+
+class Expansion(NamedTuple):
+    text: str
+    # the (owner, repository, number) keys of references left as they were, because they weren't looked up in time
+    skipped: list
+
+
+def expandRefsWithin(
+    text: str,
+    seconds: float,
+    token: object = None,
+    default_owner: object = None,
+    default_repository: object = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    markdown: bool = True,
+) -> Expansion:
+    """Expand references in text like expandRefsToMarkdown, but within about `seconds` seconds, however slow
+    GitHub is.
+
+    References that weren't looked up in time, or that failed for the time being, are left as they are, and
+    their keys returned, in the order they first appear, so they can be looked up later, like in the
+    background, to be cached for next time."""
+    deadline = time.monotonic() + seconds
+    with stats.timer("scan"):
+        regions = proseRegions(text) if markdown else None
+        keys = dict.fromkeys(
+            key
+            for key in (
+                refKey(ref, default_owner, default_repository) for ref in findMatches(text, regions)
+            )
+            if key is not None
+        )
+    stats.count("keys.unique", len(keys))
+    with stats.timer("resolve"):
+        issues, skipped = resolveRefsBy(keys, deadline, token, concurrency)
+    with stats.timer("substitute"):
+        return Expansion(substituteRefs(text, issues, default_owner, default_repository, regions), skipped)
+
+
+def substituteRefs(
+    text: str,
+    issues: dict,
+    default_owner: object = None,
+    default_repository: object = None,
+    regions: list = None,
+) -> str:
+    """Replace every reference in text with a link to the issue it refers to, from issues (as resolveRefs returns).
+
+    Given (start, end) regions of text, like proseRegions returns, only references in them are replaced."""
     substituter = partial(
         substituteMatch,
         default_owner=default_owner,
         default_repository=default_repository,
-        token=token,
+        token=None,
+        issues=issues,
     )
-    # now substituter can be called with just one argument, the match
+    # now substituter can be called with just one argument, the reference
+
+    # make all the substitutions at one time, so we never rescan text we've already expanded
+    pieces = []
+    pos = 0
+    for reference in findMatches(text, regions):
+        pieces.append(text[pos : reference.start])
+        pieces.append(substituter(reference))
+        pos = reference.end
+    pieces.append(text[pos:])
+    return "".join(pieces)
+
+
+# a line of nothing but whitespace, which ends a Markdown paragraph
+blank_line_regex = re.compile(r"^[ \t\r]*\n", re.M)
+
+
+def readChunks(stream, size: int = CHUNK_SIZE, paragraphs: bool = False):
+    """Read a text stream in chunks of about size characters, yielding them.
+
+    References never contain whitespace, and none of our regexes look past whitespace for context,
+    so chunks only ever end just after whitespace. Expanding chunk by chunk is then the same as expanding
+    everything at once. (A long run without whitespace is kept together, however long it is.)
+
+    With paragraphs, chunks only end just after blank lines, so no Markdown paragraph, with its code spans
+    and links, is split between chunks, unless it's longer than MAX_PARAGRAPH."""
+    pending = []
+    pending_length = 0
+    # whether what we've read so far ends partway through a blank line
+    on_blank_line = True
+    for block in iter(partial(stream.read, size), ""):
+        cut = 0
+        if paragraphs:
+            for match in blank_line_regex.finditer(block):
+                if match.start() or on_blank_line:
+                    cut = match.end()
+            line_start = block.rfind("\n") + 1
+            on_blank_line = (line_start > 0 or on_blank_line) and not block[line_start:].strip(" \t\r")
+        if not cut and (not paragraphs or pending_length + len(block) > max(size, MAX_PARAGRAPH)):
+            cut = max(block.rfind(c) for c in "\n\t ") + 1
+        if cut:
+            yield "".join(pending) + block[:cut]
+            pending = [block[cut:]]
+            pending_length = len(pending[0])
+        else:
+            pending.append(block)
+            pending_length += len(block)
+    tail = "".join(pending)
+    if tail:
+        yield tail
+
+
+def expandStream(
+    input,
+    output,
+    token: object = None,
+    default_owner: object = None,
+    default_repository: object = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_graphql: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    window: int = STREAM_WINDOW,
+    warm_over: int = None,
+    markdown: bool = True,
+):
+    """Expand references from the text stream input, writing the result to output as we go.
+
+    The references in up to `window` chunks are looked up ahead of the chunk being written, so lookups
+    overlap reading and writing, and memory use doesn't grow with the size of the input.
+    Chunks are written in the order they were read. With warm_over, repositories are warmed up as soon as
+    more than warm_over of their issues have been referenced. With markdown, references in code, links
+    and HTML are left alone.
+
+    Input without references is copied through without starting any threads."""
+    scanner = MarkdownScanner() if markdown else None
+    in_flight = deque()
+    # key -> [future of a resolveRefs dict with the key in it, how many chunks in flight want it]
+    lookups = {}
+    # (owner, repository) -> how many of its issues have been referenced, for warm_over
+    repository_counts = {}
+
+    def writeNext():
+        text, keys, regions = in_flight.popleft()
+        issues = {}
+        with stats.timer("stream.wait"):
+            for key in keys:
+                lookup = lookups[key]
+                issues[key] = lookup[0].result()[key]
+                lookup[1] -= 1
+                if not lookup[1]:
+                    del lookups[key]
+        with stats.timer("substitute"):
+            text = substituteRefs(text, issues, default_owner, default_repository, regions)
+        output.write(text)
+
+    pool = None
+
+    def submit(*args):
+        nonlocal pool
+        if pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+        return pool.submit(resolveRefs, *args)
+
+    try:
+        for text in readChunks(input, chunk_size, paragraphs=markdown):
+            stats.count("stream.chunks")
+            with stats.timer("scan"):
+                regions = scanner.scan(text) if markdown else None
+                keys = findRefs(text, default_owner, default_repository, regions)
+            new_keys = [key for key in keys if key not in lookups]
+            # (The same key can come up again after it's left the window, so this is an overestimate.)
+            stats.count("keys.unique", len(new_keys))
+            if warm_over is not None:
+                warmBusyRepositories(new_keys, token, warm_over, repository_counts)
+            if use_graphql and new_keys:
+                # one future for the whole chunk, so it's looked up in as few queries as possible
+                future = submit(new_keys, token, 1, True)
+                for key in new_keys:
+                    lookups[key] = [future, 0]
+            else:
+                for key in new_keys:
+                    lookups[key] = [submit([key], token, 1), 0]
+            for key in keys:
+                lookups[key][1] += 1
+
+            in_flight.append((text, keys, regions))
+            if len(in_flight) > window:
+                writeNext()
+        while in_flight:
+            writeNext()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def expandFiles(
+    paths,
+    output=None,
+    token: object = None,
+    default_owner: object = None,
+    default_repository: object = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_graphql: bool = False,
+    in_place: bool = False,
+    window: int = STREAM_WINDOW,
+    warm_over: int = None,
+    markdown: bool = True,
+    manifest=None,
+    deadline: float = None,
+    skipped: list = None,
+) -> int:
+    """Expand references in many files, looking up each reference only once however many files it's in.
+
+    Every file is scanned first, then all of their references are looked up together, then the files are
+    expanded, `concurrency` at a time. With in_place, each file is rewritten where it is, unless it has
+    nothing to expand. Otherwise, they're written to output one after the other, in order.
+    With warm_over, repositories with more than warm_over references are warmed up before anything is looked up.
+    Files that can't be read are reported and skipped. Returns how many files were rewritten.
+    With markdown, references in code, links and HTML are left alone.
+    With manifest, an incremental.Manifest, only what's changed since the last time is scanned and expanded,
+    and what's left with nothing to expand is recorded in it.
+    With deadline, a time.monotonic() time, lookups are given up on then, like resolveRefsBy gives up on them,
+    and the keys of the references left as they are added to skipped, a list, if there is one."""
+    if manifest is not None:
+        from issue_expander import incremental
+
+    unchanged = set()
+
+    def regionsOf(text):
+        return proseRegions(text) if markdown else None
+
+    def scan(path):
+        if manifest is not None and manifest.unchanged(path):
+            stats.count("files.unchanged")
+            unchanged.add(path)
+            return set()
+        try:
+            text = files.readFile(path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Unable to read {path}: {e}", file=sys.stderr)
+            return None
+        if manifest is not None:
+            known = manifest.paragraphs(path)
+            return incremental.findRefs(text, known, default_owner, default_repository, markdown)
+        return findRefs(text, default_owner, default_repository, regionsOf(text))
+
+    def expand(path):
+        text = files.readFile(path)
+        if path in unchanged:
+            return text
+        if manifest is None:
+            expanded = substituteRefs(text, issues, default_owner, default_repository, regionsOf(text))
+        else:
+            expanded, finished, complete = incremental.substitute(
+                text,
+                manifest.paragraphs(path),
+                issues,
+                default_owner,
+                default_repository,
+                markdown,
+                in_place,
+            )
+        if in_place and expanded != text:
+            files.writeAtomically(path, expanded)
+        if manifest is not None:
+            manifest.record(path, finished, expanded if complete else None)
+        if not in_place:
+            return expanded
+        # (If the references in it all failed to resolve, it's left be.)
+        return None if expanded == text else expanded
 
-    out = text
-    # make all the substitutions for this regex at one time,
-    # then check that output string with the next regex
+    from concurrent.futures import ThreadPoolExecutor
 
-    out = re.sub(megaregex, substituter, out)
-    return out
+    rewritten = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        with stats.timer("scan"):
+            scanned = list(pool.map(scan, paths))
+        stats.count("files.scanned", len(paths))
+
+        keys = set().union(*(keys for keys in scanned if keys is not None))
+        stats.count("keys.unique", len(keys))
+        if warm_over is not None:
+            warmBusyRepositories(keys, token, warm_over, {})
+        with stats.timer("resolve"):
+            if deadline is None:
+                issues = resolveRefs(keys, token, concurrency, use_graphql)
+            else:
+                issues, late = resolveRefsBy(sorted(keys), deadline, token, concurrency)
+                if skipped is not None:
+                    skipped.extend(late)
+
+        # Files without references are copied to output as they are, and not touched at all in place.
+        # With a manifest, files that have changed are expanded, even without references, to record them.
+        wanted = [
+            path
+            for path, keys in zip(paths, scanned)
+            if keys is not None
+            and (keys or not in_place or (manifest is not None and path not in unchanged))
+        ]
+        stats.count("files.skipped", len(paths) - len(wanted))
+
+        in_flight = deque()
+
+        def finishNext():
+            nonlocal rewritten
+            expanded = in_flight.popleft().result()
+            if not in_place:
+                output.write(expanded)
+            elif expanded is not None:
+                rewritten += 1
+
+        with stats.timer("substitute"):
+            # Keep a few files ahead of the one being finished, without holding them all in memory.
+            for path in wanted:
+                in_flight.append(pool.submit(expand, path))
+                if len(in_flight) > window * concurrency:
+                    finishNext()
+            while in_flight:
+                finishNext()
+
+    stats.count("files.rewritten", rewritten)
+    return rewritten
+
+
+def expandWithDaemon(remote, inputs, paths, in_place, token, default_source, markdown, use_graphql):
+    """Have a daemon, through remote, a daemon.Client, expand what the CLI was asked to, and close remote."""
+    from issue_expander import daemon
+
+    options = dict(token=token, default_source=default_source, markdown=markdown, use_graphql=use_graphql)
+    try:
+        if paths is not None:
+            daemon.expandPaths(remote, paths, sys.stdout, in_place, **options)
+        else:
+            writeInput(remote.expand(readInput(inputs[0]), **options))
+    except daemon.DaemonError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        remote.close()
+
+
+def readInput(path) -> str:
+    """Read the CLI's input, a file or - (stdin), leaving its line endings, and any bytes that aren't UTF-8,
+    as they are, like streaming it as bytes does."""
+    with click.open_file(path, "rb") as input:
+        return input.read().decode("utf-8", "surrogateescape")
+
+
+def writeInput(text):
+    """Write text, read with readInput and expanded, to stdout, with its line endings and bytes as they were."""
+    sys.stdout.flush()
+    sys.stdout.buffer.write(text.encode("utf-8", "surrogateescape"))
+    sys.stdout.buffer.flush()
+
+
+def listRefsOf(inputs, paths, default_owner, default_repository, markdown, jobs, show_stats, stats_format):
+    """List the references in what the CLI was asked to, for --list-refs."""
+    from issue_expander import extract
+
+    options = dict(
+        default_owner=default_owner,
+        default_repository=default_repository,
+        markdown=markdown,
+        jobs=jobs or os.cpu_count() or 1,
+    )
+    run_stats = stats.Stats() if show_stats or stats_format else None
+    with stats.useSink(run_stats), stats.timer("run"):
+        if paths is None and inputs[0] == "-":
+            with click.open_file("-", "rb") as input:
+                extract.listRefs(extract.streamChunks(input, markdown), sys.stdout, **options)
+        else:
+            extract.listRefs(extract.fileChunks(paths or inputs, markdown), sys.stdout, **options)
+    if run_stats is not None:
+        print(run_stats.report(stats_format or "text"), file=sys.stderr)
 
 
 @click.command()
@@ -120,9 +1149,192 @@ def expandRefsToMarkdown(
     help="GitHub token for looking up issue references. You may want to use the environment variable "
     "ISSUE_EXPANDER_GITHUB_TOKEN instead.",
 )
+@click.option(
+    "--concurrency",
+    metavar="N",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    help="Look up at most N issue references at once.",
+)
+@click.option(
+    "--cache-dir",
+    metavar="DIR",
+    envvar="ISSUE_EXPANDER_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    help="Keep the issue cache in DIR. (Default: issue-expander in your XDG cache directory)",
+)
+@click.option("--no-cache", is_flag=True, help="Don't read or write the on-disk issue cache.")
+@click.option(
+    "--cache-ttl",
+    metavar="SECONDS",
+    type=click.IntRange(min=0),
+    default=DEFAULT_TTL,
+    show_default=True,
+    help="Use cached issues for up to SECONDS before looking them up again.",
+)
+@click.option(
+    "--missing-ttl",
+    metavar="SECONDS",
+    type=click.IntRange(min=0),
+    default=DEFAULT_MISSING_TTL,
+    show_default=True,
+    help="Remember for SECONDS that a reference is to an issue that doesn't exist, instead of looking it up again.",
+)
+@click.option(
+    "--graphql",
+    "use_graphql",
+    is_flag=True,
+    help="Look up references in batches of up to 100 with GitHub's GraphQL API. Needs a GitHub token.",
+)
+@click.option(
+    "--max-wait",
+    metavar="SECONDS",
+    type=click.FloatRange(min=0),
+    default=ratelimit.DEFAULT_MAX_WAIT,
+    show_default=True,
+    help="Wait up to SECONDS for GitHub's rate limits to allow a lookup before giving up on it.",
+)
+@click.option(
+    "--deadline",
+    metavar="SECONDS",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Finish within about SECONDS, using cached issues first, and leaving references that weren't looked up "
+    "in time as they are. They're listed on stderr.",
+)
+@click.option(
+    "--stats",
+    "show_stats",
+    is_flag=True,
+    help="When done, print counts and timings of lookups, cache hits, requests and so on to stderr.",
+)
+@click.option(
+    "--stats-format",
+    type=click.Choice(["text", "json"]),
+    help="Print --stats as text or as JSON. Implies --stats. (Default: text)",
+)
+@click.option(
+    "--markdown/--plain-text",
+    default=True,
+    show_default=True,
+    help="Leave references in Markdown code, links and HTML alone, or expand them anywhere in the text.",
+)
+@click.option(
+    "-i",
+    "--in-place",
+    is_flag=True,
+    help="Rewrite each FILE with its references expanded, instead of printing them. "
+    "Files with nothing to expand are left alone.",
+)
+@click.option(
+    "--warm",
+    "warm_sources",
+    metavar="USER/REPO",
+    multiple=True,
+    help="Before expanding anything, cache every issue in USER/REPO, a hundred per request. "
+    "After the first time, only issues that have changed are fetched. Can be given more than once.",
+)
+@click.option(
+    "--warm-over",
+    metavar="N",
+    type=click.IntRange(min=0),
+    help="Warm up the cache, like --warm, for any repository with more than N distinct references in the input.",
+)
+@click.option(
+    "--index",
+    "index_path",
+    metavar="FILE",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Look up references in FILE, an issue index made with --build-index, before the cache and GitHub.",
+)
+@click.option(
+    "--offline",
+    "work_offline",
+    is_flag=True,
+    help="Don't go to GitHub at all. Only use --index and the issue cache, even where it's stale.",
+)
+@click.option(
+    "--build-index",
+    metavar="FILE",
+    type=click.Path(dir_okay=False),
+    help="When done, write every issue in the cache, and in any --from-jsonl dumps, to FILE, "
+    "an issue index for --index.",
+)
+@click.option(
+    "--from-jsonl",
+    "jsonl_paths",
+    metavar="DUMP",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Put the issues in DUMP in the --build-index index too. DUMP has a JSON object with a title and "
+    "an html_url on each line, like the issues GitHub's REST API returns.",
+)
+@click.option(
+    "--serve",
+    "serve_path",
+    metavar="SOCKET",
+    type=click.Path(dir_okay=False),
+    help="Keep running, expanding text for --connect on the Unix socket SOCKET, with the issue cache, "
+    "connections and lookups kept warm between requests.",
+)
+@click.option(
+    "--connect",
+    "connect_path",
+    metavar="SOCKET",
+    type=click.Path(dir_okay=False),
+    help="Have the issue-expander running --serve on SOCKET expand FILE, with its own options, like --cache-dir. "
+    "If there isn't one, FILE is expanded here.",
+)
+@click.option(
+    "--incremental",
+    "manifest_path",
+    metavar="MANIFEST",
+    type=click.Path(dir_okay=False),
+    help="Remember in MANIFEST what's been expanded, and next time, skip the files and paragraphs that haven't "
+    "changed since.",
+)
+@click.option(
+    "--list-refs",
+    is_flag=True,
+    help="Instead of expanding references, print a JSON object for each one, a line each, with its file, "
+    "byte offset, kind, owner, repository, number and text. Nothing is looked up.",
+)
+@click.option(
+    "--jobs",
+    metavar="N",
+    type=click.IntRange(min=1),
+    help="Scan for --list-refs in N processes at once. (Default: one per CPU)",
+)
 @click.version_option()
-@click.argument("input", metavar="FILE", type=click.File("r"))
-def cli(input, github_token=None, default_source=None):
+@click.argument("inputs", metavar="FILE...", nargs=-1)
+def cli(
+    inputs,
+    github_token=None,
+    default_source=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    cache_dir=None,
+    no_cache=False,
+    cache_ttl=DEFAULT_TTL,
+    missing_ttl=DEFAULT_MISSING_TTL,
+    use_graphql=False,
+    max_wait=ratelimit.DEFAULT_MAX_WAIT,
+    deadline=None,
+    show_stats=False,
+    stats_format=None,
+    markdown=True,
+    in_place=False,
+    warm_sources=(),
+    warm_over=None,
+    index_path=None,
+    work_offline=False,
+    build_index=None,
+    jsonl_paths=(),
+    serve_path=None,
+    connect_path=None,
+    manifest_path=None,
+    list_refs=False,
+    jobs=None,
+):
     """Turn references like "foo/bar#123" into Markdown links, like
 
     "[Prevent side fumbling #123](https://github.com/foo/bar/pull/123)"
@@ -135,16 +1347,32 @@ def cli(input, github_token=None, default_source=None):
 
     To interpret references like `#1138` as `adamwolf/issue-expander#1138`,
     specify defaults using `--default-source`.
-    """
 
-    out = []
+    FILE can be - for stdin, a directory to expand the Markdown files in, or a glob pattern like
+    "docs/**/*.md". References in all of the files are looked up together, so each is only looked up once.
+
+    References in code blocks, code spans, links and HTML are left as they are, unless --plain-text is given.
+
+    To skip starting up each time, like in an editor or a pre-commit hook, keep `issue-expander --serve SOCKET`
+    running, and run `issue-expander --connect SOCKET` instead.
+
+    To expand the same files again and again, like in a nightly build, use --incremental MANIFEST, and only
+    what's changed since the last time is scanned and looked up.
+
+    To list the references in FILE, without expanding them, use --list-refs. Big inputs are split up and
+    scanned in many processes at once.
+
+    Many runs at once, like parallel CI jobs, can share the issue cache. Each issue is only looked up by one of
+    them, and the others wait for it.
+    """
+    started = time.monotonic()
 
     default_owner = None
     default_repository = None
 
     if default_source is not None:
         # get owner/repository from default_source using a regex
-        match = re.fullmatch(r"(?P<owner>[a-zA-Z0-9.-]+)/(?P<repository>[a-zA-Z0-9.-]+)", default_source)
+        match = source_regex.fullmatch(default_source)
         if match:
             default_owner = match.group("owner")
             default_repository = match.group("repository")
@@ -153,6 +1381,251 @@ def cli(input, github_token=None, default_source=None):
             print("Error: default source must be in the format 'owner/repository'", file=sys.stderr)
             sys.exit(1)
 
-    for line in input:
-        out = expandRefsToMarkdown(line, github_token, default_owner, default_repository)
-        print(out, end="")
+    if use_graphql and not github_token:
+        print("Error: --graphql needs a GitHub token", file=sys.stderr)
+        sys.exit(1)
+
+    warm_repositories = []
+    for source in warm_sources:
+        match = source_regex.fullmatch(source)
+        if not match:
+            print("Error: --warm must be in the format 'owner/repository'", file=sys.stderr)
+            sys.exit(1)
+        warm_repositories.append((match.group("owner"), match.group("repository")))
+
+    if (warm_repositories or warm_over is not None) and no_cache:
+        print("Error: --warm and --warm-over need the issue cache", file=sys.stderr)
+        sys.exit(1)
+
+    if warm_repositories and work_offline:
+        print("Error: --warm can't be used --offline", file=sys.stderr)
+        sys.exit(1)
+
+    if serve_path is not None and (inputs or connect_path is not None):
+        print("Error: --serve doesn't expand FILE itself, or --connect to another daemon", file=sys.stderr)
+        sys.exit(1)
+
+    if connect_path is not None and (
+        warm_repositories
+        or warm_over is not None
+        or index_path
+        or work_offline
+        or build_index
+        or show_stats
+        or manifest_path
+    ):
+        print(
+            "Error: --connect can't be used with --warm, --warm-over, --index, --offline, --build-index, --stats "
+            "or --incremental",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if list_refs and (
+        in_place
+        or warm_repositories
+        or warm_over is not None
+        or build_index
+        or serve_path
+        or connect_path
+        or manifest_path
+    ):
+        print(
+            "Error: --list-refs can't be used with --in-place, --warm, --warm-over, --build-index, --serve, "
+            "--connect or --incremental",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if deadline is not None and (
+        use_graphql or warm_over is not None or serve_path or connect_path or list_refs
+    ):
+        print(
+            "Error: --deadline can't be used with --graphql, --warm-over, --serve, --connect or --list-refs",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if not (inputs or warm_repositories or build_index or serve_path):
+        raise click.UsageError("Missing argument 'FILE...'.")
+
+    index = None
+    if index_path is not None:
+        try:
+            index = IssueIndex(index_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    if manifest_path is not None and "-" in inputs:
+        print("Error: --incremental needs files to expand, not - (stdin)", file=sys.stderr)
+        sys.exit(1)
+
+    # One file is streamed, like stdin, whether it's a regular file or not, like a pipe, which could only be
+    # read once. Only directories, and patterns, need finding files in.
+    paths = None
+    if inputs and (
+        in_place
+        or manifest_path
+        or len(inputs) > 1
+        or (inputs[0] != "-" and (os.path.isdir(inputs[0]) or not os.path.exists(inputs[0])))
+    ):
+        if "-" in inputs:
+            print("Error: - (stdin) can't be expanded with other files or in place", file=sys.stderr)
+            sys.exit(1)
+        try:
+            paths = files.findFiles(inputs)
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    if list_refs:
+        listRefsOf(
+            inputs, paths, default_owner, default_repository, markdown, jobs, show_stats, stats_format
+        )
+        return
+
+    if connect_path is not None:
+        from issue_expander import daemon
+
+        connection = daemon.connect(connect_path)
+        if connection is not None:
+            expandWithDaemon(
+                daemon.Client(connection),
+                inputs,
+                paths,
+                in_place,
+                github_token,
+                default_source,
+                markdown,
+                use_graphql,
+            )
+            return
+
+    if cache_dir is None:
+        cache_dir = defaultCacheDir()
+
+    # Runs that don't look anything up, like ones with no references, needn't touch the cache at all.
+    def openCache():
+        if no_cache:
+            return None
+        try:
+            return IssueCache(cache_dir, ttl=cache_ttl, missing_ttl=missing_ttl)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Unable to open issue cache in {cache_dir}: {e}", file=sys.stderr)
+            return None
+
+    manifest = None
+    if manifest_path is not None:
+        from issue_expander import incremental
+
+        manifest = incremental.Manifest(
+            manifest_path, {"default_source": default_source, "markdown": markdown}
+        )
+
+    skipped = None
+    client.sharedClient().timeout = client.DEFAULT_TIMEOUT
+    if deadline is not None:
+        skipped = []
+        # Nothing's worth waiting on for longer than we've got.
+        max_wait = min(max_wait, deadline)
+        client.sharedClient().timeout = deadline
+    rate_limiter = client.sharedClient().rate_limiter = ratelimit.RateLimiter(max_wait=max_wait)
+
+    run_stats = stats.Stats() if show_stats or stats_format else None
+
+    with useIssueCache(openCache), useIssueIndex(index), useOffline(work_offline):
+        with stats.useSink(run_stats), stats.timer("run"):
+            for owner, repository in warm_repositories:
+                cached = warmRepository(owner, repository, github_token)
+                if cached is not None:
+                    print(f"Cached {cached} issues from {owner}/{repository}.", file=sys.stderr)
+
+            if paths is not None:
+                expandFiles(
+                    paths,
+                    sys.stdout,
+                    github_token,
+                    default_owner,
+                    default_repository,
+                    concurrency,
+                    use_graphql,
+                    in_place,
+                    warm_over=warm_over,
+                    markdown=markdown,
+                    manifest=manifest,
+                    deadline=None if deadline is None else started + deadline,
+                    skipped=skipped,
+                )
+                if manifest is not None:
+                    try:
+                        manifest.save()
+                    except OSError as e:
+                        print(f"Unable to write manifest {manifest_path}: {e}", file=sys.stderr)
+            elif inputs and deadline is not None:
+                expansion = expandRefsWithin(
+                    readInput(inputs[0]),
+                    max(started + deadline - time.monotonic(), 0),
+                    github_token,
+                    default_owner,
+                    default_repository,
+                    concurrency,
+                    markdown,
+                )
+                writeInput(expansion.text)
+                skipped.extend(expansion.skipped)
+            elif inputs:
+                # Stream the input through, so we can handle more of it than fits in memory,
+                # while looking up the references in a good-sized piece of it at once,
+                # as bytes, so what doesn't change is never decoded, or copied more than it has to be.
+                from issue_expander import rewrite
+
+                sys.stdout.flush()
+                with click.open_file(inputs[0], "rb") as input:
+                    rewrite.expandBytes(
+                        input,
+                        sys.stdout.buffer,
+                        github_token,
+                        default_owner,
+                        default_repository,
+                        concurrency,
+                        use_graphql,
+                        warm_over=warm_over,
+                        markdown=markdown,
+                    )
+                sys.stdout.buffer.flush()
+
+            if serve_path is not None:
+                from issue_expander import daemon
+
+                try:
+                    daemon.serve(serve_path, concurrency, cache_ttl)
+                except OSError as e:
+                    print(f"Error: unable to serve on {serve_path}: {e}", file=sys.stderr)
+                    sys.exit(1)
+
+            if build_index is not None:
+                cache = issueCache()
+                issues = chain(cache.issues() if cache is not None else [], *map(readJSONL, jsonl_paths))
+                try:
+                    written = writeIndex(build_index, issues)
+                except (OSError, ValueError) as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                    sys.exit(1)
+                print(f"Wrote {written} issues to {build_index}.", file=sys.stderr)
+
+    if skipped:
+        print(
+            "Not looked up by the deadline, so left as they are: "
+            + ", ".join(f"{owner}/{repository}#{number}" for owner, repository, number in skipped),
+            file=sys.stderr,
+        )
+
+    if rate_limiter.deferred or rate_limiter.dropped:
+        print(
+            f"Rate limits delayed {rate_limiter.deferred} and dropped {rate_limiter.dropped} GitHub requests.",
+            file=sys.stderr,
+        )
+
+    if run_stats is not None:
+        print(run_stats.report(stats_format or "text"), file=sys.stderr)
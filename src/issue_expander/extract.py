@@ -0,0 +1,186 @@
+"""List every reference in big inputs, without looking any of them up, scanning pieces of them in many processes.
+
+Files are split into chunks of about LIST_CHUNK_SIZE bytes that end at the ends of lines (for Markdown, at blank
+lines, where they can), and each process reads and scans its own chunks, so the work is spread evenly however
+many files there are. stdin is read in chunks like expandStream reads it, and they're sent to the processes.
+
+A chunk is scanned as if it doesn't start in a fenced code block. Going through the results in order, we know
+whether it really did, and the few chunks that did are scanned again."""
+import io
+import json
+import os
+import re
+import sys
+from collections import deque
+from contextlib import ExitStack
+from functools import partial
+from typing import NamedTuple, Optional
+
+from issue_expander import stats
+from issue_expander.expander import MAX_PARAGRAPH, findMatches, readChunks, refKey
+from issue_expander.markdown import MarkdownScanner
+
+# Scan this many bytes of input in a process at once.
+LIST_CHUNK_SIZE = 4 * 1024 * 1024
+
+# a line of nothing but whitespace, like expander.blank_line_regex, but in bytes
+_blank_line = re.compile(rb"^[ \t\r]*\n", re.M)
+
+
+class Chunk(NamedTuple):
+    # the file it's part of, or - for stdin
+    path: str
+    # where it starts and ends in the file, in bytes
+    start: int
+    end: int
+    # what's in it, for stdin, or None, for files, so whoever scans it reads it
+    text: Optional[str]
+    # whether it starts at the start of a line
+    line_start: bool = True
+
+
+def _nextBoundary(f, offset: int, markdown: bool) -> int:
+    """Return where in the binary file f a chunk ending at about offset should end.
+
+    That's the start of the first line at or after offset, or, with markdown, just after the first blank line
+    from there, unless that's more than MAX_PARAGRAPH further on. (Or the end of the file.)"""
+    f.seek(offset - 1)
+    while True:
+        block = f.read(64 * 1024)
+        newline = block.find(b"\n")
+        if newline >= 0:
+            line_start = f.tell() - len(block) + newline + 1
+            break
+        if not block:
+            return f.tell()
+    if markdown:
+        f.seek(line_start)
+        blank_line = _blank_line.search(f.read(MAX_PARAGRAPH))
+        if blank_line:
+            return line_start + blank_line.end()
+    return line_start
+
+
+def fileChunks(paths, markdown: bool = True, size: int = LIST_CHUNK_SIZE):
+    """Yield Chunks of about size bytes that cover each file in paths, in order.
+
+    Files that can't be read are reported and skipped."""
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                length = os.fstat(f.fileno()).st_size
+                start = 0
+                while start < length:
+                    end = length if start + size >= length else _nextBoundary(f, start + size, markdown)
+                    yield Chunk(path, start, end, None)
+                    start = end
+        except OSError as e:
+            print(f"Unable to read {path}: {e}", file=sys.stderr)
+
+
+def streamChunks(input, markdown: bool = True, size: int = LIST_CHUNK_SIZE):
+    """Yield Chunks of the binary stream input, read like readChunks reads text."""
+    text_input = io.TextIOWrapper(input, encoding="utf-8", errors="surrogateescape", newline="")
+    start = 0
+    line_start = True
+    try:
+        for text in readChunks(text_input, size, paragraphs=markdown):
+            end = start + len(text.encode("utf-8", "surrogateescape"))
+            yield Chunk("-", start, end, text, line_start)
+            start = end
+            line_start = text.endswith("\n")
+    finally:
+        # so input isn't closed along with text_input
+        text_input.detach()
+
+
+def scanChunk(
+    chunk, default_owner=None, default_repository=None, markdown: bool = True, fence=None
+) -> tuple:
+    """Return a JSON Lines record for each reference in chunk, all in one string, and the code fence it ends in.
+
+    With markdown, references in code, links and HTML are left out, and fence is the code fence the chunk starts
+    in, like MarkdownScanner.fence. (Without it, chunks never end in a code block.)"""
+    text = chunk.text
+    if text is None:
+        with open(chunk.path, "rb") as f:
+            f.seek(chunk.start)
+            text = f.read(chunk.end - chunk.start).decode("utf-8", "surrogateescape")
+
+    regions = None
+    if markdown:
+        scanner = MarkdownScanner(fence, chunk.line_start)
+        regions = scanner.scan(text)
+        fence = scanner.fence
+
+    # Offsets are in bytes, so count the bytes between one reference and the next, unless they're all one byte.
+    all_ascii = text.isascii()
+    offset = chunk.start
+    pos = 0
+    records = []
+    for reference in findMatches(text, regions):
+        if all_ascii:
+            offset = chunk.start + reference.start
+        else:
+            offset += len(text[pos : reference.start].encode("utf-8", "surrogateescape"))
+            pos = reference.start
+        owner, repository, _ = refKey(reference, default_owner, default_repository) or (None, None, None)
+        record = {
+            "file": chunk.path,
+            "offset": offset,
+            "kind": reference.kind,
+            "owner": owner,
+            "repository": repository,
+            "number": int(reference.number),
+            "text": reference.text,
+        }
+        records.append(json.dumps(record) + "\n")
+    return "".join(records), fence
+
+
+def _inOrder(pool, function, items, window: int):
+    """Yield (item, function(item)) for each of items, in order, running up to window of them at once in pool."""
+    pending = deque()
+    for item in items:
+        pending.append((item, pool.submit(function, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def listRefs(
+    chunks, output, default_owner=None, default_repository=None, markdown: bool = True, jobs: int = 1
+) -> int:
+    """Write a JSON Lines record for every reference in chunks to output, in order, and return how many there were.
+
+    With jobs more than 1, chunks are scanned in that many processes at once."""
+    scan = partial(
+        scanChunk, default_owner=default_owner, default_repository=default_repository, markdown=markdown
+    )
+    listed = 0
+    fence = None
+    with ExitStack() as stack:
+        if jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            scanned = _inOrder(pool, scan, chunks, window=2 * jobs)
+        else:
+            scanned = ((chunk, scan(chunk)) for chunk in chunks)
+
+        for chunk, (records, end_fence) in scanned:
+            stats.count("chunks.scanned")
+            if chunk.start == 0:
+                # a new file, which starts outside any code block
+                fence = None
+            if fence is not None:
+                stats.count("chunks.rescanned")
+                records, end_fence = scan(chunk, fence=fence)
+            fence = end_fence
+            output.write(records)
+            listed += records.count("\n")
+    stats.count("references.listed", listed)
+    return listed
@@ -0,0 +1,80 @@
+"""Find the files to expand, and rewrite them safely."""
+import glob
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# When given a directory, expand the files in it with these suffixes.
+MARKDOWN_SUFFIXES = (".md", ".markdown")
+
+
+def _walk(directory, suffixes):
+    for root, directories, filenames in os.walk(directory):
+        # Skip hidden directories, like .git, and go through the rest in a predictable order.
+        directories[:] = sorted(d for d in directories if not d.startswith("."))
+        for filename in sorted(filenames):
+            if filename.lower().endswith(suffixes):
+                yield os.path.join(root, filename)
+
+
+def findFiles(patterns, suffixes=MARKDOWN_SUFFIXES) -> list:
+    """Turn a list of files, directories and glob patterns into a list of files, in order, without repeats.
+
+    Directories are searched recursively for files ending in one of suffixes, skipping hidden directories.
+    Patterns can use ** to match any number of directories.
+    Raises FileNotFoundError if something isn't there, or a pattern doesn't match anything."""
+    found = {}
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            paths = [pattern]
+        elif glob.escape(pattern) != pattern:
+            paths = sorted(glob.glob(pattern, recursive=True))
+            if not paths:
+                raise FileNotFoundError(f"No files match {pattern}")
+        else:
+            raise FileNotFoundError(f"No such file or directory: {pattern}")
+
+        for path in paths:
+            if os.path.isdir(path):
+                for file in _walk(path, suffixes):
+                    found.setdefault(os.path.normpath(file), None)
+            else:
+                found.setdefault(os.path.normpath(path), None)
+    return list(found)
+
+
+def readFile(path) -> str:
+    """Read a UTF-8 text file, leaving its line endings alone."""
+    with open(path, encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+@contextmanager
+def atomicFile(path, mode: str = "w", **kwargs):
+    """Open a temporary file next to path for writing, and rename it over path when the with block ends.
+
+    So nothing ever sees path half written, and if the block fails, path is left alone. An existing file keeps
+    its permissions, and if path is a symlink, the file it points to is replaced."""
+    path = os.path.realpath(path)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".issue-expander-", suffix=".tmp")
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+        if os.path.exists(path):
+            shutil.copymode(path, temporary)
+        else:
+            # mkstemp makes files only we can read, so give new files the usual permissions instead.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def writeAtomically(path, text: str):
+    """Replace the contents of the file at path with text, with atomicFile."""
+    with atomicFile(path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
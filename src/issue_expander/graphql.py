@@ -0,0 +1,121 @@
+"""Look up many issues in one request, with GitHub's GraphQL API."""
+import sys
+
+from issue_expander import client, stats
+from issue_expander.cache import Issue
+from issue_expander.ratelimit import RateLimitExceeded
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+# GitHub limits how many nodes one query may ask for, and how complex it may be.
+# A hundred issues (from at most a hundred repositories) is comfortably under both.
+MAX_BATCH_SIZE = 100
+
+# GraphQL's Int is 32 bits, so there's no asking for an issue numbered more than this, and no such issue.
+MAX_NUMBER = 2**31 - 1
+
+# issueOrPullRequest is a union, so we have to ask for the fields of each kind separately.
+ISSUE_FIELDS = "... on Issue { title url } ... on PullRequest { title url }"
+
+
+def batched(keys, size=None) -> list:
+    """Split (owner, repository, number) keys into batches small enough for one query each."""
+    size = size or MAX_BATCH_SIZE
+    # Sorting keeps issues from the same repository together, so they share a repository node.
+    keys = sorted(keys)
+    return [keys[start : start + size] for start in range(0, len(keys), size)]
+
+
+def buildQuery(keys):
+    """Return a query that looks up every key, and a dict from its (repository, issue) aliases to the keys.
+
+    GraphQL doesn't let us ask for the same field twice with different arguments, so every
+    repository and every issue in it gets its own alias, like r0 and i3."""
+    import json
+
+    repositories = {}
+    for key in keys:
+        owner, repository, number = key
+        repositories.setdefault((owner, repository), []).append(key)
+
+    aliases = {}
+    parts = []
+    for r, ((owner, repository), repository_keys) in enumerate(repositories.items()):
+        issues = []
+        for i, key in enumerate(repository_keys):
+            aliases[(f"r{r}", f"i{i}")] = key
+            issues.append(f"i{i}: issueOrPullRequest(number: {int(key[2])}) {{ {ISSUE_FIELDS} }}")
+        # json.dumps makes a properly escaped GraphQL string literal
+        parts.append(
+            f"r{r}: repository(owner: {json.dumps(owner)}, name: {json.dumps(repository)}) "
+            f"{{ {' '.join(issues)} }}"
+        )
+    return "query { " + " ".join(parts) + " }", aliases
+
+
+def getIssues(keys, token: str) -> dict:
+    """Look up a batch of (owner, repository, number) keys in one query.
+
+    Returns a dict mapping every key to an Issue, like getIssue does,
+    or to None if it couldn't be found."""
+    return lookUpIssues(keys, token)[0]
+
+
+def lookUpIssues(keys, token: str) -> tuple:
+    """Look up a batch of keys like getIssues, and say why the ones that weren't found weren't.
+
+    Returns (issues, missing, failed): the dict getIssues returns, the set of keys that don't exist,
+    and whether the whole batch failed for the time being, like when GitHub had trouble, so it's worth
+    trying again soon. (When the rate limiter gives up on a batch, it isn't.)"""
+    import http.client
+    import json
+
+    keys = list(keys)
+    issues = dict.fromkeys(keys)
+    # One number too big for an Int would fail the whole query, and everything else in it.
+    missing = {key for key in keys if int(key[2]) > MAX_NUMBER}
+    if len(missing) == len(keys):
+        return issues, missing, False
+    query, aliases = buildQuery([key for key in keys if key not in missing])
+
+    headers = {"Accept": "application/json", "Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer: {token}"
+
+    try:
+        response = client.request(
+            "POST", GRAPHQL_URL, headers, json.dumps({"query": query}).encode("utf-8")
+        )
+    except RateLimitExceeded:
+        print("Unable to look up issues due to rate limit error.", file=sys.stderr)
+        return issues, missing, False
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Unable to look up issues with GraphQL: {e}", file=sys.stderr)
+        return issues, missing, True
+
+    if response.status in (403, 429):  # "rate limit exceeded"
+        print("Unable to look up issues due to rate limit error.", file=sys.stderr)
+    elif response.status == 401:
+        print("Unable to look up issues with GraphQL. Check your token.", file=sys.stderr)
+    if response.status != 200:
+        return issues, missing, response.status in (403, 429) or response.status >= 500
+
+    try:
+        with stats.timer("json.parse"):
+            j = json.loads(response.body)
+    except json.JSONDecodeError:
+        print(f"Unable to parse response from {GRAPHQL_URL}", file=sys.stderr)
+        return issues, missing, True
+
+    # Missing repositories and issues come back as nulls (with a NOT_FOUND error that we don't need).
+    # Without data at all, the query failed, and we can't tell what exists.
+    data = j.get("data") or {}
+    for (repository_alias, issue_alias), key in aliases.items():
+        if repository_alias not in data:
+            continue
+        issue = (data[repository_alias] or {}).get(issue_alias)
+        if issue and issue.get("url"):
+            issues[key] = Issue(issue["title"], issue["url"])
+        else:
+            missing.add(key)
+    return issues, missing, False
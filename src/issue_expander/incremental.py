@@ -0,0 +1,208 @@
+"""Expand the same files again and again, only doing the work for what's changed since the last time.
+
+A manifest, a JSON file, remembers the paragraphs of each file that were left with nothing to expand, by hash,
+and, if the whole file was, its size, modification time and hash. Files that haven't changed since are skipped,
+without even reading them if their size and modification time are the same, and in the rest, the paragraphs we
+remember are copied as they are, without scanning them or looking anything up.
+
+Paragraphs are the pieces of text between blank lines, like readChunks reads. A paragraph is left with nothing
+to expand when every reference in it was expanded, or is to an issue in no particular repository, like #123
+without --default-source. Paragraphs with references that couldn't be expanded, like ones to issues that don't
+exist, are scanned and looked up each time.
+
+Expanded references are links, so with --markdown, they're left alone anyway. With --plain-text, links that
+look like ones we made, like [Title #123](https://github.com/foo/bar/issues/123), are left alone too, so they
+aren't expanded again, inside themselves."""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from issue_expander import files, stats
+from issue_expander.expander import blank_line_regex, findMatches, refKey, substituteRefs
+from issue_expander.markdown import MarkdownScanner
+
+MANIFEST_VERSION = 1
+
+# A file modified this recently, in nanoseconds, might change again without its size or modification time
+# changing, so it's checked by hash next time.
+RACY_NS = 2 * 10**9
+
+# a link like substituteMatch makes, whose title can have brackets in it, as long as they're balanced
+_expanded_link = re.compile(
+    r"\[(?:[^\[\]\n]|\[[^\[\]\n]*\])* #\d+\]"
+    r"\(https://github\.com/[a-zA-Z0-9.-]+/[a-zA-Z0-9.-]+/(?:issues|pull)/\d+\)"
+)
+
+
+def paragraphs(text: str):
+    """Yield the pieces of text, each ending just after a blank line, but the last."""
+    pos = 0
+    for match in blank_line_regex.finditer(text):
+        yield text[pos : match.end()]
+        pos = match.end()
+    if pos < len(text):
+        yield text[pos:]
+
+
+def paragraphHash(fence, paragraph: str) -> str:
+    """Return a hash of paragraph, and the code fence it starts in, like MarkdownScanner.fence."""
+    return hashlib.sha256(f"{fence}\n{paragraph}".encode("utf-8")).hexdigest()[:32]
+
+
+def outsideExpandedLinks(text: str) -> list:
+    """Return the (start, end) ranges of text outside links that look like ones we made, in order."""
+    regions = []
+    pos = 0
+    for link in _expanded_link.finditer(text):
+        if link.start() > pos:
+            regions.append((pos, link.start()))
+        pos = link.end()
+    if pos < len(text):
+        regions.append((pos, len(text)))
+    return regions
+
+
+def walk(text: str, known: dict, markdown: bool = True):
+    """Yield (paragraph, the fence it starts in, the fence it ends in, regions) for each of text's paragraphs.
+
+    Paragraphs whose hashes are in known, which maps them to the fence they end in, aren't scanned, and have
+    None for regions. Fences are like MarkdownScanner.fence."""
+    scanner = MarkdownScanner()
+    for paragraph in paragraphs(text):
+        fence = scanner.fence
+        digest = paragraphHash(fence, paragraph)
+        if digest in known:
+            scanner.fence = tuple(known[digest]) if known[digest] else None
+            yield paragraph, fence, scanner.fence, None
+        elif markdown:
+            regions = scanner.scan(paragraph)
+            yield paragraph, fence, scanner.fence, regions
+        else:
+            yield paragraph, None, None, outsideExpandedLinks(paragraph)
+
+
+def findRefs(
+    text: str, known: dict, default_owner=None, default_repository=None, markdown: bool = True
+) -> set:
+    """Return the set of (owner, repository, number) keys text references, outside the paragraphs in known."""
+    keys = set()
+    for paragraph, _, _, regions in walk(text, known, markdown):
+        if regions is not None:
+            for reference in findMatches(paragraph, regions):
+                key = refKey(reference, default_owner, default_repository)
+                if key:
+                    keys.add(key)
+    return keys
+
+
+def substitute(
+    text: str,
+    known: dict,
+    issues: dict,
+    default_owner=None,
+    default_repository=None,
+    markdown: bool = True,
+    rewriting: bool = False,
+) -> tuple:
+    """Expand the references in text, outside the paragraphs in known, like substituteRefs.
+
+    Returns the expanded text, a dict like known of the paragraphs left with nothing to expand, and whether
+    that's all of them. With rewriting, they're the expanded text's, because it's going to replace text, and
+    otherwise text's, so only those that had nothing to expand to begin with."""
+    pieces = []
+    finished = {}
+    complete = True
+    for paragraph, fence, end_fence, regions in walk(text, known, markdown):
+        expanded = paragraph
+        done = True
+        if regions is None:
+            stats.count("paragraphs.skipped")
+        else:
+            expanded = substituteRefs(paragraph, issues, default_owner, default_repository, regions)
+            keys = (
+                refKey(reference, default_owner, default_repository)
+                for reference in findMatches(paragraph, regions)
+            )
+            done = all(key is None or issues.get(key) is not None for key in keys)
+        pieces.append(expanded)
+        if done and (rewriting or expanded == paragraph):
+            # Expanding doesn't touch code fences, so what it makes starts and ends in the same ones.
+            finished[paragraphHash(fence, expanded)] = end_fence
+        else:
+            complete = False
+    return "".join(pieces), finished, complete
+
+
+def textHash(text: str) -> str:
+    """Return a hash of all of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """What was left with nothing to expand, the last time, in each file, kept in a JSON file at path.
+
+    options, like the default source, change what there is to expand, so if they're not the same as the last
+    time, everything is forgotten."""
+
+    def __init__(self, path, options: dict):
+        self.path = path
+        self.options = options
+        # relative path -> {"paragraphs": {hash: fence}, and, if the whole file was finished, "sha256",
+        # and, unless it had only just been modified, "size" and "mtime_ns"}
+        self.files = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION and manifest.get("options") == options:
+                self.files = dict(manifest["files"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Unable to read manifest {path}, so starting afresh: {e}", file=sys.stderr)
+
+    def _key(self, path) -> str:
+        # relative to the manifest, so it can be kept with the files, wherever they're checked out
+        return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(self.path)))
+
+    def unchanged(self, path) -> bool:
+        """Return whether the file at path is as it was when it was left with nothing to expand."""
+        entry = self.files.get(self._key(path))
+        if entry is None or "sha256" not in entry:
+            return False
+        try:
+            status = os.stat(path)
+            if (status.st_size, status.st_mtime_ns) == (entry.get("size"), entry.get("mtime_ns")):
+                return True
+            text = files.readFile(path)
+        except (OSError, UnicodeDecodeError):
+            return False
+        if textHash(text) != entry["sha256"]:
+            return False
+        # It's only been touched, so remember when, to skip reading it next time.
+        self.record(path, entry["paragraphs"], text)
+        return True
+
+    def paragraphs(self, path) -> dict:
+        """Return the paragraphs of the file at path left with nothing to expand, the last time."""
+        return self.files.get(self._key(path), {}).get("paragraphs", {})
+
+    def record(self, path, paragraphs: dict, text=None):
+        """Remember the paragraphs of the file at path left with nothing to expand, and, if the whole file was,
+        its text now."""
+        entry = {"paragraphs": paragraphs}
+        if text is not None:
+            entry["sha256"] = textHash(text)
+            status = os.stat(path)
+            if time.time_ns() - status.st_mtime_ns > RACY_NS:
+                entry.update(size=status.st_size, mtime_ns=status.st_mtime_ns)
+        with self._lock:
+            self.files[self._key(path)] = entry
+
+    def save(self):
+        manifest = {"version": MANIFEST_VERSION, "options": self.options, "files": self.files}
+        files.writeAtomically(self.path, json.dumps(manifest, indent=1, sort_keys=True) + "\n")
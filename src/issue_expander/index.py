@@ -0,0 +1,150 @@
+"""A compact, read-only index of issues, for expanding references without going to GitHub.
+
+An index is one file: a header, a table of offsets to its records, and the records, sorted by key.
+It's memory-mapped and binary-searched, so opening one is instant however many issues it holds,
+and issues are only read (and turned into Issues) when they're looked up.
+
+    header   MAGIC, then the number of records, as a little-endian unsigned 64-bit integer
+    offsets  where each record starts, from the start of the file, as little-endian unsigned 64-bit integers
+    records  the lengths of the key, title and URL, as little-endian unsigned 16-bit integers,
+             then the key, title and URL themselves
+
+A key is the owner and repository, in UTF-8, each followed by a NUL, and then the issue number as a
+big-endian unsigned 64-bit integer, so sorting keys as bytes sorts them by (owner, repository, number).
+URLs are UTF-8, except that the usual https://github.com/OWNER/REPOSITORY/issues/NUMBER is stored as "i",
+and the usual pull request URL as "p"."""
+import mmap
+import re
+import struct
+from typing import Optional
+
+from issue_expander import files
+from issue_expander.cache import Issue
+
+MAGIC = b"ISXIDX01"
+
+_header = struct.Struct("<8sQ")
+_offset = struct.Struct("<Q")
+_lengths = struct.Struct("<HHH")
+_number = struct.Struct(">Q")
+
+# like https://github.com/foo/bar/issues/123, in JSONL dumps without owner, repository and number fields
+_url_regex = re.compile(r"https://github\.com/([^/]+)/([^/]+)/(?:issues|pull)/(\d+)")
+
+
+def _key(owner: str, repository: str, number) -> bytes:
+    return owner.encode("utf-8") + b"\0" + repository.encode("utf-8") + b"\0" + _number.pack(int(number))
+
+
+def _packURL(owner, repository, number, html_url) -> bytes:
+    for kind, short in (("issues", b"i"), ("pull", b"p")):
+        if html_url == f"https://github.com/{owner}/{repository}/{kind}/{number}":
+            return short
+    return html_url.encode("utf-8")
+
+
+def _unpackURL(owner, repository, number, url: bytes) -> str:
+    if url == b"i":
+        return f"https://github.com/{owner}/{repository}/issues/{number}"
+    if url == b"p":
+        return f"https://github.com/{owner}/{repository}/pull/{number}"
+    return url.decode("utf-8")
+
+
+def writeIndex(path, issues) -> int:
+    """Write an index of (owner, repository, number, title, html_url) issues to path, replacing it atomically.
+
+    If an issue comes up more than once, the last one wins. Returns how many issues were written."""
+    records = {}
+    for owner, repository, number, title, html_url in issues:
+        key = _key(owner, repository, number)
+        title = title.encode("utf-8")
+        url = _packURL(owner, repository, int(number), html_url)
+        records[key] = _lengths.pack(len(key), len(title), len(url)) + key + title + url
+
+    keys = sorted(records)
+    offset = _header.size + _offset.size * len(keys)
+    offsets = []
+    for key in keys:
+        offsets.append(_offset.pack(offset))
+        offset += len(records[key])
+
+    with files.atomicFile(path, "wb") as f:
+        f.write(_header.pack(MAGIC, len(keys)))
+        f.write(b"".join(offsets))
+        for key in keys:
+            f.write(records[key])
+    return len(keys)
+
+
+def readJSONL(path):
+    """Yield (owner, repository, number, title, html_url) issues from a JSON Lines dump at path.
+
+    Each line is an object with a title and an html_url, like the issues GitHub's REST API returns.
+    Its owner, repository and number are taken from the html_url, unless the line has them too."""
+    import json
+
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                issue = json.loads(line)
+                title, html_url = issue["title"], issue["html_url"]
+                owner, repository, number = issue.get("owner"), issue.get("repository"), issue.get("number")
+                if not (owner and repository and number):
+                    owner, repository, number = _url_regex.match(html_url).groups()
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(
+                    f"{path}, line {n}: not an issue with a title and a GitHub html_url"
+                ) from None
+            yield owner, repository, int(number), title, html_url
+
+
+class IssueIndex:
+    """Look up issues in an index written by writeIndex."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # it's empty
+                raise ValueError(f"{path} isn't an issue index") from None
+        if self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} isn't an issue index")
+        _, self._count = _header.unpack_from(self._map)
+
+    def _record(self, i):
+        (offset,) = _offset.unpack_from(self._map, _header.size + _offset.size * i)
+        key_length, title_length, url_length = _lengths.unpack_from(self._map, offset)
+        start = offset + _lengths.size
+        return self._map[start : start + key_length], start + key_length, title_length, url_length
+
+    def get(self, owner: str, repository: str, number) -> Optional[Issue]:
+        """Return the issue, like getIssue does, or None if it isn't here."""
+        try:
+            key = _key(owner, repository, number)
+        except struct.error:  # a number too big to be an issue
+            return None
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._count:
+            return None
+        found, start, title_length, url_length = self._record(low)
+        if found != key:
+            return None
+        title = self._map[start : start + title_length].decode("utf-8")
+        url = self._map[start + title_length : start + title_length + url_length]
+        return Issue(title, _unpackURL(owner, repository, int(number), url))
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
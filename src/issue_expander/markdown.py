@@ -0,0 +1,201 @@
+"""Find where in Markdown issue references should be expanded: the prose, not the code or the links.
+
+This isn't a Markdown parser. It's one quick pass that finds fenced code blocks, code spans, links,
+images, link reference definitions, autolinks, HTML tags and comments, and the contents of <a>, <code>
+and <pre> elements, so references in them are left alone. Expanding a reference in a code sample changes
+the code, and expanding one in a link (like one we expanded before) breaks the link.
+
+Indented code blocks aren't recognized, because telling them apart from the rest of a list item
+takes a real parser, and links and code spans don't carry on past a blank line.
+
+Everything here takes time in proportion to the length of the text, however it's nested or unbalanced."""
+import re
+
+# Lines that matter to us: code fences (in lists and block quotes too), link reference definitions,
+# and blank lines, which end paragraphs.
+_block = re.compile(
+    r"^[ \t]*(?:>[ \t]*|(?:[-*+]|\d{1,9}[.)])[ \t]+)*(?P<fence>`{3,}(?=[^`\n]*$)|~{3,})(?P<info>[^\n]*)$"
+    r"|^(?P<definition>[ \t]{0,3}\[[^\]\n]+\]:[^\n]*)$"
+    r"|^[ \t\r]*$",
+    re.M,
+)
+
+# Inside a paragraph, the things that might start or end code, links or HTML.
+_inline = re.compile(r"\\[\\`\[\]<!]|`+|!?\[|\]|<")
+
+# What follows the ] of an inline link or image: (destination "title")
+_link_tail = re.compile(
+    r"""\([ \t\r\n]*(?:<[^<>\n]*>|(?:[^\s()]|\([^\s()]*\))*)"""
+    r"""(?:\s+(?:"[^"\n]*"|'[^'\n]*'|\([^()\n]*\)))?\s*\)"""
+)
+# and of a full reference link: [label]
+_reference_tail = re.compile(r"\[[^\[\]\n]*\]")
+
+_autolink = re.compile(r"<(?:[a-zA-Z][a-zA-Z0-9+.-]{1,31}:[^\s<>]*|[^\s@<>]+@[^\s@<>]+)>")
+_tag = re.compile(r"</?(?P<name>[a-zA-Z][a-zA-Z0-9-]*)(?:\s[^<>]*)?/?>")
+# Elements whose contents are left alone, as well as the tags themselves.
+_closing_tags = {name: re.compile(rf"</{name}\s*>", re.I) for name in ("a", "code", "pre")}
+_comment_end = re.compile("-->")
+
+
+class _Finder:
+    """Searches for a pattern again and again, each time from further on, in linear time overall.
+
+    A search only goes back to the text if the last match is behind where we're searching from now."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.searched = False
+        self.found = None
+
+    def search(self, text, pos, endpos):
+        if not self.searched or (self.found is not None and self.found.start() < pos):
+            self.found = self.pattern.search(text, pos, endpos)
+            self.searched = True
+        return self.found
+
+
+class MarkdownScanner:
+    """Finds the prose in Markdown, in one piece or in consecutive chunks.
+
+    Chunks should end at the ends of lines, ideally at blank lines, like readChunks makes them.
+    A code fence can still span any number of chunks."""
+
+    def __init__(self, fence=None, line_start: bool = True):
+        # the fence character and length of the code block we're in, if we're in one
+        self.fence = fence
+        # whether the next chunk starts at the start of a line
+        self.line_start = line_start
+
+    def scan(self, text: str, candidates: list = None) -> list:
+        """Return the (start, end) ranges of text outside code, links and HTML, in order.
+
+        Given candidates, the sorted offsets in text where references might start, paragraphs without any are
+        skipped, and left out, which is quicker, when there aren't many."""
+        regions = []
+        pos = 0  # where the paragraph we're in started
+        next_candidate = 0
+
+        def scanParagraph(start, end):
+            nonlocal next_candidate
+            if candidates is not None:
+                while next_candidate < len(candidates) and candidates[next_candidate] < start:
+                    next_candidate += 1
+                if next_candidate == len(candidates) or candidates[next_candidate] >= end:
+                    return
+            _scanParagraph(text, start, end, regions)
+
+        for match in _block.finditer(text):
+            if match.start() == 0 and not self.line_start:
+                # We're partway through a line, so this isn't the start of one.
+                continue
+            fence = match.group("fence")
+            if self.fence is not None:
+                if fence and fence[0] == self.fence[0] and len(fence) >= self.fence[1]:
+                    if not match.group("info").strip():
+                        self.fence = None
+                        pos = match.end()
+                continue
+            scanParagraph(pos, match.start())
+            if fence:
+                self.fence = (fence[0], len(fence))
+            pos = match.end()
+        if self.fence is None:
+            scanParagraph(pos, len(text))
+        self.line_start = text.endswith("\n") if text else self.line_start
+        return regions
+
+
+def proseRegions(text: str) -> list:
+    """Return the (start, end) ranges of Markdown text outside code, links and HTML, in order."""
+    return MarkdownScanner().scan(text)
+
+
+def _codeSpans(tokens):
+    """Pair up runs of backticks of the same length into code spans, returning their (start, end)s."""
+    runs = [token for token in tokens if token.group()[0] == "`"]
+    # for each length, the indexes of the runs that long, in order
+    by_length = {}
+    for i, run in enumerate(runs):
+        by_length.setdefault(len(run.group()), []).append(i)
+    cursors = dict.fromkeys(by_length, 0)
+
+    spans = []
+    i = 0
+    while i < len(runs):
+        length = len(runs[i].group())
+        candidates = by_length[length]
+        cursor = cursors[length]
+        while cursor < len(candidates) and candidates[cursor] <= i:
+            cursor += 1
+        cursors[length] = cursor
+        if cursor == len(candidates):
+            # No closing run, so these backticks are just backticks.
+            i += 1
+            continue
+        closer = candidates[cursor]
+        spans.append((runs[i].start(), runs[closer].end()))
+        i = closer + 1
+    return spans
+
+
+def _scanParagraph(text, start, end, regions):
+    """Add the prose between start and end, a paragraph or less, to regions."""
+    if start >= end:
+        return
+    tokens = list(_inline.finditer(text, start, end))
+    skipped = _codeSpans(tokens)
+
+    code = iter(list(skipped))
+    next_code = next(code, None)
+    # one per pattern we look ahead for, so unclosed comments and elements don't make us search again and again
+    finders = {}
+    brackets = []
+    skip_until = start
+    for token in tokens:
+        position = token.start()
+        while next_code is not None and next_code[1] <= position:
+            next_code = next(code, None)
+        if position < skip_until or (next_code is not None and next_code[0] <= position):
+            continue
+        kind = token.group()
+        if kind[0] in "\\`":
+            continue
+        if kind in ("[", "!["):
+            brackets.append(position)
+        elif kind == "]":
+            if not brackets:
+                continue
+            opened = brackets.pop()
+            tail = _link_tail.match(text, token.end(), end) or _reference_tail.match(text, token.end(), end)
+            if tail:
+                skipped.append((opened, tail.end()))
+                skip_until = tail.end()
+        else:  # <
+            if text.startswith("<!--", position):
+                finder = finders.setdefault("-->", _Finder(_comment_end))
+                comment_end = finder.search(text, position + 4, end)
+                if comment_end:
+                    skip_until = comment_end.end()
+                    skipped.append((position, skip_until))
+                continue
+            tag = _autolink.match(text, position, end) or _tag.match(text, position, end)
+            if not tag:
+                continue
+            skip_until = tag.end()
+            name = (tag.groupdict().get("name") or "").lower()
+            if name in _closing_tags and not tag.group().startswith("</"):
+                finder = finders.setdefault(name, _Finder(_closing_tags[name]))
+                closing = finder.search(text, skip_until, end)
+                if closing:
+                    skip_until = closing.end()
+            skipped.append((position, skip_until))
+
+    # The prose is whatever is left between what we skipped.
+    pos = start
+    for skip_start, skip_end in sorted(skipped):
+        if skip_start > pos:
+            regions.append((pos, skip_start))
+        pos = max(pos, skip_end)
+    if pos < end:
+        regions.append((pos, end))
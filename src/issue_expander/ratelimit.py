@@ -0,0 +1,136 @@
+"""Keep our requests to GitHub inside its rate limits, waiting when we have to."""
+import random
+import threading
+import time
+
+from issue_expander import stats
+
+# The longest we'll wait, in seconds, before giving up on a request.
+DEFAULT_MAX_WAIT = 60
+
+# GitHub's secondary rate limits allow about 900 points a minute on the REST API,
+# and each issue lookup costs one, so don't start requests any closer together than this.
+DEFAULT_MIN_INTERVAL = 60 / 900
+
+# When GitHub tells us to back off without saying for how long, start by waiting this long (doubling each time).
+DEFAULT_BACKOFF = 60
+
+# How many times we retry a request that was rate limited.
+MAX_RETRIES = 3
+
+
+class RateLimitExceeded(Exception):
+    """We'd have to wait longer than max_wait to make a request, so we didn't."""
+
+
+def _header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Schedules requests using what GitHub tells us in X-RateLimit-* and Retry-After headers.
+
+    Call acquire() before each request, and update() with each response. It's safe to share between
+    threads. `deferred` counts requests GitHub's limits made wait, because the budget had run out or it said
+    to back off, but not ones that only waited for their turn, and `dropped` counts ones we gave up on."""
+
+    def __init__(
+        self,
+        max_wait=DEFAULT_MAX_WAIT,
+        min_interval=DEFAULT_MIN_INTERVAL,
+        clock=time.time,
+        sleep=time.sleep,
+        jitter=random.random,
+    ):
+        self.max_wait = max_wait
+        self.min_interval = min_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0
+        self.deferred = 0
+        self.dropped = 0
+
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until it's our turn to make a request.
+
+        Raises RateLimitExceeded if that would take longer than max_wait."""
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+    def reserve(self) -> float:
+        """Book our turn to make a request, and return how many seconds we have to wait for it.
+
+        This is acquire() without the sleep, for callers that wait some other way, like asyncio.
+        Raises RateLimitExceeded if GitHub's limits would make us wait longer than max_wait. Requests are
+        only held up by those while the budget's used up, or GitHub has said to back off; otherwise,
+        they only wait for their turn, which is never given up on."""
+        with self._lock:
+            now = self.clock()
+            # when GitHub's limits let the request start
+            allowed = self.blocked_until
+            if self.remaining == 0 and self.reset_at is not None:
+                allowed = max(allowed, self.reset_at)
+            if allowed - now > self.max_wait:
+                self.dropped += 1
+                stats.count("ratelimit.dropped")
+                raise RateLimitExceeded(f"Rate limited for another {allowed - now:.0f} seconds")
+            # when our own pacing would have let the request start
+            paced = max(now, self._next_slot)
+            ready = max(paced, allowed)
+            wait = ready - now
+            self._next_slot = ready + self.min_interval
+            if self.remaining:
+                # Count this request against the budget now, so other threads pace themselves.
+                self.remaining -= 1
+            if wait > 0:
+                stats.observe("ratelimit.wait", wait)
+            if ready > paced:
+                self.deferred += 1
+        return wait
+
+    def update(self, response, attempt=0):
+        """Note the rate limit headers on a response.
+
+        Returns True if the request was rate limited, and should be retried."""
+        headers = response.headers
+        with self._lock:
+            now = self.clock()
+            remaining = _header(headers, "X-RateLimit-Remaining")
+            reset_at = _header(headers, "X-RateLimit-Reset")
+            if remaining is not None:
+                self.remaining = remaining
+            if reset_at is not None:
+                self.reset_at = reset_at
+
+            if response.status not in (403, 429):
+                return False
+
+            retry_after = _header(headers, "Retry-After")
+            if retry_after is not None:
+                # a secondary rate limit
+                backoff = retry_after
+            elif remaining == 0 and reset_at is not None:
+                # we've used up our primary rate limit
+                backoff = reset_at - now
+            elif response.status == 429:
+                backoff = DEFAULT_BACKOFF * 2**attempt
+            else:
+                # A 403 that isn't about rate limits, like a private repository.
+                return False
+
+            # Jitter, so threads (and other processes) don't all come back at the same moment.
+            self.blocked_until = max(self.blocked_until, now + max(backoff, 0) + self.jitter())
+            stats.count("ratelimit.retries")
+            return True
@@ -0,0 +1,126 @@
+"""Find issue references in text, in time proportional to its length.
+
+There are four kinds of reference, each with a regex of its own:
+
+    url         https://github.com/foo/bar/issues/123 (or /pull/123)
+    number      #123
+    gh          GH-123
+    repository  foo/bar#123
+
+Each regex starts with something only its kind of reference has (https://github, #, GH- and the / in foo/bar#),
+so searching for it is quick, and only ever tries to match where a reference could be. The earliest reference
+found wins, and if two start at the same place, the one earlier in that list wins, just as if the regexes were
+alternatives in one big regex.
+
+That one big regex would be slow, though: it tries [a-zA-Z0-9.-]+/ for foo/bar#123 at every character of
+every word, and on a long run of those characters, like a hash or a base64 blob, it tries again at each one,
+all the way to the end of the run, in time proportional to the square of the run's length.
+
+The regexes are compiled for bytes too, to find references in bytes without decoding them, like rewrite does.
+There, digits and word characters are only ASCII ones, so next to anything else, like GH-123 right after é,
+they don't match the same as in text. Only bytes that are all ASCII are scanned like that.
+
+When adding a kind of reference, take care to only match if you should--this may mean negative look-ahead and
+-behind assertions--and keep its regex starting with something literal."""
+import re
+from typing import NamedTuple, Optional
+
+# what owners and repositories are made of
+NAME_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.-"
+
+_url = re.compile(
+    r"https://github.com/(?P<owner>[a-zA-Z0-9.-]+)/(?P<repository>[a-zA-Z0-9.-]+)/(issues|pull)/(?P<number>\d+)"
+)
+# (The look-behinds come after the literal # and GH-, which is the same, but much quicker to search for.)
+_number = re.compile(r"#(?<![a-zA-Z0-9#-].)(?P<number>\d+)(?![a-zA-Z0-9#])")
+_gh = re.compile(r"GH-(?<!\wGH-)(?P<number>\d+)")
+# the part of foo/bar#123 after foo, which has to be right before it
+_repository = re.compile(r"/(?P<repository>[a-zA-Z0-9.-]+)#(?P<number>\d+)")
+
+KINDS = ("url", "number", "gh", "repository")
+
+# the regexes above, and NAME_CHARACTERS, for bytes
+_bytes_regexes = tuple(
+    re.compile(regex.pattern.encode("ascii")) for regex in (_url, _number, _gh, _repository)
+)
+_BYTES_NAME_CHARACTERS = NAME_CHARACTERS.encode("ascii")
+
+
+class Reference(NamedTuple):
+    start: int
+    end: int
+    # the reference as it is in the text
+    text: str
+    # one of KINDS
+    kind: str
+    # None for the kinds that don't say
+    owner: Optional[str]
+    repository: Optional[str]
+    number: str
+
+
+def findReferences(text: str, pos: int = 0, endpos: int = None):
+    """Yield the references in text, or in text[pos:endpos], in order, as References.
+
+    They never overlap, and after each one, the search carries on from its end. text can be bytes, or something
+    like them, such as an mmap, and then the References' text, owners, repositories and numbers are bytes."""
+    if endpos is None:
+        endpos = len(text)
+    if isinstance(text, str):
+        regexes, repository_regex, name_characters = (_url, _number, _gh), _repository, NAME_CHARACTERS
+    else:
+        *regexes, repository_regex = _bytes_regexes
+        name_characters = _BYTES_NAME_CHARACTERS
+    # The next match of each regex, from where we were when we last searched for it. A search only has to be
+    # done again once we've gone past where its match started, so each regex searches through the text once.
+    found = [None, None, None]
+    searched = [False, False, False]
+    # the next foo/bar#123 after foo, and where its owner starts
+    tail = None
+    searched_tail = False
+    owner_start = None
+
+    while pos < endpos:
+        best = best_kind = None
+        for i, regex in enumerate(regexes):
+            if not searched[i] or (found[i] is not None and found[i].start() < pos):
+                found[i] = regex.search(text, pos, endpos)
+                searched[i] = True
+            match = found[i]
+            if match is not None and (best is None or match.start() < best.start()):
+                best, best_kind = match, KINDS[i]
+
+        # foo/bar#123 starts with the run of NAME_CHARACTERS right before its /, or as much of it as is after pos.
+        if not searched_tail or (tail is not None and tail.start() <= pos):
+            tail_from = pos
+            while True:
+                tail = repository_regex.search(text, tail_from, endpos)
+                if tail is None:
+                    break
+                owner_start = tail_from + len(text[tail_from : tail.start()].rstrip(name_characters))
+                if owner_start < tail.start():
+                    break
+                # There's no owner before this /, so look for the next one.
+                tail_from = tail.start() + 1
+            searched_tail = True
+        if tail is not None and (best is None or max(pos, owner_start) < best.start()):
+            start = max(pos, owner_start)
+            yield Reference(
+                start,
+                tail.end(),
+                text[start : tail.end()],
+                "repository",
+                text[start : tail.start()],
+                tail.group("repository"),
+                tail.group("number"),
+            )
+            pos = tail.end()
+            continue
+
+        if best is None:
+            return
+        owner, repository = best.group("owner", "repository") if best_kind == "url" else (None, None)
+        yield Reference(
+            best.start(), best.end(), best.group(), best_kind, owner, repository, best.group("number")
+        )
+        pos = best.end()
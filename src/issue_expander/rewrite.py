@@ -0,0 +1,307 @@
+"""Expand references in big inputs as bytes, without decoding them, or copying what doesn't change.
+
+Files are memory-mapped, and other inputs, like stdin, are read in big blocks. References are found with
+findReferences' regexes compiled for bytes, and what's between them is written straight from the input to the
+output, so the only new bytes are the links that replace references. Like expandStream, the input is expanded a
+chunk at a time, with each chunk's references looked up while the chunks before it are written.
+
+Chunks that aren't all ASCII are decoded, and scanned as text, though they're still written as bytes. With
+Markdown, chunks with references or code fences in them are decoded too, so MarkdownScanner can find their
+prose, but only the paragraphs with references in them are scanned for it.
+
+Bytes that aren't UTF-8 are written out as they are, and so are line endings."""
+import io
+import mmap
+import os
+import re
+import stat
+from collections import deque
+
+from issue_expander import expander, stats
+from issue_expander.expander import (
+    DEFAULT_CONCURRENCY,
+    MAX_PARAGRAPH,
+    STREAM_WINDOW,
+    findMatches,
+    markdownLink,
+    resolveRefs,
+    warmBusyRepositories,
+)
+from issue_expander.markdown import MarkdownScanner
+from issue_expander.references import findReferences
+
+# Read, scan and write input this many bytes at a time.
+BYTES_CHUNK_SIZE = 1024 * 1024
+
+# a line of nothing but whitespace, like expander.blank_line_regex, but in bytes
+_blank_line = re.compile(rb"^[ \t\r]*\n", re.M)
+_whitespace = re.compile(rb"[\n\t ]")
+
+
+def _chunkEnd(data, start: int, size: int, paragraphs: bool, final: bool, searched: int = 0):
+    """Return where a chunk of data starting at start, about size bytes long, should end, or None if it's
+    impossible to tell until there's more data.
+
+    Chunks end just after whitespace, like readChunks ends them, or, with paragraphs, just after blank lines,
+    unless there isn't one in the MAX_PARAGRAPH bytes after size. final says whether there's any more data to come.
+    searched is how much of data an earlier call, that returned None, had, so it isn't searched again."""
+    length = len(data)
+    if start + size >= length:
+        return length if final else None
+    whitespace_from = max(start + size, searched)
+    if paragraphs:
+        limit = start + size + MAX_PARAGRAPH
+        # A blank line we couldn't find before can only start at the start of the line we stopped in.
+        line_start = data.rfind(b"\n", start + size, searched) + 1
+        blank_line = _blank_line.search(data, max(start + size, line_start), limit)
+        if blank_line:
+            return blank_line.end()
+        if limit > length:
+            return length if final else None
+        # There's no blank line for MAX_PARAGRAPH, so cut the paragraph at whitespace after that much of it.
+        whitespace_from = start + max(size, MAX_PARAGRAPH)
+    whitespace = _whitespace.search(data, whitespace_from)
+    if whitespace:
+        return whitespace.end()
+    return length if final else None
+
+
+def mappedChunks(data, size: int = BYTES_CHUNK_SIZE, paragraphs: bool = False):
+    """Yield (data, start, end) for each chunk of data, something like bytes, all there at once, like an mmap."""
+    start = 0
+    while start < len(data):
+        end = _chunkEnd(data, start, size, paragraphs, final=True)
+        yield data, start, end
+        start = end
+
+
+def streamChunks(input, size: int = BYTES_CHUNK_SIZE, paragraphs: bool = False):
+    """Yield (data, start, end) for each chunk of the binary stream input, read size bytes at a time."""
+    data = b""
+    # Blocks without whitespace, which no chunk can end in, are kept until one with some comes, rather than each
+    # being added to data, which copies it all, and searched is how much of data has been looked through already.
+    blocks = []
+    searched = 0
+    while True:
+        block = input.read(size)
+        if block and not _whitespace.search(block):
+            blocks.append(block)
+            continue
+        data = b"".join([data, *blocks, block])
+        blocks = []
+        start = 0
+        while start < len(data):
+            end = _chunkEnd(data, start, size, paragraphs, final=not block, searched=searched)
+            if end is None:
+                break
+            yield data, start, end
+            start = end
+            searched = 0
+        data = data[start:]
+        searched = len(data)
+        if not block:
+            return
+
+
+def mapFile(input):
+    """Return the binary file input memory-mapped, if it's a regular file we're at the start of, or None."""
+    try:
+        status = os.fstat(input.fileno())
+        if input.tell() != 0:
+            return None
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    if not stat.S_ISREG(status.st_mode) or not status.st_size:
+        return None
+    try:
+        return mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def byteOffsets(text: str, references, start: int = 0) -> list:
+    """Return the References found in text, with their offsets those of the bytes they're at in UTF-8, from start."""
+    converted = []
+    pos = 0
+    offset = start
+    for reference in references:
+        offset += len(text[pos : reference.start].encode("utf-8", "surrogateescape"))
+        pos = reference.start
+        converted.append(reference._replace(start=offset, end=offset + len(reference.text.encode("utf-8"))))
+    return converted
+
+
+def scanChunk(data, start: int, end: int, scanner=None) -> list:
+    """Return the References in data[start:end], or with a MarkdownScanner, in the prose there, with their
+    offsets in data.
+
+    Only chunks that are all ASCII are scanned as bytes. The rest are decoded, and scanned as text, because
+    next to other characters, like é, the regexes don't match the same in bytes."""
+    chunk = data[start:end]
+    if not chunk.isascii():
+        text = chunk.decode("utf-8", "surrogateescape")
+        references = findReferences(text)
+        if scanner is not None:
+            # Only paragraphs with references in them, wherever they are, can have references in their prose.
+            references = findMatches(
+                text, scanner.scan(text, [reference.start for reference in references])
+            )
+        return byteOffsets(text, references, start)
+
+    references = list(findReferences(data, start, end))
+    if scanner is None:
+        return references
+    if not references and b"```" not in chunk and b"~~~" not in chunk:
+        # There's nothing to expand, and no code fences to keep track of, so the prose doesn't matter.
+        scanner.line_start = chunk.endswith(b"\n")
+        return []
+    regions = scanner.scan(chunk.decode("ascii"), [reference.start - start for reference in references])
+    references = []
+    for region_start, region_end in regions:
+        references.extend(findReferences(data, start + region_start, start + region_end))
+    return references
+
+
+def refKey(reference, default_owner, default_repository):
+    """Like expander.refKey, for References found in bytes too, so the key is in strings, like always."""
+    key = expander.refKey(reference, default_owner, default_repository)
+    if key is None or isinstance(key[2], str):
+        return key
+    return tuple(part if isinstance(part, str) else part.decode("ascii") for part in key)
+
+
+def expandBytes(
+    input,
+    output,
+    token: object = None,
+    default_owner: object = None,
+    default_repository: object = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_graphql: bool = False,
+    chunk_size: int = BYTES_CHUNK_SIZE,
+    window: int = STREAM_WINDOW,
+    warm_over: int = None,
+    markdown: bool = True,
+):
+    """Expand references from the binary stream input, writing the result to the binary stream output as we go.
+
+    It's just like expandStream, but if input is a regular file, it's memory-mapped, rather than read.
+    Each chunk's new references are looked up together, up to `concurrency` at once."""
+    mapped = mapFile(input)
+    try:
+        if mapped is not None:
+            chunks = mappedChunks(mapped, chunk_size, markdown)
+        else:
+            chunks = streamChunks(input, chunk_size, markdown)
+        _expandChunks(
+            chunks,
+            output,
+            token,
+            default_owner,
+            default_repository,
+            concurrency,
+            use_graphql,
+            window,
+            warm_over,
+            markdown,
+        )
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def _expandChunks(
+    chunks,
+    output,
+    token,
+    default_owner,
+    default_repository,
+    concurrency,
+    use_graphql,
+    window,
+    warm_over,
+    markdown,
+):
+    scanner = MarkdownScanner() if markdown else None
+    # (data, start, end, references, their keys, the chunk's keys), for each chunk read but not written yet
+    in_flight = deque()
+    # key -> [future of a resolveRefs dict with the key in it, how many chunks in flight want it]
+    lookups = {}
+    # (owner, repository) -> how many of its issues have been referenced, for warm_over
+    repository_counts = {}
+
+    def writeNext():
+        data, start, end, references, reference_keys, keys = in_flight.popleft()
+        issues = {}
+        with stats.timer("stream.wait"):
+            # Many keys share a future, so wait for each future once.
+            for future in {lookups[key][0] for key in keys}:
+                issues.update(future.result())
+            for key in keys:
+                lookup = lookups[key]
+                lookup[1] -= 1
+                if not lookup[1]:
+                    del lookups[key]
+        with stats.timer("substitute"), memoryview(data) as view:
+            pieces = []
+            pos = start
+            for reference, key in zip(references, reference_keys):
+                issue = issues.get(key)
+                if issue:
+                    pieces.append(view[pos : reference.start])
+                    pieces.append(markdownLink(issue, key[2]).encode("utf-8"))
+                    pos = reference.end
+            pieces.append(view[pos:end])
+            try:
+                for piece in pieces:
+                    output.write(piece)
+            finally:
+                # so nothing's left holding on to an mmap, which can't be closed until nothing is
+                for piece in pieces[::2]:
+                    piece.release()
+
+    pool = None
+
+    def submit(keys):
+        nonlocal pool
+        if pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # one chunk's lookups at a time, each up to concurrency at once
+            pool = ThreadPoolExecutor(max_workers=1)
+        return pool.submit(resolveRefs, keys, token, concurrency, use_graphql)
+
+    try:
+        for data, start, end in chunks:
+            stats.count("stream.chunks")
+            with stats.timer("scan"):
+                references = scanChunk(data, start, end, scanner)
+                reference_keys = [refKey(ref, default_owner, default_repository) for ref in references]
+            if stats.enabled():
+                kinds = {}
+                for reference in references:
+                    kinds[reference.kind] = kinds.get(reference.kind, 0) + 1
+                for kind, n in kinds.items():
+                    stats.count(f"matches.{kind}", n)
+            keys = set(reference_keys)
+            keys.discard(None)
+            new_keys = [key for key in keys if key not in lookups]
+            # (The same key can come up again after it's left the window, so this is an overestimate.)
+            stats.count("keys.unique", len(new_keys))
+            if warm_over is not None:
+                warmBusyRepositories(new_keys, token, warm_over, repository_counts)
+            if new_keys:
+                future = submit(new_keys)
+                for key in new_keys:
+                    lookups[key] = [future, 0]
+            for key in keys:
+                lookups[key][1] += 1
+
+            in_flight.append((data, start, end, references, reference_keys, keys))
+            if len(in_flight) > window:
+                writeNext()
+        while in_flight:
+            writeNext()
+    finally:
+        if pool is not None:
+            pool.shutdown()
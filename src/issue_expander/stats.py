@@ -0,0 +1,181 @@
+"""Count and time what issue-expander does, so a slow run can be explained.
+
+Measurements go to sinks. A sink is anything with count(name, n) and observe(name, seconds) methods,
+like Stats, which keeps them for a report, or an adapter for your own metrics system:
+
+    with stats.useSink(MyStatsdSink()):
+        expandRefsToMarkdown(text)
+
+Sinks are called from whichever thread made the measurement, so they must be thread-safe.
+With no sinks, measuring costs next to nothing."""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the buckets timings are sorted into, for estimating percentiles.
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+_sinks = []
+
+
+def addSink(sink):
+    global _sinks
+    # Replace the list rather than changing it, so count() and observe() never need a lock.
+    _sinks = _sinks + [sink]
+
+
+def removeSink(sink):
+    global _sinks
+    _sinks = [s for s in _sinks if s is not sink]
+
+
+@contextmanager
+def useSink(sink):
+    """Send measurements to sink inside the with block. (If sink is None, don't.)"""
+    if sink is None:
+        yield sink
+        return
+    addSink(sink)
+    try:
+        yield sink
+    finally:
+        removeSink(sink)
+
+
+def enabled() -> bool:
+    """Whether anything is listening, for measurements that are expensive to gather."""
+    return bool(_sinks)
+
+
+def count(name: str, n: int = 1):
+    for sink in _sinks:
+        sink.count(name, n)
+
+
+def observe(name: str, seconds: float):
+    for sink in _sinks:
+        sink.observe(name, seconds)
+
+
+@contextmanager
+def timer(name: str):
+    """Time the with block, and observe it as name."""
+    if not _sinks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+class Histogram:
+    """A summary of timings: how many, their total, extremes, and how many fell in each bucket."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, p: float) -> float:
+        """Estimate the pth percentile, as the upper bound of the bucket it falls in (or the max)."""
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+        }
+
+
+class Stats:
+    """A sink that keeps counters and timing histograms for a report."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    def asDict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "timings": {name: self.histograms[name].summary() for name in sorted(self.histograms)},
+            }
+
+    def report(self, format: str = "text") -> str:
+        """Return a report of everything measured, as text for people or as JSON."""
+        stats = self.asDict()
+        if format == "json":
+            import json
+
+            return json.dumps(stats, indent=2)
+
+        lines = ["Counters:"]
+        width = max([len(name) for name in list(stats["counters"]) + list(stats["timings"])] + [20])
+        for name, value in stats["counters"].items():
+            lines.append(f"  {name:<{width}} {value:>12,}")
+        if stats["timings"]:
+            lines.append("Timings (ms):")
+            lines.append(
+                f"  {'':<{width}} {'count':>8} {'total':>10} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}"
+            )
+        for name, timing in stats["timings"].items():
+            ms = {key: value * 1000 for key, value in timing.items() if key != "count"}
+            lines.append(
+                f"  {name:<{width}} {timing['count']:>8,} {ms['total']:>10.1f} {ms['mean']:>8.2f} "
+                f"{ms['p50']:>8.2f} {ms['p95']:>8.2f} {ms['max']:>8.2f}"
+            )
+        return "\n".join(lines)
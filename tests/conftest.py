@@ -1,8 +1,176 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
 import pytest
 
-from issue_expander.expander import getIssue
+from issue_expander import client, expander, graphql
+from issue_expander.expander import getIssue, retry_queue
 
 
 @pytest.fixture(autouse=True)
-def clear_issue_cache():
+def clear_issue_cache(monkeypatch):
     getIssue.cache_clear()
+    retry_queue.clear()
+    # Try failed lookups again straight away.
+    monkeypatch.setattr(retry_queue, "backoff", 0)
+
+
+@pytest.fixture(autouse=True)
+def isolate_issue_cache(tmp_path, monkeypatch):
+    """Keep the CLI's on-disk issue cache out of the real cache directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg-cache"))
+    monkeypatch.delenv("ISSUE_EXPANDER_CACHE_DIR", raising=False)
+
+
+@pytest.fixture(autouse=True)
+def isolate_proxies(monkeypatch):
+    """Talk to fake servers directly, whatever proxies are set where the tests run."""
+    for name in ("http_proxy", "https_proxy", "all_proxy", "no_proxy"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+
+
+class FakeGitHub:
+    """Just enough of the GitHub API, served locally, to look up issues."""
+
+    def __init__(self):
+        self.issues = {}
+        self.redirects = {}
+        self.requests = []
+        self.connections = set()
+        # (status, headers) to answer the next requests with, before answering normally
+        self.canned = []
+        # headers to send with every answer, like X-RateLimit-Remaining
+        self.headers = {}
+
+    def addIssue(self, owner, repository, number, title):
+        html_url = f"https://github.com/{owner}/{repository}/issues/{number}"
+        self.issues[(owner, repository, int(number))] = {"html_url": html_url, "title": title}
+
+    def listIssues(self, owner, repository, query):
+        """Return a page of a repository's issues, newest first, and the query for the next page if there is one."""
+        issues = [
+            dict(issue, number=number)
+            for (issue_owner, issue_repository, number), issue in sorted(self.issues.items(), reverse=True)
+            if (issue_owner, issue_repository) == (owner, repository)
+        ]
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        next_query = None
+        if page * per_page < len(issues):
+            next_query = "&".join(f"{name}={values[0]}" for name, values in query.items() if name != "page")
+            next_query += f"&page={page + 1}"
+        return issues[(page - 1) * per_page : page * per_page], next_query
+
+    def answerGraphQL(self, query):
+        """Answer a query made of aliased repository { issueOrPullRequest } lookups."""
+        data = {}
+        repositories = list(re.finditer(r'(\w+): repository\(owner: ("[^"]*"), name: ("[^"]*")\)', query))
+        for n, repository in enumerate(repositories):
+            end = repositories[n + 1].start() if n + 1 < len(repositories) else len(query)
+            owner, name = json.loads(repository.group(2)), json.loads(repository.group(3))
+            if not any(key[:2] == (owner, name) for key in self.issues):
+                data[repository.group(1)] = None
+                continue
+            found = data[repository.group(1)] = {}
+            for issue in re.finditer(
+                r"(\w+): issueOrPullRequest\(number: (\d+)\)", query[repository.end() : end]
+            ):
+                known = self.issues.get((owner, name, int(issue.group(2))))
+                found[issue.group(1)] = (
+                    {"url": known["html_url"], "title": known["title"]} if known else None
+                )
+        return {"data": data}
+
+
+@pytest.fixture
+def fake_github():
+    """Run a FakeGitHub on localhost for the length of a test. Its base URL is in .url."""
+    github = FakeGitHub()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # so connections are kept alive
+
+        def do_GET(self):
+            github.requests.append(("GET", self.path, dict(self.headers), b""))
+            github.connections.add(self.client_address)
+            if github.canned:
+                status, headers = github.canned.pop(0)
+                self.reply(status, headers=headers)
+                return
+            if self.path in github.redirects:
+                self.send_response(301)
+                self.send_header("Location", github.redirects[self.path])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            url = urlsplit(self.path)
+            match = re.fullmatch(r"/repos/([^/]+)/([^/]+)/issues", url.path)
+            if match and any(key[:2] == match.groups() for key in github.issues):
+                issues, next_query = github.listIssues(*match.groups(), parse_qs(url.query))
+                links = {"Link": f'<{github.url}{url.path}?{next_query}>; rel="next"'} if next_query else {}
+                self.reply(200, issues, links)
+                return
+            match = re.fullmatch(r"/repos/([^/]+)/([^/]+)", url.path)
+            if match and any(key[:2] == match.groups() for key in github.issues):
+                self.reply(200, {"full_name": "/".join(match.groups())})
+                return
+            match = re.fullmatch(r"/repos/([^/]+)/([^/]+)/issues/(\d+)", self.path)
+            issue = match and github.issues.get((match.group(1), match.group(2), int(match.group(3))))
+            if not issue:
+                self.reply(404, {"message": "Not Found"})
+                return
+            self.reply(200, dict(issue, number=int(match.group(3)), body="A long description..."))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            github.requests.append(("POST", self.path, dict(self.headers), body))
+            github.connections.add(self.client_address)
+            if github.canned:
+                status, headers = github.canned.pop(0)
+                self.reply(status, headers=headers)
+                return
+            if self.path != "/graphql":
+                self.send_error(404)
+                return
+            self.reply(200, github.answerGraphQL(json.loads(body)["query"]))
+
+        def reply(self, status, j=None, headers=None):
+            body = json.dumps({"message": "Nope"} if j is None else j).encode("utf-8")
+            self.send_response(status)
+            for name, value in dict(github.headers, **(headers or {})).items():
+                self.send_header(name, str(value))
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if self.headers.get("Connection") == "close":
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    github.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield github
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def github(fake_github, monkeypatch):
+    """A FakeGitHub that lookups, REST and GraphQL, talk to, over a fresh shared client (and so a fresh rate
+    limiter), with foo/bar#1, foo/bar#2 and baz/qux#3 in it."""
+    monkeypatch.setattr(expander, "API_URL", fake_github.url)
+    monkeypatch.setattr(graphql, "GRAPHQL_URL", fake_github.url + "/graphql")
+    monkeypatch.setattr(client, "_shared_client", None)
+    fake_github.addIssue("foo", "bar", 1, "One")
+    fake_github.addIssue("foo", "bar", 2, "Two")
+    fake_github.addIssue("baz", "qux", 3, "Three")
+    yield fake_github
+    client.sharedClient().close()
@@ -0,0 +1,401 @@
+import asyncio
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+import issue_expander
+from issue_expander import aio, client, expander
+from issue_expander.cache import IssueCache
+from issue_expander.expander import expandRefsToMarkdown, getIssue, useIssueCache
+from issue_expander.ratelimit import RateLimiter
+
+
+def run(coroutine):
+    """Run coroutine in a new event loop, closing the connections it leaves open."""
+
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await aio.closeConnections()
+
+    return asyncio.run(main())
+
+
+class FakeWriter:
+    """Enough of a StreamWriter to stand in for a connection."""
+
+    def __init__(self):
+        self.closed = False
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def brokenConnection():
+    """A (reader, writer) whose server has already hung up."""
+    reader = asyncio.StreamReader()
+    reader.feed_eof()
+    return reader, FakeWriter()
+
+
+def test_async_expansion_matches_sync(github):
+    """The coroutine gives the same output as expandRefsToMarkdown."""
+    text = "#1, GH-2 and baz/qux#3, but not #9"
+    expansion = run(aio.expandRefsToMarkdownAsync(text, None, "foo", "bar"))
+    assert expansion == (
+        "[One #1](https://github.com/foo/bar/issues/1), [Two #2](https://github.com/foo/bar/issues/2) "
+        "and [Three #3](https://github.com/baz/qux/issues/3), but not #9"
+    )
+    assert expansion == expandRefsToMarkdown(text, None, "foo", "bar")
+
+
+def test_concurrent_calls_share_lookups(github):
+    """Many expansions running at once look up each issue only once."""
+
+    async def main():
+        return await asyncio.gather(
+            *(aio.expandRefsToMarkdownAsync("#1 #2", None, "foo", "bar") for _ in range(10))
+        )
+
+    expansions = run(main())
+    assert len(set(expansions)) == 1
+    assert sorted(request[1] for request in github.requests) == [
+        "/repos/foo/bar/issues/1",
+        "/repos/foo/bar/issues/2",
+    ]
+
+
+def test_concurrency_is_bounded(github, monkeypatch):
+    """No more than `concurrency` requests are in flight at once."""
+    in_flight = []
+    most = []
+    real_request = aio.AsyncHTTPClient.request
+
+    async def request(self, *args, **kwargs):
+        in_flight.append(1)
+        most.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        try:
+            return await real_request(self, *args, **kwargs)
+        finally:
+            in_flight.pop()
+
+    monkeypatch.setattr(aio.AsyncHTTPClient, "request", request)
+    text = " ".join(f"foo/bar#{n}" for n in range(1, 7))
+    run(aio.expandRefsToMarkdownAsync(text, concurrency=2))
+    assert len(github.requests) == 6
+    assert max(most) == 2
+
+
+def test_sequential_lookups_share_a_connection(github):
+    """Lookups one after another reuse one keep-alive connection."""
+
+    async def main():
+        return [await aio.getIssueAsync("foo", "bar", n, None) for n in (1, 2, 9)]
+
+    assert [issue and issue.title for issue in run(main())] == ["One", "Two", None]
+    assert len(github.connections) == 1
+
+
+def test_async_lookups_share_what_getIssue_remembers(github):
+    """Async lookups remember their answers like getIssue does, and share them with it."""
+    for _ in range(3):
+        assert (
+            run(aio.expandRefsToMarkdownAsync("foo/bar#1"))
+            == "[One #1](https://github.com/foo/bar/issues/1)"
+        )
+    assert getIssue("foo", "bar", "2", None).title == "Two"
+    assert run(aio.getIssueAsync("foo", "bar", "2", None)).title == "Two"
+    assert run(aio.getIssueAsync("foo", "bar", "1", None)).title == "One"
+    assert [request[1] for request in github.requests] == [
+        "/repos/foo/bar/issues/1",
+        "/repos/foo/bar/issues/2",
+    ]
+
+
+def test_async_lookups_use_the_issue_cache_off_the_event_loop(github, tmp_path, monkeypatch):
+    """SQLite blocks, so the issue cache is opened and used from other threads, not the event loop's."""
+    threads = set()
+    for name in ("checkIssueCache", "knownMissing", "issueRequest", "readIssueResponse", "possibleRename"):
+        real = getattr(expander, name)
+
+        def recordThread(*args, real=real):
+            threads.add(threading.get_ident())
+            return real(*args)
+
+        monkeypatch.setattr(expander, name, recordThread)
+    with useIssueCache(lambda: IssueCache(tmp_path)):
+        assert run(aio.getIssueAsync("foo", "bar", "1", None)).title == "One"
+        assert expander.issue_cache is not None
+    assert threads and threading.get_ident() not in threads
+
+
+def test_async_lookups_use_the_issue_cache(github, tmp_path):
+    """Fresh cached issues aren't requested, stale ones are revalidated, and what we find is cached."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Cached one", "https://example.com/1")
+    with useIssueCache(cache):
+        expansion = run(aio.expandRefsToMarkdownAsync("#1 #2", None, "foo", "bar"))
+        assert (
+            expansion
+            == "[Cached one #1](https://example.com/1) [Two #2](https://github.com/foo/bar/issues/2)"
+        )
+        assert cache.get("foo", "bar", "2").title == "Two"
+    assert [request[1] for request in github.requests] == ["/repos/foo/bar/issues/2"]
+
+
+def test_async_lookups_share_the_rate_limiter(github, capsys):
+    """When the shared rate limiter gives up on a lookup, the reference is left alone."""
+    limiter = client.sharedClient().rate_limiter = RateLimiter(max_wait=1)
+    limiter.blocked_until = time.time() + 100
+    assert run(aio.expandRefsToMarkdownAsync("foo/bar#1")) == "foo/bar#1"
+    assert github.requests == []
+    assert capsys.readouterr().err == (
+        "Unable to look up issue due to rate limit error. Try providing a token with --token.\n"
+    )
+
+
+def test_rate_limited_requests_wait_and_retry(github):
+    """A rate limited request is retried once the limiter says so, sleeping without blocking the loop."""
+    client.sharedClient().rate_limiter = RateLimiter(min_interval=0, jitter=lambda: 0.01)
+    github.canned = [(429, {"Retry-After": "0"})]
+    assert run(aio.getIssueAsync("foo", "bar", 1, "sekrit")).title == "One"
+    assert len(github.requests) == 2
+    assert github.requests[0][2]["Authorization"] == "Bearer: sekrit"
+
+
+def test_failed_lookups_are_not_remembered(github, monkeypatch):
+    """A lookup that can't connect is forgotten, so the next one tries again, and it's queued to retry."""
+    monkeypatch.setattr(issue_expander.expander, "API_URL", "http://127.0.0.1:1")
+
+    async def main():
+        assert await aio.getIssueAsync("foo", "bar", 1, None) is None
+        return aio._loopState().lookups
+
+    assert run(main()) == {}
+    assert issue_expander.expander.retry_queue.take([("foo", "bar", 1)])[0] == [("foo", "bar", 1)]
+
+
+@pytest.mark.parametrize(
+    "raw,method,expected",
+    (
+        (
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3;ext=1\r\nabc\r\n2\r\nde\r\n0\r\nX-Trailer: yes\r\n\r\n",
+            "GET",
+            (200, b"abcde", False),
+        ),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi", "GET", (200, b"hi", False)),
+        (b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nto the end", "GET", (200, b"to the end", True)),
+        (b"HTTP/1.1 200 OK\r\n\r\nuntil EOF", "GET", (200, b"until EOF", True)),
+        (b"HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n", "GET", (200, b"", True)),
+        (
+            b"HTTP/1.0 200 OK\r\nConnection: keep-alive\r\nContent-Length: 0\r\n\r\n",
+            "GET",
+            (200, b"", False),
+        ),
+        (b"HTTP/1.1 304 Not Modified\r\nETag: x\r\n\r\n", "GET", (304, b"", False)),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n", "HEAD", (200, b"", False)),
+    ),
+)
+def test_readResponse(raw, method, expected):
+    """Responses are read by length, in chunks, or to the end of the connection, as they say."""
+
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        status, headers, body, will_close = await aio.readResponse(reader, method)
+        return status, body, will_close
+
+    assert asyncio.run(main()) == expected
+
+
+def test_stale_connections_are_replaced(github):
+    """If the server dropped an idle connection, the request is retried on a new one."""
+    http_client = aio.AsyncHTTPClient()
+    host = ("http", github.url.split("//")[1])
+    stale = []
+
+    async def main():
+        stale.append(brokenConnection())
+        http_client._idle[host] = list(stale)
+        try:
+            return await http_client.request("GET", github.url + "/repos/foo/bar/issues/1")
+        finally:
+            await http_client.close()
+
+    assert asyncio.run(main()).status == 200
+    assert stale[0][1].closed
+    assert len(github.connections) == 1
+
+
+def test_failed_new_connections_raise(github):
+    """Errors on a brand new connection aren't retried."""
+    http_client = aio.AsyncHTTPClient()
+    connections = []
+
+    async def connect(scheme, netloc):
+        connections.append(brokenConnection())
+        return connections[-1]
+
+    with patch.object(http_client, "_connect", side_effect=connect):
+        with pytest.raises(asyncio.IncompleteReadError):
+            asyncio.run(http_client.request("GET", github.url + "/?per_page=1"))
+    assert [writer.closed for _, writer in connections] == [True]
+
+
+def test_cancelled_requests_close_their_connection():
+    """A connection abandoned partway through a response isn't reused."""
+    http_client = aio.AsyncHTTPClient()
+    writer = FakeWriter()
+
+    async def connect(scheme, netloc):
+        return asyncio.StreamReader(), writer
+
+    async def main():
+        task = asyncio.ensure_future(http_client.request("GET", "http://example.com/"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with patch.object(http_client, "_connect", side_effect=connect):
+        asyncio.run(main())
+    assert writer.closed
+    assert http_client._idle == {}
+
+
+def test_quiet_connections_time_out(monkeypatch, capsys):
+    """A server that never answers is given up on after timeout seconds, and so is the lookup."""
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        url = f"http://127.0.0.1:{server.getsockname()[1]}"
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(aio.AsyncHTTPClient(timeout=0.1).request("GET", url + "/"))
+
+        monkeypatch.setattr(expander, "API_URL", url)
+        monkeypatch.setattr(client, "_shared_client", None)
+        client.sharedClient().timeout = 0.1
+        assert run(aio.getIssueAsync("foo", "bar", 1, None)) is None
+    assert "Unable to look up foo/bar#1: timed out" in capsys.readouterr().err
+
+
+def test_slow_connects_time_out():
+    """So does a connection that takes too long to open."""
+
+    async def connect(scheme, netloc):
+        await asyncio.sleep(60)
+
+    http_client = aio.AsyncHTTPClient(timeout=0.1)
+    with patch.object(http_client, "_connect", side_effect=connect):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(http_client.request("GET", "http://example.com/"))
+
+
+def test_timeouts_on_reused_connections_arent_retried():
+    """A reused connection that times out isn't stale, so the request isn't sent again."""
+    http_client = aio.AsyncHTTPClient(timeout=0.1)
+    writer = FakeWriter()
+
+    async def main():
+        http_client._idle[("http", "example.com")] = [(asyncio.StreamReader(), writer)]
+        with pytest.raises(asyncio.TimeoutError):
+            await http_client.request("POST", "http://example.com/", body=b"{}")
+
+    with patch.object(http_client, "_connect", side_effect=AssertionError):
+        asyncio.run(main())
+    assert writer.closed
+    assert http_client._idle == {("http", "example.com"): []}
+
+
+def test_redirects_are_followed(github):
+    """Redirects are followed, and a 303 is followed with a GET, without the body."""
+    github.redirects["/repos/old/bar/issues/1"] = github.url + "/repos/foo/bar/issues/1"
+    assert run(aio.getIssueAsync("old", "bar", 1, None)).title == "One"
+
+    github.requests.clear()
+    github.canned = [(303, {"Location": "/repos/foo/bar/issues/2"})]
+    http_client = aio.AsyncHTTPClient()
+
+    async def main():
+        try:
+            return await http_client.request("POST", github.url + "/graphql", {}, b"{}")
+        finally:
+            await http_client.close()
+
+    assert asyncio.run(main()).status == 200
+    assert [request[:2] for request in github.requests] == [
+        ("POST", "/graphql"),
+        ("GET", "/repos/foo/bar/issues/2"),
+    ]
+
+
+def test_redirect_loops_give_up(github):
+    """A redirect loop ends with the last redirect response."""
+    github.redirects["/loop"] = "/loop"
+    http_client = aio.AsyncHTTPClient()
+
+    async def main():
+        try:
+            return await http_client.request("GET", github.url + "/loop")
+        finally:
+            await http_client.close()
+
+    assert asyncio.run(main()).status == 301
+    assert len(github.requests) == client.MAX_REDIRECTS
+
+
+def test_https_shares_the_ssl_context(monkeypatch):
+    """HTTPS connections use the shared client's SSL context, so the CA bundle is only loaded once."""
+    monkeypatch.setattr(client, "_shared_client", None)
+    calls = []
+
+    async def open_connection(host, port, **kwargs):
+        calls.append((host, port, kwargs))
+        return "connection"
+
+    with patch("asyncio.open_connection", side_effect=open_connection):
+        assert asyncio.run(aio.AsyncHTTPClient()._connect("https", "example.com")) == "connection"
+    assert calls == [("example.com", 443, {"ssl": client.sharedClient().sslContext})]
+
+
+def test_unsupported_schemes():
+    """We only speak HTTP and HTTPS."""
+    with pytest.raises(ValueError):
+        asyncio.run(aio.AsyncHTTPClient().request("GET", "ftp://example.com/"))
+
+
+def test_idle_pool_is_bounded():
+    """Connections beyond max_idle_connections are closed when they're returned."""
+    http_client = aio.AsyncHTTPClient(max_idle_connections=1)
+    first, second = (None, FakeWriter()), (None, FakeWriter())
+    http_client._checkin("host", first)
+    http_client._checkin("host", second)
+    assert http_client._idle == {"host": [first]}
+    assert second[1].closed
+
+
+def test_closing_without_lookups():
+    """There's nothing to close if nothing was looked up."""
+    assert run(asyncio.sleep(0)) is None
+
+
+def test_closed_connections_are_not_pooled(github):
+    """Connections the server is closing aren't kept for later."""
+    http_client = aio.AsyncHTTPClient()
+    url = github.url + "/repos/foo/bar/issues/1"
+    response = asyncio.run(http_client.request("GET", url, {"Connection": "close"}))
+    assert response.status == 200
+    assert http_client._idle == {}
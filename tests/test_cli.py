@@ -5,6 +5,7 @@ import pytest
 from click.testing import CliRunner
 
 import issue_expander
+from issue_expander.cache import Issue
 from issue_expander.expander import cli
 
 
@@ -13,7 +14,7 @@ def test_file(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/106970", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/106970")
         else:
             raise ValueError("Unexpected request")
 
@@ -34,7 +35,7 @@ def test_stdin(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/106970", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/106970")
         else:
             raise ValueError("Unexpected request")
 
@@ -51,7 +52,7 @@ def test_gh_expansion(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "123" and token is None:
-            return {"html_url": "https://example.com/pull/123", "title": "Hoist the Mainsail!"}
+            return Issue("Hoist the Mainsail!", "https://example.com/pull/123")
         else:
             raise ValueError("Unexpected request")
 
@@ -68,7 +69,7 @@ def test_url_expansion(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "123" and token is None:
-            return {"html_url": "https://example.com/pull/123", "title": "Hoist the Mainsail!"}
+            return Issue("Hoist the Mainsail!", "https://example.com/pull/123")
         else:
             raise ValueError("Unexpected request")
 
@@ -85,7 +86,7 @@ def test_url_expansion_with_mismatched_urls(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "123" and token is None:
-            return {"html_url": "https://example.com/pulls/123", "title": "Hoist the Mainsail!"}
+            return Issue("Hoist the Mainsail!", "https://example.com/pulls/123")
         else:
             raise ValueError("Unexpected request")
 
@@ -102,7 +103,7 @@ def test_default_source(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/106970", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/106970")
         else:
             raise ValueError("Unexpected request")
 
@@ -142,7 +143,7 @@ def test_default_source_but_not_needed(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/106970", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/106970")
         else:
             raise ValueError("Unexpected request")
 
@@ -163,9 +164,9 @@ def test_two_expansions_in_one_line(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/101", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/101")
         elif owner == "adamwolf" and repository == "geewhiz" and number == "102" and token is None:
-            return {"html_url": "https://example.com/pulls/102", "title": "HOTFIX: fix the frobnitz!"}
+            return Issue("HOTFIX: fix the frobnitz!", "https://example.com/pulls/102")
         else:
             raise ValueError("Unexpected request")
 
@@ -184,9 +185,9 @@ def test_multiline_expansions_over_stdin(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/101", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/101")
         elif owner == "adamwolf" and repository == "geewhiz" and number == "102" and token is None:
-            return {"html_url": "https://example.com/pulls/102", "title": "HOTFIX: fix the frobnitz!"}
+            return Issue("HOTFIX: fix the frobnitz!", "https://example.com/pulls/102")
         else:
             raise ValueError("Unexpected request")
 
@@ -207,9 +208,9 @@ def test_multiline_expansions_over_file(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "geewhiz" and number == "101" and token is None:
-            return {"html_url": "https://example.com/pulls/101", "title": "Foobar the Frobnitz"}
+            return Issue("Foobar the Frobnitz", "https://example.com/pulls/101")
         elif owner == "adamwolf" and repository == "geewhiz" and number == "102" and token is None:
-            return {"html_url": "https://example.com/pulls/102", "title": "HOTFIX: fix the frobnitz!"}
+            return Issue("HOTFIX: fix the frobnitz!", "https://example.com/pulls/102")
         else:
             raise ValueError("Unexpected request")
 
@@ -252,7 +253,7 @@ def test_cli_auth(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "foo" and repository == "privaterepo" and number == "555" and token == "password1":
-            return {"html_url": "https://example.com/pulls/555", "title": "Sshhh!"}
+            return Issue("Sshhh!", "https://example.com/pulls/555")
         else:
             raise ValueError("Unexpected request")
 
@@ -0,0 +1,102 @@
+import threading
+
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander.cache import Issue
+from issue_expander.expander import cli, expandRefsToMarkdown, findRefs
+from issue_expander.references import findReferences
+
+
+def test_findRefs_deduplicates():
+    """Every unique reference is found once, with defaults filled in."""
+    text = "#1 foo/bar#1 GH-1 https://github.com/foo/bar/issues/2 baz/qux#3 #1"
+    assert findRefs(text, "foo", "bar") == {("foo", "bar", "1"), ("foo", "bar", "2"), ("baz", "qux", "3")}
+
+
+def test_findRefs_without_defaults_skips_bare_numbers():
+    """References like #1 can't be looked up without a default source, so they aren't collected."""
+    assert findRefs("#1 GH-2 foo/bar#3") == {("foo", "bar", "3")}
+
+
+def test_lookups_run_concurrently(monkeypatch):
+    """All the lookups for a text are in flight at the same time."""
+    barrier = threading.Barrier(3, timeout=5)
+
+    def mockIssue(owner, repository, number, token):
+        barrier.wait()  # raises if the three lookups don't overlap
+        return Issue(f"Issue {number}", f"https://example.com/{number}")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    expansion = expandRefsToMarkdown("foo/bar#1 foo/bar#2\nfoo/bar#3", concurrency=3)
+    assert expansion == (
+        "[Issue 1 #1](https://example.com/1) [Issue 2 #2](https://example.com/2)\n"
+        "[Issue 3 #3](https://example.com/3)"
+    )
+
+
+def test_each_reference_is_looked_up_once(monkeypatch):
+    """Repeated references share one lookup."""
+    calls = []
+
+    def mockIssue(owner, repository, number, token):
+        calls.append((owner, repository, number, token))
+        return Issue("One", "https://example.com/1")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    expansion = expandRefsToMarkdown("#1 foo/bar#1 GH-1", "tok", "foo", "bar")
+    assert expansion == " ".join(["[One #1](https://example.com/1)"] * 3)
+    assert calls == [("foo", "bar", "1", "tok")]
+
+
+def test_resolveRefs_sequentially(monkeypatch):
+    """With a concurrency of 1, lookups happen one at a time, in the calling thread."""
+    threads = set()
+
+    def mockIssue(owner, repository, number, token):
+        threads.add(threading.get_ident())
+        return None if number == "2" else Issue("t", "u")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    issues = issue_expander.expander.resolveRefs([("foo", "bar", "1"), ("foo", "bar", "2")], concurrency=1)
+    assert issues == {("foo", "bar", "1"): Issue("t", "u"), ("foo", "bar", "2"): None}
+    assert threads == {threading.get_ident()}
+
+
+def test_cli_concurrency(monkeypatch):
+    """--concurrency is accepted and expansion is unchanged."""
+
+    def mockIssue(owner, repository, number, token):
+        return Issue("Hi", f"https://example.com/{number}")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["--concurrency", "2", "-"], input="a/b#1\nplain\na/b#2\n")
+    assert result.output == "[Hi #1](https://example.com/1)\nplain\n[Hi #2](https://example.com/2)\n"
+    assert result.exit_code == 0
+
+
+def test_cli_concurrency_must_be_positive():
+    """--concurrency 0 is a usage error."""
+    runner = CliRunner()
+    result = runner.invoke(cli, ["--concurrency", "0", "-"], input="a/b#1")
+    assert result.exit_code == 2
+
+
+def test_substituteMatch_looks_up_issue_without_resolved_map(monkeypatch):
+    """substituteMatch still works on its own, looking up the issue itself."""
+
+    def mockIssue(owner, repository, number, token):
+        return Issue("Seven", "https://example.com/7")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    reference = next(findReferences("see foo/bar#7"))
+    assert (
+        issue_expander.expander.substituteMatch(reference, None, None, None)
+        == "[Seven #7](https://example.com/7)"
+    )
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+from email.message import Message
+from unittest.mock import patch
+
+from issue_expander.cache import CACHE_FILENAME, Issue, IssueCache
+from issue_expander.client import Response
+from issue_expander.expander import getIssue, useIssueCache
+
+
+class FakeClock:
+    """A clock that only moves when we tell it to."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def issue_response(issue, etag=None, last_modified=None):
+    """Make a Response like the HTTP client returns for an issue."""
+    headers = Message()
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return Response(200, headers, json.dumps(issue).encode("utf-8"), "https://api.github.com/")
+
+
+def not_modified(method, url, headers=None, body=None):
+    """Answer like GitHub does when the issue hasn't changed."""
+    return Response(304, Message(), b"", url)
+
+
+def stale_cache(tmp_path, etag=None, last_modified=None):
+    """Make a cache holding one issue that's past its TTL."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, ttl=60, clock=clock)
+    cache.put("foo", "bar", "1", "Old title", "https://example.com/1", etag, last_modified)
+    clock.now += 61
+    return cache
+
+
+def test_stale_entries_are_revalidated_with_etag(tmp_path):
+    """A stale entry is revalidated with If-None-Match, and a 304 means we keep using it."""
+    cache = stale_cache(tmp_path, etag='W/"abc"')
+
+    with useIssueCache(cache), patch(
+        "issue_expander.client.request", side_effect=not_modified
+    ) as mock_request:
+        assert getIssue("foo", "bar", "1", None) == Issue("Old title", "https://example.com/1")
+        request_headers = mock_request.call_args[0][2]
+        assert request_headers.get("If-None-Match") == 'W/"abc"'
+        assert request_headers.get("If-Modified-Since") is None
+
+        # ...and the 304 made it fresh again.
+        assert cache.isFresh(cache.get("foo", "bar", "1"))
+
+
+def test_stale_entries_are_revalidated_with_last_modified(tmp_path):
+    """If all we have is Last-Modified, we revalidate with If-Modified-Since."""
+    cache = stale_cache(tmp_path, last_modified="Wed, 25 Jan 2023 23:54:14 GMT")
+
+    with useIssueCache(cache), patch(
+        "issue_expander.client.request", side_effect=not_modified
+    ) as mock_request:
+        assert getIssue("foo", "bar", "1", None).title == "Old title"
+        request_headers = mock_request.call_args[0][2]
+        assert request_headers.get("If-Modified-Since") == "Wed, 25 Jan 2023 23:54:14 GMT"
+        assert request_headers.get("If-None-Match") is None
+
+
+def test_changed_issues_replace_stale_entries(tmp_path):
+    """If the issue changed, GitHub sends it, and we cache it with its new validators."""
+    cache = stale_cache(tmp_path, etag='"v1"')
+
+    with useIssueCache(cache), patch(
+        "issue_expander.client.request",
+        return_value=issue_response(
+            {"html_url": "https://example.com/1", "title": "New title"},
+            '"v2"',
+            "Thu, 26 Jan 2023 00:00:00 GMT",
+        ),
+    ):
+        assert getIssue("foo", "bar", "1", None).title == "New title"
+
+        entry = cache.get("foo", "bar", "1")
+        assert (entry.title, entry.etag, entry.last_modified) == (
+            "New title",
+            '"v2"',
+            "Thu, 26 Jan 2023 00:00:00 GMT",
+        )
+        assert cache.isFresh(entry)
+
+
+def test_304_without_a_cached_entry_is_not_found():
+    """We never ask for a 304 without a cache entry, but if we get one anyway, there's no issue to return."""
+    with patch("issue_expander.client.request", side_effect=not_modified):
+        assert getIssue("foo", "bar", "1", None) is None
+
+
+def test_caches_from_older_versions_are_rebuilt(tmp_path):
+    """A cache file with an older table layout is thrown away rather than misread."""
+    db = sqlite3.connect(str(tmp_path / CACHE_FILENAME))
+    db.execute(
+        "CREATE TABLE issues (owner, repository, number, title, html_url, fetched_at, etag, last_used)"
+    )
+    db.execute("INSERT INTO issues VALUES ('foo', 'bar', '1', 't', 'u', 0, NULL, 0)")
+    db.commit()
+    db.close()
+
+    cache = IssueCache(tmp_path)
+    assert cache.get("foo", "bar", "1") is None
+    cache.put("foo", "bar", "1", "t", "u", '"e"', "Thu, 26 Jan 2023 00:00:00 GMT")
+    assert cache.get("foo", "bar", "1").last_modified == "Thu, 26 Jan 2023 00:00:00 GMT"
+    cache.close()
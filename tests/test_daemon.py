@@ -0,0 +1,286 @@
+import io
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import daemon
+from issue_expander.cache import Issue
+from issue_expander.expander import cli
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Expand references to any issue but #404, recording each lookup."""
+    calls = []
+
+    def mockIssue(owner, repository, number, token):
+        calls.append((owner, repository, number, token))
+        if number == "404":
+            return None
+        return Issue(f"Issue {number}", f"https://example.com/{owner}/{repository}/{number}")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    return calls
+
+
+@pytest.fixture
+def server(tmp_path, lookups):
+    """A daemon serving on a socket in tmp_path, in a thread. The socket's path is in .path."""
+    path = str(tmp_path / "daemon.sock")
+    server = daemon.makeServer(path, concurrency=2, memo_ttl=60)
+    server.path = path
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server):
+    return daemon.Client(daemon.connect(server.path))
+
+
+@pytest.mark.parametrize(
+    "data,error",
+    (
+        (b"\x00\x00", "truncated frame"),
+        (b"\x00\x00\x00\x05{}", "truncated frame"),
+        (b"\x10\x00\x00\x00", "bigger than"),
+        (b"\x00\x00\x00\x02\xff\xfe", "isn't JSON"),
+        (b"\x00\x00\x00\x01{", "isn't JSON"),
+    ),
+)
+def test_bad_frames(data, error):
+    """Frames that are cut short, too big, or not JSON are refused."""
+    with pytest.raises(daemon.ProtocolError, match=error):
+        daemon.readFrame(io.BytesIO(data))
+
+
+def test_frames_round_trip():
+    """What's written as a frame reads back the same, and the end of the stream reads as None."""
+    stream = io.BytesIO(daemon.encodeFrame({"text": "Ünïcode"}) + daemon.encodeFrame([1, 2]))
+    assert daemon.readFrame(stream) == {"text": "Ünïcode"}
+    assert daemon.readFrame(stream) == [1, 2]
+    assert daemon.readFrame(stream) is None
+
+
+def test_daemon_expands_requests(server, lookups):
+    """One connection can send many requests, each with its own options."""
+    remote = client(server)
+    try:
+        assert (
+            remote.expand("#1", default_source="foo/bar") == "[Issue 1 #1](https://example.com/foo/bar/1)"
+        )
+        assert remote.expand("`#1` #404", "sekrit", "foo/bar") == "`#1` #404"
+        assert remote.expand("`#2`", default_source="foo/bar", markdown=False) == (
+            "`[Issue 2 #2](https://example.com/foo/bar/2)`"
+        )
+    finally:
+        remote.close()
+    assert lookups[1] == ("foo", "bar", "404", "sekrit")
+
+
+@pytest.mark.parametrize(
+    "request_,error",
+    (
+        (["#1"], "a request needs text"),
+        ({"text": 1}, "a request needs text"),
+        (
+            {"text": "#1", "default_source": "nope"},
+            "default source must be in the format 'owner/repository'",
+        ),
+        ({"text": "#1", "graphql": True}, "--graphql needs a GitHub token"),
+    ),
+)
+def test_daemon_refuses_bad_requests(server, request_, error):
+    """Requests that don't make sense get errors back, and the connection can still be used."""
+    connection = daemon.connect(server.path)
+    stream = connection.makefile("rb")
+    try:
+        connection.sendall(daemon.encodeFrame(request_))
+        assert daemon.readFrame(stream) == {"error": error}
+        connection.sendall(daemon.encodeFrame({"text": "foo/bar#3"}))
+        assert daemon.readFrame(stream) == {"text": "[Issue 3 #3](https://example.com/foo/bar/3)"}
+    finally:
+        stream.close()
+        connection.close()
+
+
+def test_daemon_hangs_up_on_bad_frames(server):
+    """A frame that can't be read is answered with an error, and the connection closed."""
+    remote = client(server)
+    remote.connection.sendall(b"\x00\x00\x00\x01{")
+    try:
+        assert daemon.readFrame(remote._reader)["error"].startswith("frame isn't JSON: ")
+        assert daemon.readFrame(remote._reader) is None
+    finally:
+        remote.close()
+
+
+def test_client_reports_errors(server):
+    """Errors from the daemon are raised as DaemonError."""
+    remote = client(server)
+    try:
+        with pytest.raises(daemon.DaemonError, match="^--graphql needs a GitHub token$"):
+            remote.expand("#1", use_graphql=True)
+    finally:
+        remote.close()
+
+
+def test_client_loses_the_daemon():
+    """A daemon that hangs up, or has gone away, is lost."""
+    ours, theirs = socket.socketpair(socket.AF_UNIX)
+    remote = daemon.Client(ours)
+    try:
+        theirs.shutdown(socket.SHUT_WR)
+        with pytest.raises(daemon.DaemonError, match="^lost the daemon: it hung up$"):
+            remote.expand("#1")
+        theirs.close()
+        with pytest.raises(daemon.DaemonError, match="^lost the daemon: "):
+            remote.expand("#1")
+    finally:
+        remote.close()
+
+
+def test_lookups_are_forgotten_after_memo_ttl(monkeypatch):
+    """Lookups are remembered between requests, until they're memo_ttl seconds old."""
+    now = [0]
+    clears = []
+    monkeypatch.setattr(issue_expander.expander.getIssue, "cache_clear", lambda: clears.append(now[0]))
+    expander = daemon.Expander(1, 60, clock=lambda: now[0])
+    for seconds in (10, 59, 60, 119, 120):
+        now[0] = seconds
+        assert expander.answer({"text": "nothing"}) == {"text": "nothing"}
+    assert clears == [60, 120]
+
+
+def test_stale_sockets_are_replaced(tmp_path, lookups):
+    """A socket a daemon left behind is replaced, but not one a daemon is still listening on, or anything else."""
+    path = tmp_path / "daemon.sock"
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    server = daemon.makeServer(str(path), 1, 60)
+    try:
+        assert (path.stat().st_mode & 0o777) == 0o600
+        with pytest.raises(OSError, match="already serving"):
+            daemon.makeServer(str(path), 1, 60)
+    finally:
+        server.server_close()
+
+    path.unlink()
+    path.write_text("not a socket")
+    with pytest.raises(OSError, match="isn't a socket"):
+        daemon.makeServer(str(path), 1, 60)
+
+
+def test_serve_until_interrupted(tmp_path, monkeypatch, capsys):
+    """serve runs until it's interrupted or terminated, and then cleans up its socket."""
+    path = tmp_path / "daemon.sock"
+
+    def terminated(self, poll_interval=0.5):
+        assert path.exists()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    monkeypatch.setattr(socketserver.ThreadingUnixStreamServer, "serve_forever", terminated)
+    daemon.serve(str(path), 1, 60)
+    assert not path.exists()
+    assert capsys.readouterr().err == f"Expanding references for clients on {path}.\n"
+    assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+
+
+def test_no_unix_sockets(tmp_path, monkeypatch):
+    """Where there are no Unix sockets, there's no serving, and no daemon to connect to."""
+    monkeypatch.delattr(socketserver, "ThreadingUnixStreamServer")
+    with pytest.raises(OSError, match="aren't supported"):
+        daemon.makeServer(str(tmp_path / "daemon.sock"), 1, 60)
+    monkeypatch.delattr(socket, "AF_UNIX")
+    assert daemon.connect(str(tmp_path / "daemon.sock")) is None
+
+
+def test_cli_connect(server, lookups, tmp_path):
+    """--connect has the daemon expand stdin, a file, or many files, in place or not."""
+    runner = CliRunner()
+    args = ["--connect", server.path, "--default-source", "foo/bar"]
+    result = runner.invoke(cli, args + ["-"], input="#1")
+    assert result.output == "[Issue 1 #1](https://example.com/foo/bar/1)"
+
+    (tmp_path / "a.md").write_text("#2\n")
+    (tmp_path / "b.md").write_text("#404\n")
+    (tmp_path / "c.md").write_bytes(b"\xff")
+    result = runner.invoke(cli, args + [str(tmp_path / "a.md"), str(tmp_path / "b.md")])
+    assert result.output == "[Issue 2 #2](https://example.com/foo/bar/2)\n#404\n"
+
+    result = runner.invoke(cli, args + ["-i", str(tmp_path / "*.md")])
+    assert result.output.startswith(f"Unable to read {tmp_path / 'c.md'}: ")
+    assert (tmp_path / "a.md").read_text() == "[Issue 2 #2](https://example.com/foo/bar/2)\n"
+    assert (tmp_path / "b.md").read_text() == "#404\n"
+
+
+def test_cli_connect_keeps_line_endings(server, lookups, tmp_path):
+    """Like expanding it here, a file's CRLF line endings, and bytes that aren't UTF-8, come out as they went in."""
+    (tmp_path / "a.md").write_bytes(b"#1\r\n\xff\r\n")
+    result = CliRunner().invoke(
+        cli, ["--connect", server.path, "--default-source", "foo/bar", str(tmp_path / "a.md")]
+    )
+    assert result.stdout_bytes == b"[Issue 1 #1](https://example.com/foo/bar/1)\r\n\xff\r\n"
+
+
+def test_cli_connect_falls_back(lookups, tmp_path):
+    """Without a daemon to connect to, --connect expands here."""
+    result = CliRunner().invoke(
+        cli, ["--connect", str(tmp_path / "nobody.sock"), "--no-cache", "-"], input="foo/bar#1"
+    )
+    assert result.output == "[Issue 1 #1](https://example.com/foo/bar/1)"
+
+
+def test_cli_connect_errors(server):
+    """Errors from the daemon are reported, and end the run."""
+    server.expander.answer = lambda request: {"error": "Broken"}
+    result = CliRunner().invoke(cli, ["--connect", server.path, "-"], input="#1")
+    assert result.exit_code == 1
+    assert result.output == "Error: Broken\n"
+
+
+@pytest.mark.parametrize(
+    "args,error",
+    (
+        (["--serve", "x.sock", "-"], "--serve doesn't expand FILE itself"),
+        (["--serve", "x.sock", "--connect", "y.sock"], "--serve doesn't expand FILE itself"),
+        (["--connect", "x.sock", "--offline", "-"], "--connect can't be used with"),
+        (["--connect", "x.sock", "--stats", "-"], "--connect can't be used with"),
+    ),
+)
+def test_cli_daemon_conflicts(args, error):
+    """--serve and --connect can't be used with options that don't make sense with them."""
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 1
+    assert result.output.startswith(f"Error: {error}")
+
+
+def test_cli_serve(tmp_path, monkeypatch):
+    """--serve serves until it's stopped, with the cache open, and says if it can't."""
+    served = []
+
+    def serve(path, concurrency, memo_ttl):
+        served.append((path, concurrency, memo_ttl, issue_expander.expander.issueCache() is not None))
+
+    monkeypatch.setattr(daemon, "serve", serve)
+    result = CliRunner().invoke(cli, ["--serve", "x.sock", "--concurrency", "3", "--cache-ttl", "5"])
+    assert result.exit_code == 0
+    assert served == [("x.sock", 3, 5, True)]
+
+    (tmp_path / "file").write_text("")
+    monkeypatch.undo()
+    result = CliRunner().invoke(cli, ["--serve", str(tmp_path / "file")])
+    assert result.exit_code == 1
+    assert (
+        result.output
+        == f"Error: unable to serve on {tmp_path / 'file'}: {tmp_path / 'file'} exists, and isn't a socket\n"
+    )
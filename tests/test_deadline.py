@@ -0,0 +1,192 @@
+import io
+import sqlite3
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import client, stats
+from issue_expander.cache import Issue, IssueCache
+from issue_expander.expander import cli, expandFiles, expandRefsWithin, resolveRefsBy, useIssueCache
+from issue_expander.ratelimit import RateLimitExceeded
+
+
+@pytest.fixture
+def slow_lookups(monkeypatch):
+    """Look up issues straight away, recording each lookup, but #404 doesn't exist, and #999 takes until the test
+    ends."""
+    calls = []
+    finished = threading.Event()
+
+    def mockIssue(owner, repository, number, token):
+        calls.append(int(number))
+        if number == "999":
+            finished.wait()
+        if number == "404":
+            return None
+        return Issue(f"Issue {number}", f"https://github.com/{owner}/{repository}/issues/{number}")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    monkeypatch.setattr(client, "_shared_client", None)
+    yield calls
+    finished.set()
+
+
+def test_slow_lookups_are_skipped(slow_lookups):
+    """What's looked up by the deadline is used, missing or not, and the rest is skipped."""
+    keys = [("foo", "bar", "999"), ("foo", "bar", "1"), ("foo", "bar", "404")]
+    issues, skipped = resolveRefsBy(keys, time.monotonic() + 0.2)
+    assert issues == {
+        ("foo", "bar", "1"): Issue("Issue 1", "https://github.com/foo/bar/issues/1"),
+        ("foo", "bar", "404"): None,
+    }
+    assert skipped == [("foo", "bar", "999")]
+
+
+def test_cached_issues_come_first(slow_lookups, tmp_path):
+    """Cached issues are used, even if there's no time left to look anything up."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Cached", "https://example.com/1")
+    cache.putMissing("foo", "bar", "404")
+    with useIssueCache(cache):
+        issues, skipped = resolveRefsBy(
+            [("foo", "bar", "2"), ("foo", "bar", "1"), ("foo", "bar", "404")], time.monotonic()
+        )
+    assert issues == {
+        ("foo", "bar", "1"): Issue("Cached", "https://example.com/1"),
+        ("foo", "bar", "404"): None,
+    }
+    assert skipped == [("foo", "bar", "2")]
+    assert slow_lookups == []
+
+
+def test_failed_lookups_are_skipped(monkeypatch):
+    """Lookups that failed for the time being are skipped too, to be tried again later."""
+    monkeypatch.setattr(client, "_shared_client", None)
+    with patch("issue_expander.client.request", side_effect=OSError("Nope")):
+        issues, skipped = resolveRefsBy([("foo", "bar", "1")], time.monotonic() + 10)
+    assert (issues, skipped) == ({}, [("foo", "bar", "1")])
+
+
+def test_rate_limited_lookups_are_skipped(monkeypatch):
+    """Lookups the rate limiter gave up on are skipped too, though they aren't tried again soon."""
+    monkeypatch.setattr(client, "_shared_client", None)
+    with patch("issue_expander.client.request", side_effect=RateLimitExceeded()):
+        issues, skipped = resolveRefsBy([("foo", "bar", "1")], time.monotonic() + 10)
+    assert (issues, skipped) == ({}, [("foo", "bar", "1")])
+
+
+def test_claims_arent_waited_for_past_the_deadline(monkeypatch, tmp_path):
+    """An issue another process is looking up is only waited for until the deadline, and then skipped."""
+    monkeypatch.setattr(client, "_shared_client", None)
+    theirs = IssueCache(tmp_path)
+    with patch.object(IssueCache, "_claimant", return_value="elsewhere:1:1"):
+        theirs.claim("foo", "bar", "1")
+    sink = stats.Stats()
+    with useIssueCache(IssueCache(tmp_path)), stats.useSink(sink), patch(
+        "issue_expander.client.request"
+    ) as request:
+        started = time.monotonic()
+        issues, skipped = resolveRefsBy([("foo", "bar", "1")], started + 0.2)
+        # the lookup gives up about then too, rather than waiting on in the background
+        while "lookups.failed" not in sink.counters and time.monotonic() - started < 5:
+            time.sleep(0.01)
+        assert time.monotonic() - started < 5
+        request.assert_not_called()
+    assert (issues, skipped) == ({}, [("foo", "bar", "1")])
+    theirs.close()
+
+
+def test_lookups_after_the_deadline_dont_need_the_cache(monkeypatch):
+    """A lookup still going at the deadline quietly gives up if the cache is closed under it, but otherwise, a
+    closed cache is an error."""
+    finished = threading.Event()
+    errors = []
+
+    def closedCache(owner, repository, number, token):
+        if number == "999":
+            finished.wait()
+        raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", closedCache)
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    resolveRefsBy([("foo", "bar", "999")], time.monotonic() + 0.1)
+    finished.set()
+    resolveRefsBy([("foo", "bar", "1")], time.monotonic() + 0.2)
+    for _ in range(100):
+        if errors:
+            break
+        time.sleep(0.01)
+    assert [type(error.exc_value) for error in errors] == [sqlite3.ProgrammingError]
+
+
+def test_expandRefsWithin(slow_lookups):
+    """References that weren't looked up in time are left as they are, and listed in the order they're in."""
+    expansion = expandRefsWithin(
+        "#999, #1 and foo/baz#999, but not `#2`.", 0.2, None, "foo", "bar", concurrency=1
+    )
+    assert expansion.text == "#999, #1 and foo/baz#999, but not `#2`."
+    assert expansion.skipped == [("foo", "bar", "999"), ("foo", "bar", "1"), ("foo", "baz", "999")]
+
+    expansion = expandRefsWithin("#999, #1 and foo/baz#999.", 0.2, None, "foo", "bar")
+    assert expansion.text == "#999, [Issue 1 #1](https://github.com/foo/bar/issues/1) and foo/baz#999."
+    assert expansion.skipped == [("foo", "bar", "999"), ("foo", "baz", "999")]
+
+
+def test_cli_deadline(slow_lookups, tmp_path):
+    """--deadline expands what it can in time, from stdin or files, and lists what it couldn't on stderr."""
+    (tmp_path / "a.md").write_text("#1 #999\n")
+    (tmp_path / "b.md").write_text("#2\n")
+    runner = CliRunner()
+    expanded = "[Issue 1 #1](https://github.com/foo/bar/issues/1) #999\n"
+    for args, output in (
+        (["-"], expanded),
+        (
+            [str(tmp_path / "a.md"), str(tmp_path / "b.md")],
+            expanded + "[Issue 2 #2](https://github.com/foo/bar/issues/2)\n",
+        ),
+    ):
+        result = runner.invoke(
+            cli,
+            ["--no-cache", "--default-source", "foo/bar", "--deadline", "0.2"] + args,
+            input="#1 #999\n",
+        )
+        assert result.exit_code == 0
+        assert result.output.startswith(output)
+        assert "Not looked up by the deadline, so left as they are: foo/bar#999\n" in result.output
+    assert client.sharedClient().timeout == 0.2
+
+    runner.invoke(cli, ["--no-cache", "-"], input="#1\n")
+    assert client.sharedClient().timeout == client.DEFAULT_TIMEOUT
+
+
+def test_cli_deadline_keeps_line_endings(slow_lookups, tmp_path):
+    """With --deadline, CRLF line endings, and bytes that aren't UTF-8, come out as they went in, like without."""
+    (tmp_path / "a.md").write_bytes(b"#1\r\n\xff #999\r\n")
+    for args in ([str(tmp_path / "a.md")], ["-"]):
+        result = CliRunner().invoke(
+            cli,
+            ["--no-cache", "--default-source", "foo/bar", "--deadline", "0.2"] + args,
+            input=b"#1\r\n\xff #999\r\n",
+        )
+        assert result.exit_code == 0
+        assert result.stdout_bytes == b"[Issue 1 #1](https://github.com/foo/bar/issues/1)\r\n\xff #999\r\n"
+
+
+def test_expandFiles_deadline(slow_lookups, tmp_path):
+    """Files are expanded by a deadline too, even if nobody wants to know what was skipped."""
+    (tmp_path / "a.md").write_text("foo/bar#1 foo/bar#999\n")
+    output = io.StringIO()
+    expandFiles([str(tmp_path / "a.md")], output, deadline=time.monotonic() + 0.2)
+    assert output.getvalue() == "[Issue 1 #1](https://github.com/foo/bar/issues/1) foo/bar#999\n"
+
+
+@pytest.mark.parametrize("option", (["--graphql", "-p", "token"], ["--warm-over", "1"], ["--connect", "x"]))
+def test_cli_deadline_conflicts(option):
+    """--deadline only works with lookups it can give up on."""
+    result = CliRunner().invoke(cli, ["--deadline", "1", "-"] + option)
+    assert result.exit_code == 1
+    assert result.output.startswith("Error: --deadline can't be used with")
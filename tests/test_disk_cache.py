@@ -0,0 +1,447 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from email.message import Message
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import cache as cache_module
+from issue_expander.cache import CACHE_FILENAME, Issue, IssueCache, defaultCacheDir
+from issue_expander.client import Response
+from issue_expander.expander import LookupFailed, cli, getIssue, issueCache, useIssueCache
+
+# Run the CLI against a fake GitHub, whose URL is the first argument.
+RUN_CLI = """
+import sys
+import issue_expander.expander
+issue_expander.expander.API_URL = sys.argv[1]
+issue_expander.expander.cli(sys.argv[2:])
+"""
+
+
+class FakeClock:
+    """A clock that only moves when we tell it to."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def issue_response(issue, etag=None):
+    """Make a Response like the HTTP client returns for an issue."""
+    headers = Message()
+    if etag:
+        headers["ETag"] = etag
+    return Response(200, headers, json.dumps(issue).encode("utf-8"), "https://api.github.com/")
+
+
+def test_default_cache_dir_follows_xdg(monkeypatch, tmp_path):
+    """The cache lives in $XDG_CACHE_HOME/issue-expander, or ~/.cache/issue-expander."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert defaultCacheDir() == tmp_path / "issue-expander"
+
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert defaultCacheDir() == tmp_path / ".cache" / "issue-expander"
+
+
+def test_entries_survive_reopening(tmp_path):
+    """What one IssueCache stores, the next one can read."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "A title", "https://example.com/1", '"abc"')
+    cache.close()
+
+    cache = IssueCache(tmp_path)
+    entry = cache.get("foo", "bar", 1)
+    assert (entry.title, entry.html_url, entry.etag) == ("A title", "https://example.com/1", '"abc"')
+    assert cache.get("foo", "bar", "2") is None
+    cache.close()
+
+
+def test_entries_go_stale_after_ttl(tmp_path):
+    """Entries are fresh until they are ttl seconds old."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, ttl=60, clock=clock)
+    cache.put("foo", "bar", "1", "A title", "https://example.com/1")
+
+    clock.now += 59
+    assert cache.isFresh(cache.get("foo", "bar", "1"))
+    clock.now += 1
+    assert not cache.isFresh(cache.get("foo", "bar", "1"))
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """Once there are too many entries, the ones used longest ago go first."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, max_entries=2, clock=clock)
+    for number in "123":
+        clock.now += 1
+        cache.put("foo", "bar", number, f"Issue {number}", f"https://example.com/{number}")
+    clock.now += 1
+    cache.get("foo", "bar", "1")
+    cache.close()
+
+    cache = IssueCache(tmp_path, max_entries=2)
+    assert len(cache) == 2
+    assert cache.get("foo", "bar", "1") is not None
+    assert cache.get("foo", "bar", "2") is None
+    assert cache.get("foo", "bar", "3") is not None
+    cache.close()
+
+
+def test_getting_entries_writes_nothing_until_eviction(tmp_path):
+    """Getting an entry only marks it used in memory, and those are all written down at once when we evict,
+    without making entries that were put since any less recently used."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, clock=clock)
+    cache.put("foo", "bar", "1", "One", "https://example.com/1")
+    cache.put("foo", "bar", "2", "Two", "https://example.com/2")
+    clock.now += 10
+    for number in "112":
+        cache.get("foo", "bar", number)
+    clock.now += 10
+    cache.put("foo", "bar", "2", "Two", "https://example.com/2")
+
+    def lastUsed():
+        with sqlite3.connect(str(tmp_path / CACHE_FILENAME)) as db:
+            return dict(db.execute("SELECT number, last_used FROM issues").fetchall())
+
+    assert not cache._db.in_transaction
+    assert lastUsed() == {"1": clock.now - 20, "2": clock.now}
+    cache.evict()
+    assert lastUsed() == {"1": clock.now - 10, "2": clock.now}
+    cache.close()
+
+
+def test_getIssue_uses_fresh_cache_entries(tmp_path):
+    """getIssue doesn't go to GitHub for an issue that's fresh in the cache."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Cached", "https://example.com/1")
+
+    with useIssueCache(cache), patch("issue_expander.client.request") as mock_request:
+        assert getIssue("foo", "bar", "1", None) == Issue("Cached", "https://example.com/1")
+        mock_request.assert_not_called()
+    assert issue_expander.expander.issue_cache is None
+
+
+def test_getIssue_fills_the_cache(tmp_path):
+    """Issues getIssue fetches are saved, along with their ETag."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, ttl=60, clock=clock)
+    clock.now += 120
+    cache.put("foo", "bar", "2", "Stale", "https://example.com/old")
+    clock.now += 120
+
+    def mock_request(method, url, headers=None, body=None):
+        number = url.rsplit("/", 1)[1]
+        return issue_response({"html_url": f"https://example.com/{number}", "title": "Fetched"}, '"v1"')
+
+    with useIssueCache(IssueCache(tmp_path, ttl=60, clock=clock)), patch(
+        "issue_expander.client.request", side_effect=mock_request
+    ) as mock_request:
+        assert getIssue("foo", "bar", "1", None).title == "Fetched"
+        assert getIssue("foo", "bar", "2", None).title == "Fetched"
+        assert mock_request.call_count == 2
+
+    cache = IssueCache(tmp_path)
+    assert cache.get("foo", "bar", "1")[:2] == ("Fetched", "https://example.com/1")
+    assert cache.get("foo", "bar", "2").etag == '"v1"'
+    cache.close()
+
+
+def test_cli_reuses_cache_between_runs(tmp_path):
+    """A second run over the same input doesn't look anything up."""
+    with patch(
+        "issue_expander.client.request",
+        side_effect=lambda *args, **kwargs: issue_response(
+            {"html_url": "https://example.com/1", "title": "Hi"}
+        ),
+    ) as mock_request:
+        runner = CliRunner()
+        for _ in range(2):
+            getIssue.cache_clear()
+            result = runner.invoke(cli, ["--cache-dir", str(tmp_path), "-"], input="foo/bar#1\n")
+            assert result.output == "[Hi #1](https://example.com/1)\n"
+        assert mock_request.call_count == 1
+
+        getIssue.cache_clear()
+        runner.invoke(cli, ["--cache-dir", str(tmp_path), "--cache-ttl", "0", "-"], input="foo/bar#1\n")
+        assert mock_request.call_count == 2
+
+
+def test_cli_only_opens_the_cache_to_look_something_up(tmp_path):
+    """Runs that don't look anything up leave the disk alone, and ones that only read the cache don't evict."""
+    result = CliRunner().invoke(cli, ["--cache-dir", str(tmp_path), "-"], input="Nothing to see here.\n")
+    assert result.output == "Nothing to see here.\n"
+    assert not (tmp_path / CACHE_FILENAME).exists()
+
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Hi", "https://example.com/1")
+    cache.close()
+    with patch.object(IssueCache, "evict") as evict:
+        result = CliRunner().invoke(cli, ["--cache-dir", str(tmp_path), "-"], input="foo/bar#1\n")
+    assert result.output == "[Hi #1](https://example.com/1)\n"
+    evict.assert_not_called()
+
+
+def test_issue_cache_is_opened_once(tmp_path):
+    """However many threads want the issue cache first, it's only opened once."""
+    opened = []
+
+    def openCache():
+        time.sleep(0.1)
+        opened.append(IssueCache(tmp_path))
+        return opened[-1]
+
+    caches = []
+    with useIssueCache(openCache):
+        threads = [threading.Thread(target=lambda: caches.append(issueCache())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(opened) == 1
+    assert caches == opened * 4
+    assert issueCache() is None
+
+
+def test_cli_uses_default_cache_dir():
+    """Without --cache-dir, the cache goes in the default location."""
+    with patch(
+        "issue_expander.client.request",
+        side_effect=lambda *args, **kwargs: issue_response(
+            {"html_url": "https://example.com/1", "title": "Hi"}
+        ),
+    ):
+        result = CliRunner().invoke(cli, ["-"], input="foo/bar#1")
+    assert result.exit_code == 0
+    assert (defaultCacheDir() / CACHE_FILENAME).exists()
+
+
+def test_cli_no_cache(tmp_path):
+    """--no-cache leaves the disk alone."""
+    with patch(
+        "issue_expander.client.request",
+        side_effect=lambda *args, **kwargs: issue_response(
+            {"html_url": "https://example.com/1", "title": "Hi"}
+        ),
+    ):
+        result = CliRunner().invoke(
+            cli, ["--no-cache", "--cache-dir", str(tmp_path / "c"), "-"], input="foo/bar#1"
+        )
+    assert result.output == "[Hi #1](https://example.com/1)"
+    assert not (tmp_path / "c").exists()
+
+
+def test_cli_carries_on_without_a_usable_cache(tmp_path):
+    """If the cache can't be opened, say so, and expand anyway."""
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    with patch(
+        "issue_expander.client.request",
+        side_effect=lambda *args, **kwargs: issue_response(
+            {"html_url": "https://example.com/1", "title": "Hi"}
+        ),
+    ):
+        result = CliRunner().invoke(
+            cli, ["--cache-dir", str(not_a_directory / "cache"), "-"], input="foo/bar#1"
+        )
+    assert result.exit_code == 0
+    assert "[Hi #1](https://example.com/1)" in result.output
+    assert "Unable to open issue cache" in result.output
+
+
+def test_one_claim_at_a_time(tmp_path):
+    """Only one of the processes sharing a cache can claim an issue, until they release it."""
+    ours, theirs = IssueCache(tmp_path), IssueCache(tmp_path)
+    assert ours.claim("foo", "bar", 1)
+    assert not theirs.claim("foo", "bar", "1")
+    assert theirs.claim("foo", "bar", 2)
+    ours.release("foo", "bar", 1)
+    assert theirs.claim("foo", "bar", 1)
+    ours.close()
+    theirs.close()
+
+
+def test_only_the_claimant_releases(tmp_path):
+    """Releasing an issue someone else claimed doesn't take their claim away."""
+    cache = IssueCache(tmp_path)
+    thread = threading.Thread(target=cache.claim, args=("foo", "bar", 1))
+    thread.start()
+    thread.join()
+    cache.release("foo", "bar", 1)
+    assert not cache.claim("foo", "bar", 1)
+    cache.close()
+
+
+def test_old_claims_are_given_up_on(tmp_path):
+    """A claim claim_timeout seconds old is waited for no longer, and can be claimed again."""
+    clock = FakeClock()
+    ours = IssueCache(tmp_path, clock=clock, claim_timeout=10)
+    theirs = IssueCache(tmp_path, clock=clock, claim_timeout=10, sleep=lambda seconds: None)
+    ours.claim("foo", "bar", 1)
+    clock.now += 9
+    assert not theirs.claim("foo", "bar", 1)
+    clock.now += 1
+    theirs.waitForClaim("foo", "bar", 1)
+    assert theirs.claim("foo", "bar", 1)
+    ours.close()
+    theirs.close()
+
+
+def test_claims_arent_waited_for_past_until(tmp_path):
+    """waitForClaim gives up at until, however long the claim has left."""
+    theirs = IssueCache(tmp_path)
+    thread = threading.Thread(target=theirs.claim, args=("foo", "bar", 1))
+    thread.start()
+    thread.join()
+    ours = IssueCache(tmp_path, sleep=lambda seconds: pytest.fail("waited past until"))
+    ours.waitForClaim("foo", "bar", 1, until=time.monotonic())
+    ours.close()
+    theirs.close()
+
+
+def test_closing_releases_our_claims(tmp_path):
+    """Closing a cache releases every claim this process made, in whichever thread, but not others'."""
+    cache = IssueCache(tmp_path)
+    for number in (1, 2):
+        thread = threading.Thread(target=cache.claim, args=("foo", "bar", number))
+        thread.start()
+        thread.join()
+    with patch.object(IssueCache, "_claimant", return_value="elsewhere:1:1"):
+        cache.claim("foo", "bar", 3)
+    cache.close()
+    cache = IssueCache(tmp_path)
+    assert cache._db.execute("SELECT number FROM claims").fetchall() == [("3",)]
+    cache.close()
+
+
+def test_issues_looked_up_since_cant_be_claimed(tmp_path):
+    """An issue someone cached, or found missing, after we last looked isn't claimed, unless it's stale."""
+    clock = FakeClock()
+    ours = IssueCache(tmp_path, clock=clock, ttl=10, missing_ttl=10)
+    theirs = IssueCache(tmp_path, clock=clock, ttl=10, missing_ttl=10)
+    theirs.put("foo", "bar", 1, "Theirs", "https://example.com/1")
+    theirs.putMissing("foo", "bar", 2)
+    assert not ours.claim("foo", "bar", 1)
+    assert not ours.claim("foo", "bar", 2)
+    clock.now += 10
+    assert ours.claim("foo", "bar", 1)
+    assert ours.claim("foo", "bar", 2)
+    ours.close()
+    theirs.close()
+
+
+def test_claims_of_exited_processes_are_taken_over(tmp_path):
+    """A claim made by a process on this machine that's since exited isn't waited for, and can be claimed."""
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    cache = IssueCache(tmp_path, sleep=lambda seconds: pytest.fail("waited for an exited process"))
+    for number, claimant in (
+        (1, f"{cache_module._HOST}:{process.pid}:1"),
+        (2, f"elsewhere:{process.pid}:1"),
+    ):
+        with cache._db:
+            cache._db.execute(
+                "INSERT INTO claims (owner, repository, number, claimant, claimed_at) VALUES (?, ?, ?, ?, ?)",
+                ("foo", "bar", str(number), claimant, cache.clock()),
+            )
+    cache.waitForClaim("foo", "bar", 1)
+    assert cache.claim("foo", "bar", 1)
+    assert not cache.claim("foo", "bar", 2)
+    cache.close()
+
+
+def test_claimantExited():
+    """Only processes on this machine are checked, and ones we may not signal are running."""
+    assert not cache_module._claimantExited(f"{cache_module._HOST}:{os.getpid()}:1")
+    with patch("os.kill", side_effect=PermissionError):
+        assert not cache_module._claimantExited(f"{cache_module._HOST}:1:1")
+    assert not cache_module._claimantExited(f"{cache_module._HOST}:nope:1")
+    with patch.object(cache_module, "_HOST", None):
+        assert not cache_module._claimantExited("None:99999999:1")
+
+
+def test_getIssue_waits_for_whoever_claimed_it(tmp_path):
+    """getIssue doesn't look up an issue another process is looking up, but waits for them to cache it."""
+    theirs = IssueCache(tmp_path)
+    theirs.claim("foo", "bar", 1)
+
+    def lookUpMeanwhile(seconds):
+        theirs.put("foo", "bar", 1, "Theirs", "https://example.com/1")
+        theirs.release("foo", "bar", 1)
+
+    with useIssueCache(IssueCache(tmp_path, sleep=lookUpMeanwhile)), patch(
+        "issue_expander.client.request"
+    ) as mock_request:
+        assert getIssue("foo", "bar", 1, None) == Issue("Theirs", "https://example.com/1")
+        mock_request.assert_not_called()
+
+
+def test_getIssue_waits_for_missing_issues(tmp_path):
+    """An issue the claimant found doesn't exist isn't looked up again either."""
+    theirs = IssueCache(tmp_path)
+    theirs.claim("foo", "bar", 1)
+
+    def lookUpMeanwhile(seconds):
+        theirs.putMissing("foo", "bar", 1)
+        theirs.release("foo", "bar", 1)
+
+    with useIssueCache(IssueCache(tmp_path, sleep=lookUpMeanwhile)), patch(
+        "issue_expander.client.request"
+    ) as mock_request:
+        assert getIssue("foo", "bar", 1, None) is None
+        mock_request.assert_not_called()
+
+
+def test_getIssue_looks_up_what_the_claimant_could_not(tmp_path):
+    """If whoever claimed an issue gives up on it, getIssue looks it up itself, and releases it either way."""
+    theirs = IssueCache(tmp_path)
+    theirs.claim("foo", "bar", 1)
+    ours = IssueCache(tmp_path, sleep=lambda seconds: theirs.release("foo", "bar", 1))
+
+    with useIssueCache(ours), patch(
+        "issue_expander.client.request",
+        side_effect=[
+            issue_response({"html_url": "https://example.com/1", "title": "Ours"}),
+            OSError("Nope"),
+        ],
+    ):
+        assert getIssue("foo", "bar", 1, None) == Issue("Ours", "https://example.com/1")
+        try:
+            getIssue("foo", "bar", 2, None)
+        except LookupFailed:
+            pass
+    assert theirs._db.execute("SELECT COUNT(*) FROM claims").fetchone()[0] == 0
+
+
+def test_processes_look_up_each_issue_once(tmp_path, fake_github):
+    """However many processes share a cache, each issue is only looked up once."""
+    for number in range(1, 6):
+        fake_github.addIssue("foo", "bar", number, f"Issue {number}")
+    text = "foo/bar#1 foo/bar#2 foo/bar#3 foo/bar#4 foo/bar#5 foo/bar#404\n"
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", RUN_CLI, fake_github.url, "--cache-dir", str(tmp_path), "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        for _ in range(8)
+    ]
+    for process in processes:
+        output, _ = process.communicate(text.encode("utf-8"))
+        assert output.decode("utf-8").startswith("[Issue 1 #1](https://github.com/foo/bar/issues/1) ")
+    assert Counter(path for _, path, _, _ in fake_github.requests) == {
+        f"/repos/foo/bar/issues/{number}": 1 for number in (1, 2, 3, 4, 5, 404)
+    }
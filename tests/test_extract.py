@@ -0,0 +1,166 @@
+import io
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import extract, stats
+from issue_expander.expander import cli
+
+MARKDOWN = """See #1, GH-2 and foo/bar#3, but not `#4`.
+
+```
+#5 is in a code block
+```
+
+Ünïcode, then https://github.com/foo/bar/issues/6 and [#7](https://example.com).
+
+~~~~python
+#8
+
+#9
+~~~~
+#10
+"""
+
+
+def records(jsonl: str) -> list:
+    return [json.loads(line) for line in jsonl.splitlines()]
+
+
+@pytest.fixture
+def no_lookups(monkeypatch):
+    """Fail the test if anything is looked up."""
+
+    def mockIssue(owner, repository, number, token):
+        raise AssertionError("looked up an issue")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+
+def test_scanChunk():
+    """Every reference is listed, with its byte offset, kind and the issue it refers to, if we can tell."""
+    chunk = extract.Chunk("a.md", 100, 100 + len(MARKDOWN.encode("utf-8")), MARKDOWN)
+    listed, fence = extract.scanChunk(chunk, "me", "mine")
+    assert fence is None
+    listed = records(listed)
+    assert [record["number"] for record in listed] == [1, 2, 3, 6, 10]
+    assert listed[0] == {
+        "file": "a.md",
+        "offset": 104,
+        "kind": "number",
+        "owner": "me",
+        "repository": "mine",
+        "number": 1,
+        "text": "#1",
+    }
+    assert [record["kind"] for record in listed] == ["number", "gh", "repository", "url", "number"]
+    data = MARKDOWN.encode("utf-8")
+    for record in listed:
+        start = record["offset"] - 100
+        assert data[start : start + len(record["text"])].decode("utf-8") == record["text"]
+
+    listed, _ = extract.scanChunk(chunk, markdown=False)
+    assert [(record["owner"], record["number"]) for record in records(listed)] == [
+        (None, n) if n != 3 and n != 6 else ("foo", n) for n in range(1, 11)
+    ]
+
+
+def test_scanChunk_reads_files(tmp_path):
+    """Chunks of files are read by whoever scans them, and can start in a code block."""
+    path = tmp_path / "a.md"
+    path.write_bytes(b"\xff #1\n```\n#2\n")
+    listed, fence = extract.scanChunk(extract.Chunk(str(path), 0, 12, None))
+    assert [record["offset"] for record in records(listed)] == [2]
+    assert fence == ("`", 3)
+
+    listed, fence = extract.scanChunk(extract.Chunk(str(path), 0, 5, None), fence=("`", 3))
+    assert (listed, fence) == ("", ("`", 3))
+
+
+@pytest.mark.parametrize("markdown", (True, False))
+@pytest.mark.parametrize("size", (1, 8, 30, 1000))
+def test_fileChunks(tmp_path, markdown, size):
+    """Files are split into chunks that end at the ends of lines, or with markdown, at blank lines if they can."""
+    path = tmp_path / "a.md"
+    path.write_text(MARKDOWN + "no newline at the end")
+    data = path.read_bytes()
+    chunks = list(extract.fileChunks([str(path)], markdown, size))
+    assert chunks[0].start == 0
+    assert chunks[-1].end == len(data)
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk.end == following.start
+        assert data[: chunk.end].endswith(b"\n")
+        if markdown:
+            assert data[: chunk.end].endswith(b"\n\n") or b"\n\n" not in data[chunk.end - 1 :]
+
+
+def test_fileChunks_skips_unreadable_files(tmp_path, capsys):
+    """Files that can't be read are reported, and the rest are chunked."""
+    (tmp_path / "b.md").write_text("#1\n")
+    chunks = list(extract.fileChunks([str(tmp_path / "a.md"), str(tmp_path / "b.md")]))
+    assert chunks == [extract.Chunk(str(tmp_path / "b.md"), 0, 3, None)]
+    assert capsys.readouterr().err.startswith(f"Unable to read {tmp_path / 'a.md'}: ")
+
+
+def test_streamChunks():
+    """stdin is chunked like expandStream chunks it, counting bytes, and leaving the stream open."""
+    data = "Ünïcode #1 " * 10
+    stream = io.BytesIO(data.encode("utf-8"))
+    chunks = list(extract.streamChunks(stream, markdown=False, size=16))
+    assert "".join(chunk.text for chunk in chunks) == data
+    assert chunks[-1].end == len(data.encode("utf-8"))
+    assert [chunk.line_start for chunk in chunks[:2]] == [True, False]
+    assert not stream.closed
+
+
+@pytest.mark.parametrize("jobs", (1, 2))
+@pytest.mark.parametrize("size", (1, 20, 100))
+def test_listRefs_matches_scanning_everything(tmp_path, jobs, size):
+    """However files are chunked, and however many processes scan them, the references listed are the same."""
+    (tmp_path / "a.md").write_text(MARKDOWN * 3)
+    (tmp_path / "b.md").write_text("```\n" + MARKDOWN)
+    paths = [str(tmp_path / "a.md"), str(tmp_path / "b.md")]
+    expected = "".join(extract.scanChunk(chunk)[0] for chunk in extract.fileChunks(paths, size=10**6))
+
+    output = io.StringIO()
+    sink = stats.Stats()
+    with stats.useSink(sink):
+        listed = extract.listRefs(extract.fileChunks(paths, size=size), output, jobs=jobs)
+    assert output.getvalue() == expected
+    assert listed == len(records(expected))
+    if size == 1:
+        assert sink.counters["chunks.rescanned"] > 0
+
+
+def test_cli_list_refs(tmp_path, no_lookups):
+    """--list-refs lists the references in files, or stdin, without looking anything up."""
+    (tmp_path / "a.md").write_text("#1\n")
+    (tmp_path / "b.md").write_text("foo/bar#2 `#3`\n")
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["--list-refs", "--jobs", "1", "--default-source", "me/mine", str(tmp_path)]
+    )
+    assert result.exit_code == 0
+    assert [(r["file"], r["owner"], r["number"]) for r in records(result.output)] == [
+        (str(tmp_path / "a.md"), "me", 1),
+        (str(tmp_path / "b.md"), "foo", 2),
+    ]
+
+    result = runner.invoke(cli, ["--list-refs", str(tmp_path / "b.md"), "--plain-text"])
+    assert [r["number"] for r in records(result.output)] == [2, 3]
+
+    result = runner.invoke(cli, ["--list-refs", "--stats", "-"], input="Ünïcode #4\n")
+    assert result.output.startswith('{"file": "-", "offset": 10, "kind": "number", "owner": null,')
+    assert "references.listed               1" in result.output
+
+
+@pytest.mark.parametrize(
+    "option", (["-i"], ["--warm", "foo/bar"], ["--build-index", "x"], ["--connect", "x"])
+)
+def test_cli_list_refs_conflicts(option):
+    """--list-refs doesn't expand, or do any of the things that go with expanding."""
+    result = CliRunner().invoke(cli, ["--list-refs", "-"] + option)
+    assert result.exit_code == 1
+    assert result.output.startswith("Error: --list-refs can't be used with")
@@ -0,0 +1,266 @@
+import asyncio
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import aio, client, graphql, stats
+from issue_expander.cache import Issue, IssueCache
+from issue_expander.expander import (
+    RetryQueue,
+    cli,
+    expandRefsToMarkdown,
+    getIssue,
+    resolveRefs,
+    resolveRefsWithGraphQL,
+    retry_queue,
+    useIssueCache,
+)
+from issue_expander.ratelimit import RateLimiter
+
+
+class FakeClock:
+    """A clock that only moves when it's told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_retry_queue_backs_off_and_gives_up():
+    """Each failure waits twice as long as the one before, and after `retries` of them, there are no more."""
+    clock = FakeClock()
+    queue = RetryQueue(retries=2, backoff=1, clock=clock)
+    key = ("foo", "bar", 1)
+
+    queue.add(key)
+    assert queue.take([key, ("foo", "bar", 2)]) == ([key], 1)
+    assert queue.take([key]) == ([], 0)
+    queue.add(key)
+    clock.now += 0.5
+    assert queue.take([key]) == ([key], 1.5)
+    queue.add(key)
+    assert queue.take([key]) == ([], 0)
+
+    queue.forget(key)
+    queue.add(key)
+    assert queue.take([key]) == ([key], 1)
+
+
+def test_lookups_forget_their_failures(github):
+    """Once a key's been looked up, REST, GraphQL or async, its failures don't count against it any more,
+    so in a long-running process, it can fail, and be retried, again."""
+
+    def resolveAsync(keys):
+        async def main():
+            try:
+                return await aio.resolveRefsAsync(keys)
+            finally:
+                await aio.closeConnections()
+
+        return asyncio.run(main())
+
+    for resolve in (resolveRefs, lambda keys: resolveRefsWithGraphQL(keys, "sekrit"), resolveAsync):
+        github.canned = [(503, {})] * 3
+        assert resolve([("foo", "bar", 1)])[("foo", "bar", 1)] is None
+        assert retry_queue._failures
+        getIssue.cache_clear()
+        assert resolve([("foo", "bar", 1)])[("foo", "bar", 1)].title == "One"
+        assert not retry_queue._failures
+
+
+def test_server_errors_are_retried(github, monkeypatch):
+    """When GitHub has trouble, the lookup isn't remembered, and it's tried again after a while."""
+    monkeypatch.setattr(retry_queue, "backoff", 0.01)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    github.canned = [(502, {})]
+    sink = stats.Stats()
+    with stats.useSink(sink):
+        assert resolveRefs([("foo", "bar", 1)])[("foo", "bar", 1)].title == "One"
+    assert len(github.requests) == 2
+    assert sink.counters["lookups.failed"] == 1
+    assert sink.counters["lookups.retried"] == 1
+    assert 0 < sleeps[0] <= 0.01
+
+
+def test_retries_are_bounded(github):
+    """A lookup that keeps failing is only tried LOOKUP_RETRIES more times, and then left alone."""
+    github.canned = [(503, {})] * 5
+    assert expandRefsToMarkdown("#1", None, "foo", "bar") == "#1"
+    assert len(github.requests) == 3
+
+
+def test_network_errors_are_retried(monkeypatch, capsys):
+    """A lookup that can't connect says so, and is queued to try again, not remembered."""
+    monkeypatch.setattr(issue_expander.expander, "API_URL", "http://127.0.0.1:1")
+    monkeypatch.setattr(client, "_shared_client", None)
+    for _ in range(2):
+        assert getIssue("foo", "bar", 1, None) is None
+        assert capsys.readouterr().err.startswith("Unable to look up foo/bar#1: ")
+    assert retry_queue.take([("foo", "bar", 1)])[0] == [("foo", "bar", 1)]
+
+
+def test_malformed_answers_are_retried(github, monkeypatch):
+    """An answer we can't parse is a failure for the time being, too."""
+    real_request = client.request
+    answers = []
+
+    def request(method, url, headers=None, body=None):
+        response = real_request(method, url, headers, body)
+        if not answers:
+            response = response._replace(body=b"{nope")
+        answers.append(response)
+        return response
+
+    monkeypatch.setattr(client, "request", request)
+    assert resolveRefs([("foo", "bar", 2)])[("foo", "bar", 2)].title == "Two"
+    assert len(answers) == 2
+
+
+def test_rate_limited_lookups_are_not_remembered(github):
+    """When the rate limiter gives up, the lookup isn't retried straight away, but isn't remembered either."""
+    limiter = client.sharedClient().rate_limiter = RateLimiter(max_wait=1)
+    limiter.blocked_until = time.time() + 100
+    assert resolveRefs([("foo", "bar", 1)]) == {("foo", "bar", 1): None}
+    assert github.requests == []
+
+    limiter.blocked_until = 0
+    assert getIssue("foo", "bar", 1, None).title == "One"
+
+
+def test_missing_issues_are_remembered(github, tmp_path):
+    """Issues GitHub says don't exist aren't looked up again until missing_ttl has passed."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, clock=clock, missing_ttl=60)
+    sink = stats.Stats()
+    with useIssueCache(cache), stats.useSink(sink):
+        assert getIssue("foo", "bar", 9, None) is None
+        getIssue.cache_clear()
+        assert getIssue("foo", "bar", 9, None) is None
+        assert len(github.requests) == 1
+
+        clock.now += 60
+        getIssue.cache_clear()
+        assert getIssue("foo", "bar", 9, None) is None
+        assert len(github.requests) == 2
+    assert sink.counters["lookups.missing"] == 2
+    assert sink.counters["cache.missing"] == 1
+
+
+def test_gone_issues_are_forgotten(github, tmp_path):
+    """A cached issue that's since been deleted is dropped from the cache and remembered as missing."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, ttl=10, clock=clock)
+    cache.put("foo", "bar", 1, "One", "https://github.com/foo/bar/issues/1")
+    clock.now += 10
+    github.canned = [(410, {})]
+    with useIssueCache(cache):
+        assert getIssue("foo", "bar", 1, None) is None
+        assert cache.get("foo", "bar", 1) is None
+        assert cache.isMissing("foo", "bar", 1)
+
+
+def test_missing_issues_in_the_cache(tmp_path):
+    """Finding an issue forgets that it was missing, and eviction throws away expired missing issues."""
+    clock = FakeClock()
+    cache = IssueCache(tmp_path, clock=clock, missing_ttl=60)
+    cache.putMissing("foo", "bar", 1)
+    cache.putMissing("foo", "bar", 2)
+    cache.putMissing("foo", "bar", 3)
+    cache.put("foo", "bar", 1, "One", "https://github.com/foo/bar/issues/1")
+    cache.putMany("foo", "bar", [(2, "Two", "https://github.com/foo/bar/issues/2")])
+    assert not cache.isMissing("foo", "bar", 1)
+    assert not cache.isMissing("foo", "bar", 2)
+    assert cache.isMissing("foo", "bar", 3)
+
+    clock.now += 30
+    cache.putMissing("foo", "bar", 4)
+    clock.now += 30
+    cache.evict()
+    assert cache._db.execute("SELECT number FROM missing").fetchall() == [("4",)]
+
+
+def test_graphql_remembers_missing_issues(github, tmp_path):
+    """Issues and repositories the GraphQL API says don't exist are remembered, and not asked about again."""
+    cache = IssueCache(tmp_path)
+    keys = [("foo", "bar", 1), ("foo", "bar", 9), ("nope", "nope", 1)]
+    with useIssueCache(cache):
+        assert resolveRefsWithGraphQL(keys, "sekrit")[("foo", "bar", 9)] is None
+        assert resolveRefsWithGraphQL(keys, "sekrit") == {
+            ("foo", "bar", 1): Issue("One", "https://github.com/foo/bar/issues/1"),
+            ("foo", "bar", 9): None,
+            ("nope", "nope", 1): None,
+        }
+        assert cache.isMissing("foo", "bar", 9)
+        assert cache.isMissing("nope", "nope", 1)
+    assert len(github.requests) == 1
+
+
+def test_graphql_retries_failed_batches(github):
+    """A batch that fails for the time being is tried again, but not the issues in it we know don't exist,
+    and one GitHub turned away isn't."""
+    github.canned = [(502, {})]
+    issues = resolveRefsWithGraphQL([("foo", "bar", 2), ("foo", "bar", 2**31)], "sekrit")
+    assert issues[("foo", "bar", 2)].title == "Two"
+    assert issues[("foo", "bar", 2**31)] is None
+    assert len(github.requests) == 2
+
+    github.requests.clear()
+    github.canned = [(401, {})]
+    assert resolveRefsWithGraphQL([("foo", "bar", 2)], "sekrit") == {("foo", "bar", 2): None}
+    assert len(github.requests) == 1
+
+
+@pytest.mark.parametrize(
+    "url,failed",
+    (("http://127.0.0.1:1/graphql", True), (None, False)),
+    ids=["unreachable", "rate-limited"],
+)
+def test_lookUpIssues_failures(github, monkeypatch, capsys, url, failed):
+    """Batches that can't connect are worth trying again soon, and ones the rate limiter gave up on aren't."""
+    if url:
+        monkeypatch.setattr(graphql, "GRAPHQL_URL", url)
+    else:
+        client.sharedClient().rate_limiter = RateLimiter(max_wait=1)
+        client.sharedClient().rate_limiter.blocked_until = time.time() + 100
+    keys = [("foo", "bar", 1)]
+    assert graphql.lookUpIssues(keys, "sekrit") == ({("foo", "bar", 1): None}, set(), failed)
+    assert capsys.readouterr().err.startswith("Unable to look up issues")
+
+
+def test_async_lookups_retry_and_remember_missing_issues(github, tmp_path):
+    """The coroutines retry lookups that failed for the time being, and skip issues known to be missing."""
+    cache = IssueCache(tmp_path)
+    cache.putMissing("foo", "bar", 9)
+    github.canned = [(500, {})]
+
+    async def main():
+        try:
+            return await aio.resolveRefsAsync([("foo", "bar", 1), ("foo", "bar", 9)])
+        finally:
+            await aio.closeConnections()
+
+    with useIssueCache(cache):
+        issues = asyncio.run(main())
+    assert issues[("foo", "bar", 1)].title == "One"
+    assert issues[("foo", "bar", 9)] is None
+    assert [request[1] for request in github.requests] == ["/repos/foo/bar/issues/1"] * 2
+
+
+def test_cli_missing_ttl(github, tmp_path):
+    """--missing-ttl says how long to remember missing issues, and 0 doesn't remember them at all."""
+    runner = CliRunner()
+    args = ["--cache-dir", str(tmp_path), "--default-source", "foo/bar", "-"]
+    for _ in range(2):
+        getIssue.cache_clear()
+        assert runner.invoke(cli, args, input="#9").output == "#9"
+    assert len(github.requests) == 1
+
+    for _ in range(2):
+        getIssue.cache_clear()
+        assert runner.invoke(cli, ["--missing-ttl", "0"] + args, input="#9").output == "#9"
+    assert len(github.requests) == 3
@@ -0,0 +1,192 @@
+import os
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import files
+from issue_expander.cache import Issue
+from issue_expander.expander import cli, expandFiles
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Stand in for getIssue, with issue 404 missing, recording each lookup."""
+    calls = []
+
+    def mockIssue(owner, repository, number, token):
+        calls.append((owner, repository, number))
+        if number == "404":
+            return None
+        return Issue(f"Issue {number}", f"https://example.com/{owner}/{repository}/{number}")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    return calls
+
+
+@pytest.fixture
+def docs(tmp_path):
+    """A small docs tree."""
+    (tmp_path / "guide").mkdir()
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "index.md").write_text("Fixes foo/bar#1.\n")
+    (tmp_path / "guide" / "a.md").write_text("See foo/bar#1 and foo/bar#2.\r\n")
+    (tmp_path / "guide" / "b.markdown").write_text("Nothing to see here.\n")
+    (tmp_path / "guide" / "c.md").write_text("Missing: foo/bar#404\n")
+    (tmp_path / "guide" / "notes.txt").write_text("foo/bar#3\n")
+    (tmp_path / ".git" / "d.md").write_text("foo/bar#4\n")
+    return tmp_path
+
+
+def test_find_files(docs, monkeypatch):
+    """Directories are searched for Markdown files, patterns are globbed, and nothing is repeated."""
+    monkeypatch.chdir(docs)
+    assert files.findFiles(["."]) == [
+        "index.md",
+        os.path.join("guide", "a.md"),
+        os.path.join("guide", "b.markdown"),
+        os.path.join("guide", "c.md"),
+    ]
+    assert files.findFiles(["guide/notes.txt", "**/*.md", "index.md"]) == [
+        os.path.join("guide", "notes.txt"),
+        os.path.join("guide", "a.md"),
+        os.path.join("guide", "c.md"),
+        "index.md",
+    ]
+    assert files.findFiles(["g*"]) == files.findFiles(["guide"])
+
+
+@pytest.mark.parametrize("pattern", ["missing.md", "missing/*.md"])
+def test_find_files_that_are_not_there(docs, pattern):
+    """Missing files, and patterns matching nothing, are errors."""
+    with pytest.raises(FileNotFoundError, match="missing"):
+        files.findFiles([str(docs / "index.md"), str(docs / pattern)])
+
+
+def test_write_atomically(tmp_path):
+    """Files are replaced whole, keeping their permissions, and through symlinks."""
+    path = tmp_path / "a.md"
+    path.write_text("old")
+    path.chmod(0o640)
+    link = tmp_path / "link.md"
+    link.symlink_to(path)
+
+    files.writeAtomically(str(link), "new\r\n")
+    assert path.read_bytes() == b"new\r\n"
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert link.is_symlink()
+    assert sorted(os.listdir(tmp_path)) == ["a.md", "link.md"]
+
+
+def test_new_files_get_the_usual_permissions(tmp_path):
+    """Files that didn't exist before aren't left readable only by us."""
+    umask = os.umask(0o022)
+    try:
+        files.writeAtomically(str(tmp_path / "new.md"), "new")
+    finally:
+        os.umask(umask)
+    assert (tmp_path / "new.md").stat().st_mode & 0o777 == 0o644
+
+
+def test_failed_writes_leave_the_file_alone(tmp_path, monkeypatch):
+    """If the rename fails, the original is untouched, and the temporary file is cleaned up."""
+    path = tmp_path / "a.md"
+    path.write_text("old")
+
+    def fail(source, destination):
+        raise OSError("nope")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        files.writeAtomically(str(path), "new")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["a.md"]
+
+
+def test_expand_files_in_place(docs, lookups):
+    """Each reference is looked up once across all the files, and only files that change are rewritten."""
+    paths = files.findFiles([str(docs)])
+    os.utime(docs / "guide" / "b.markdown", ns=(0, 0))
+    os.utime(docs / "guide" / "c.md", ns=(0, 0))
+
+    assert expandFiles(paths, in_place=True, window=0) == 2
+    assert sorted(lookups) == [("foo", "bar", "1"), ("foo", "bar", "2"), ("foo", "bar", "404")]
+    assert (docs / "index.md").read_text() == "Fixes [Issue 1 #1](https://example.com/foo/bar/1).\n"
+    assert (docs / "guide" / "a.md").read_bytes() == (
+        b"See [Issue 1 #1](https://example.com/foo/bar/1) and [Issue 2 #2](https://example.com/foo/bar/2).\r\n"
+    )
+    for name in ("b.markdown", "c.md"):
+        assert os.stat(docs / "guide" / name).st_mtime_ns == 0
+
+
+def test_expand_files_to_output(docs, lookups, capsys):
+    """Without in_place, the files are expanded one after another to output, and unreadable ones skipped."""
+    (docs / "bad.md").write_bytes(b"\xff foo/bar#9\n")
+    paths = [str(docs / "index.md"), str(docs / "bad.md"), str(docs / "guide" / "b.markdown")]
+
+    class Output(list):
+        write = list.append
+
+    output = Output()
+    assert expandFiles(paths, output) == 0
+    assert output == ["Fixes [Issue 1 #1](https://example.com/foo/bar/1).\n", "Nothing to see here.\n"]
+    assert "Unable to read" in capsys.readouterr().err
+
+
+def test_cli_many_files(docs, lookups, monkeypatch):
+    """The CLI takes several files, directories and patterns, and prints them expanded."""
+    monkeypatch.chdir(docs)
+    result = CliRunner().invoke(cli, ["--no-cache", "index.md", "guide/*.markdown"])
+    assert result.exit_code == 0
+    assert result.output == "Fixes [Issue 1 #1](https://example.com/foo/bar/1).\nNothing to see here.\n"
+
+
+def test_cli_in_place(docs, lookups):
+    """--in-place rewrites the files, and prints nothing."""
+    result = CliRunner().invoke(cli, ["--no-cache", "--in-place", str(docs / "index.md")])
+    assert result.exit_code == 0
+    assert result.output == ""
+    assert (docs / "index.md").read_text() == "Fixes [Issue 1 #1](https://example.com/foo/bar/1).\n"
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+def test_cli_pipe(tmp_path, lookups):
+    """A named pipe, like from <(cmd), can only be read once, so it's streamed like stdin."""
+    fifo = tmp_path / "notes.md"
+    os.mkfifo(fifo)
+
+    done = threading.Event()
+
+    def feed():
+        with open(fifo, "w") as f:
+            f.write("Fixes foo/bar#1.\n")
+        # Anyone opening it again gets nothing, like they would from <(cmd), rather than waiting forever.
+        while not done.wait(0.01):
+            try:
+                os.close(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    result = CliRunner().invoke(cli, ["--no-cache", str(fifo)])
+    done.set()
+    writer.join()
+    assert result.exit_code == 0
+    assert result.output == "Fixes [Issue 1 #1](https://example.com/foo/bar/1).\n"
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (["--in-place", "-"], "Error: - (stdin) can't be expanded with other files or in place"),
+        (["missing.md"], "Error: No such file or directory: missing.md"),
+    ],
+)
+def test_cli_bad_files(docs, lookups, monkeypatch, args, message):
+    """Stdin can't be expanded in place, and missing files are errors."""
+    monkeypatch.chdir(docs)
+    result = CliRunner().invoke(cli, ["--no-cache"] + args)
+    assert result.exit_code == 1
+    assert result.output == message + "\n"
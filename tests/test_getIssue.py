@@ -1,19 +1,26 @@
-import io
 import json
+from email.message import Message
 from unittest.mock import patch
-from urllib.error import HTTPError
 
-import issue_expander
-from issue_expander.expander import getIssue
+from issue_expander.cache import Issue
+from issue_expander.client import Response
+from issue_expander.expander import getIssue, rememberAnswers
+
+
+def response(status, body=b""):
+    """Make a Response like the HTTP client returns."""
+    return Response(
+        status, Message(), body, "https://api.github.com/repos/adamwolf/issue-expander/issues/1"
+    )
 
 
 def test_getIssue_with_404(monkeypatch):
     """getIssue should return None if the issue is not found"""
 
-    def mock_urlopen(request, context=None):
-        raise HTTPError("http://example.com", 404, "Not Found", {}, io.BytesIO(b""))
+    def mock_request(method, url, headers=None, body=None):
+        return response(404)
 
-    monkeypatch.setattr(issue_expander.expander, "urlopen", mock_urlopen)
+    monkeypatch.setattr("issue_expander.client.request", mock_request)
     assert getIssue("adamwolf", "issue-expander", "1", None) is None
 
 
@@ -21,15 +28,12 @@ def test_getIssue_puts_token_in_headers():
     """getIssue should put the token in the headers as Authorization"""
 
     with patch(
-        "issue_expander.expander.urlopen",
-        return_value=io.BytesIO(json.dumps({"html_url": "foo", "title": "bar"}).encode("utf-8")),
-    ) as mock_urlopen:
-        assert getIssue("adamwolf", "issue-expander", "1", "frobnitz") == {
-            "html_url": "foo",
-            "title": "bar",
-        }
-        mock_urlopen.assert_called_once
-        request_headers = mock_urlopen.call_args[0][0].headers
+        "issue_expander.client.request",
+        return_value=response(200, json.dumps({"html_url": "foo", "title": "bar"}).encode("utf-8")),
+    ) as mock_request:
+        assert getIssue("adamwolf", "issue-expander", "1", "frobnitz") == Issue("bar", "foo")
+        mock_request.assert_called_once
+        request_headers = mock_request.call_args[0][2]
         assert request_headers["Authorization"] == "Bearer: frobnitz"
 
 
@@ -38,10 +42,10 @@ def test_getIssue_with_403_without_token(monkeypatch, capsys):
 
     If we didn't pass a token it, it should tell us to try again with a token."""
 
-    def mock_urlopen(request, context=None):
-        raise HTTPError("http://example.com", 403, "Rate limit exceeded.", {}, io.BytesIO(b""))
+    def mock_request(method, url, headers=None, body=None):
+        return response(403)
 
-    monkeypatch.setattr(issue_expander.expander, "urlopen", mock_urlopen)
+    monkeypatch.setattr("issue_expander.client.request", mock_request)
     assert getIssue("adamwolf", "issue-expander", "1", None) is None
     captured = capsys.readouterr()
     assert (
@@ -55,10 +59,10 @@ def test_getIssue_with_403_with_token(monkeypatch, capsys):
 
     If we passed a token in, it shouldn't tell us to try again with a token."""
 
-    def mock_urlopen(request, context=None):
-        raise HTTPError("http://example.com", 403, "Rate limit exceeded.", {}, io.BytesIO(b"foo   "))
+    def mock_request(method, url, headers=None, body=None):
+        return response(403, b"foo   ")
 
-    monkeypatch.setattr(issue_expander.expander, "urlopen", mock_urlopen)
+    monkeypatch.setattr("issue_expander.client.request", mock_request)
     assert getIssue("adamwolf", "issue-expander", "1", "imatoken") is None
     captured = capsys.readouterr()
     assert captured.err == "Unable to look up issue due to rate limit error.\n"
@@ -67,10 +71,10 @@ def test_getIssue_with_403_with_token(monkeypatch, capsys):
 def test_getIssue_with_malformed_json(monkeypatch, capsys):
     """getIssue should return None and print an error if the JSON is malformed"""
 
-    def mock_urlopen(request, context=None):
-        raise json.JSONDecodeError("msg", "doc", 0)
+    def mock_request(method, url, headers=None, body=None):
+        return response(200, b"{not json")
 
-    monkeypatch.setattr(issue_expander.expander, "urlopen", mock_urlopen)
+    monkeypatch.setattr("issue_expander.client.request", mock_request)
     assert getIssue("adamwolf", "issue-expander", "1", None) is None
 
     captured = capsys.readouterr()
@@ -85,11 +89,37 @@ def test_getIssue_happy_path():
     """getIssue should return the issue if it's found"""
 
     with patch(
-        "issue_expander.expander.urlopen",
-        return_value=io.BytesIO(json.dumps({"html_url": "foo", "title": "bar"}).encode("utf-8")),
-    ) as mock_urlopen:
-        assert getIssue("adamwolf", "issue-expander", "1", None) == {
-            "html_url": "foo",
-            "title": "bar",
-        }
-        mock_urlopen.assert_called_once
+        "issue_expander.client.request",
+        return_value=response(200, json.dumps({"html_url": "foo", "title": "bar"}).encode("utf-8")),
+    ) as mock_request:
+        assert getIssue("adamwolf", "issue-expander", "1", None) == Issue("bar", "foo")
+        mock_request.assert_called_once
+
+
+def test_getIssue_keeps_only_what_it_needs():
+    """getIssue should keep the title and URL of an issue, and none of the rest, like its body"""
+    issue = {"html_url": "foo", "title": "bar", "body": "x" * 100000, "user": {"login": "adamwolf"}}
+    with patch(
+        "issue_expander.client.request", return_value=response(200, json.dumps(issue).encode("utf-8"))
+    ):
+        found = getIssue("adamwolf", "issue-expander", "1", None)
+    assert found == Issue("bar", "foo")
+    assert (found.title, found.html_url) == ("bar", "foo")
+
+
+def test_remembered_answers_are_bounded():
+    """Like lru_cache, only the most recently used answers are remembered."""
+    calls = []
+
+    @rememberAnswers
+    def lookUp(owner, repository, number, token):
+        calls.append(number)
+        return number
+
+    for number in range(130):
+        lookUp("foo", "bar", number, None)
+    lookUp("foo", "bar", 2, None)
+    lookUp("foo", "bar", 0, None)
+    assert calls == list(range(130)) + [0]
+    assert lookUp.recall(("foo", "bar", 2, None)) == (True, 2)
+    assert lookUp.recall(("foo", "bar", 3, None)) == (False, None)
@@ -0,0 +1,158 @@
+import json
+from email.message import Message
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import graphql
+from issue_expander.cache import Issue, IssueCache
+from issue_expander.client import Response
+from issue_expander.expander import cli, expandRefsToMarkdown, useIssueCache
+
+
+@pytest.fixture
+def github(github):
+    """The fake GitHub, with a title that needs quoting."""
+    github.addIssue("baz", "qux", 3, 'Three "quoted"')
+    return github
+
+
+def test_batches_are_bounded_and_grouped_by_repository():
+    """Keys are split into batches of at most MAX_BATCH_SIZE, keeping repositories together."""
+    keys = [("foo", "bar", str(n)) for n in range(150)] + [("a", "b", "1")]
+    batches = graphql.batched(keys)
+    assert [len(batch) for batch in batches] == [100, 51]
+    assert sorted(sum(batches, [])) == sorted(keys)
+    assert batches[0][0] == ("a", "b", "1")
+
+
+def test_query_aliases_every_issue():
+    """Each repository and each issue in it gets its own alias."""
+    query, aliases = graphql.buildQuery([("foo", "bar", "1"), ("foo", "bar", "2"), ("baz", "qux", "3")])
+    assert query.count("repository(") == 2
+    assert query.count("issueOrPullRequest(") == 3
+    assert aliases == {
+        ("r0", "i0"): ("foo", "bar", "1"),
+        ("r0", "i1"): ("foo", "bar", "2"),
+        ("r1", "i0"): ("baz", "qux", "3"),
+    }
+
+
+def test_getIssues_finds_issues_in_one_request(github):
+    """A whole batch is looked up with a single query, and missing issues come back as None."""
+    keys = [("foo", "bar", "1"), ("foo", "bar", "2"), ("foo", "bar", "9"), ("nope", "nope", "1")]
+    issues = graphql.getIssues(keys, "sekrit")
+    assert issues == {
+        ("foo", "bar", "1"): Issue("One", "https://github.com/foo/bar/issues/1"),
+        ("foo", "bar", "2"): Issue("Two", "https://github.com/foo/bar/issues/2"),
+        ("foo", "bar", "9"): None,
+        ("nope", "nope", "1"): None,
+    }
+    assert len(github.requests) == 1
+    assert github.requests[0][2]["Authorization"] == "Bearer: sekrit"
+
+
+def test_expansion_with_graphql(github):
+    """Expanding with GraphQL gives the same output as expanding issue by issue."""
+    expansion = expandRefsToMarkdown("#1, GH-2, #9 and baz/qux#3", "sekrit", "foo", "bar", use_graphql=True)
+    assert expansion == (
+        "[One #1](https://github.com/foo/bar/issues/1), [Two #2](https://github.com/foo/bar/issues/2), "
+        '#9 and [Three "quoted" #3](https://github.com/baz/qux/issues/3)'
+    )
+    assert len(github.requests) == 1
+
+
+def test_expansion_with_graphql_splits_big_documents(github, monkeypatch):
+    """Documents with more references than fit in one query take several queries."""
+    monkeypatch.setattr(graphql, "MAX_BATCH_SIZE", 2)
+    expansion = expandRefsToMarkdown("#1 #2 baz/qux#3", "sekrit", "foo", "bar", use_graphql=True)
+    assert expansion.count("](https://github.com/") == 3
+    assert len(github.requests) == 2
+
+
+def test_graphql_uses_and_fills_the_issue_cache(github, tmp_path):
+    """Fresh cached issues aren't queried, and what we find is cached."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Cached one", "https://example.com/1")
+    with useIssueCache(cache):
+        expansion = expandRefsToMarkdown("#1 #2 #9", "sekrit", "foo", "bar", use_graphql=True)
+        assert expansion == (
+            "[Cached one #1](https://example.com/1) [Two #2](https://github.com/foo/bar/issues/2) #9"
+        )
+        assert cache.get("foo", "bar", "2").title == "Two"
+        assert cache.get("foo", "bar", "9") is None
+
+        github.requests.clear()
+        expandRefsToMarkdown("#1 #2", "sekrit", "foo", "bar", use_graphql=True)
+        assert github.requests == []
+
+
+def test_numbers_too_big_for_graphql_are_missing(github):
+    """An issue number too big for GraphQL's Int is missing, without it failing the query for the rest."""
+    too_big = ("foo", "bar", str(2**31))
+    issues, missing, failed = graphql.lookUpIssues([("foo", "bar", "1"), too_big], "sekrit")
+    assert issues == {
+        ("foo", "bar", "1"): Issue("One", "https://github.com/foo/bar/issues/1"),
+        too_big: None,
+    }
+    assert (missing, failed) == ({too_big}, False)
+    assert str(2**31).encode() not in github.requests[0][3]
+
+    github.requests.clear()
+    assert graphql.lookUpIssues([too_big], "sekrit") == ({too_big: None}, {too_big}, False)
+    assert github.requests == []
+
+
+@pytest.mark.parametrize(
+    "code,message",
+    (
+        (403, "Unable to look up issues due to rate limit error.\n"),
+        (401, "Unable to look up issues with GraphQL. Check your token.\n"),
+        (502, ""),
+    ),
+)
+def test_getIssues_http_errors(code, message, capsys):
+    """When the query fails, nothing is found, and we say why if we know."""
+
+    def mock_request(method, url, headers=None, body=None):
+        return Response(code, Message(), b"", url)
+
+    with patch("issue_expander.client.request", side_effect=mock_request):
+        assert graphql.getIssues([("foo", "bar", "1")], "sekrit") == {("foo", "bar", "1"): None}
+    assert capsys.readouterr().err == message
+
+
+def test_getIssues_malformed_json(capsys):
+    """Unparseable responses find nothing."""
+    with patch("issue_expander.client.request", return_value=Response(200, Message(), b"{nope", "")):
+        assert graphql.getIssues([("foo", "bar", "1")], None) == {("foo", "bar", "1"): None}
+    assert capsys.readouterr().err == "Unable to parse response from https://api.github.com/graphql\n"
+
+
+def test_getIssues_query_errors():
+    """A response with errors and no data finds nothing."""
+    body = json.dumps({"data": None, "errors": [{"message": "Bad"}]}).encode("utf-8")
+    with patch("issue_expander.client.request", return_value=Response(200, Message(), body, "")):
+        assert graphql.getIssues([("foo", "bar", "1")], "sekrit") == {("foo", "bar", "1"): None}
+
+
+def test_cli_graphql(github, monkeypatch):
+    """--graphql expands through the GraphQL API."""
+
+    def mockIssue(owner, repository, number, token):
+        raise ValueError("Unexpected REST lookup")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    result = CliRunner().invoke(cli, ["--graphql", "-p", "sekrit", "-"], input="foo/bar#1\n")
+    assert result.output == "[One #1](https://github.com/foo/bar/issues/1)\n"
+    assert result.exit_code == 0
+
+
+def test_cli_graphql_needs_a_token():
+    """GitHub's GraphQL API doesn't allow anonymous access, so --graphql without a token is an error."""
+    result = CliRunner().invoke(cli, ["--graphql", "-"], input="foo/bar#1\n")
+    assert result.exit_code == 1
+    assert "Error: --graphql needs a GitHub token\n" in result.output
@@ -0,0 +1,232 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import incremental
+from issue_expander.cache import Issue
+from issue_expander.expander import cli
+
+CHANGELOG = """# Changes
+
+Fixed #1 and foo/bar#2.
+
+```
+#3
+
+#4
+```
+
+#404 is still missing.
+"""
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Expand references to any issue but #404, recording each lookup, and trust modification times at once."""
+    calls = []
+
+    def mockIssue(owner, repository, number, token):
+        calls.append(int(number))
+        if number == "404":
+            return None
+        return Issue(
+            f"Fix [the] thing {number}", f"https://github.com/{owner}/{repository}/issues/{number}"
+        )
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    monkeypatch.setattr(incremental, "RACY_NS", -1)
+    return calls
+
+
+def run(tmp_path, *args, stats=False):
+    options = [
+        "--no-cache",
+        "--default-source",
+        "foo/bar",
+        "--incremental",
+        str(tmp_path / "manifest.json"),
+    ]
+    if stats:
+        options.append("--stats")
+    return CliRunner().invoke(cli, options + list(args))
+
+
+def test_paragraphs():
+    """Paragraphs end just after blank lines, and together, they're the whole text."""
+    assert list(incremental.paragraphs(CHANGELOG))[:3] == [
+        "# Changes\n\n",
+        "Fixed #1 and foo/bar#2.\n\n",
+        "```\n#3\n\n",
+    ]
+    assert "".join(incremental.paragraphs(CHANGELOG)) == CHANGELOG
+    assert list(incremental.paragraphs("\n")) == ["\n"]
+
+
+def test_outsideExpandedLinks():
+    """Links like the ones we make are left out, even with brackets in their titles, but other links aren't."""
+    text = (
+        "[Fix [it] #1](https://github.com/foo/bar/issues/1) #2 [#3](https://example.com/3) "
+        "[A #4](https://github.com/a/b/pull/4)"
+    )
+    regions = incremental.outsideExpandedLinks(text)
+    assert [text[start:end] for start, end in regions] == [" #2 [#3](https://example.com/3) "]
+
+
+def test_in_place_only_changes_are_expanded(tmp_path, lookups):
+    """The second time, only the paragraph with a reference to a missing issue is scanned and looked up,
+    and when the file's changed, only the paragraphs that have changed."""
+    path = tmp_path / "CHANGELOG.md"
+    path.write_text(CHANGELOG)
+    assert run(tmp_path, "-i", str(path)).exit_code == 0
+    assert sorted(lookups) == [1, 2, 404]
+    expanded = path.read_text()
+    assert expanded.startswith(
+        "# Changes\n\nFixed [Fix [the] thing 1 #1](https://github.com/foo/bar/issues/1) and"
+    )
+    assert "```\n#3\n\n#4\n```" in expanded
+
+    lookups.clear()
+    result = run(tmp_path, "-i", str(path), stats=True)
+    assert lookups == [404]
+    assert path.read_text() == expanded
+    assert "paragraphs.skipped              4" in result.output
+
+    lookups.clear()
+    path.write_text(expanded.replace("#404 is still missing.", "#5 is new."))
+    run(tmp_path, "-i", str(path))
+    assert lookups == [5]
+
+    lookups.clear()
+    result = run(tmp_path, "-i", str(path), stats=True)
+    assert lookups == []
+    assert "files.unchanged                 1" in result.output
+
+
+def test_touched_files_are_checked_by_hash(tmp_path, lookups):
+    """A file with nothing to expand that's only been touched is read, but not scanned, and remembered as it is."""
+    path = tmp_path / "notes.md"
+    path.write_text("Nothing to see.\n")
+    run(tmp_path, "-i", str(path))
+    os.utime(path, ns=(1, 1))
+    assert "files.unchanged                 1" in run(tmp_path, "-i", str(path), stats=True).output
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["files"]["notes.md"]["mtime_ns"] == 1
+
+    path.write_text("Now with #6.\n")
+    os.utime(path, ns=(1, 1))
+    run(tmp_path, "-i", str(path))
+    assert lookups == [6]
+
+
+def test_printing_remembers_only_what_had_nothing_to_expand(tmp_path, lookups):
+    """Without -i, files aren't rewritten, so only the paragraphs that had nothing to expand are remembered,
+    and files that haven't changed are printed as they are."""
+    (tmp_path / "a.md").write_text("#1\n\nNothing.\n")
+    (tmp_path / "b.md").write_text("Nothing at all.\n")
+    paths = [str(tmp_path / "a.md"), str(tmp_path / "b.md")]
+    first = run(tmp_path, *paths)
+    lookups.clear()
+    second = run(tmp_path, *paths, stats=True)
+    assert second.output.startswith(first.output)
+    assert lookups == [1]
+    assert "paragraphs.skipped              1" in second.output
+    assert "files.unchanged                 1" in second.output
+
+
+def test_plain_text_leaves_expanded_links_alone(tmp_path, lookups):
+    """With --plain-text, links we made are left alone, instead of being expanded again, inside themselves."""
+    path = tmp_path / "CHANGELOG.md"
+    path.write_text(CHANGELOG)
+    run(tmp_path, "--plain-text", "-i", str(path))
+    assert "```\n[Fix [the] thing 3 #3](https://github.com/foo/bar/issues/3)\n" in path.read_text()
+    expanded = path.read_text()
+    (tmp_path / "manifest.json").unlink()
+    lookups.clear()
+    run(tmp_path, "--plain-text", "-i", str(path))
+    assert lookups == [404]
+    assert path.read_text() == expanded
+
+
+def test_changed_options_forget_everything(tmp_path, lookups):
+    """What's remembered with one default source doesn't count with another."""
+    path = tmp_path / "a.md"
+    path.write_text("#1\n")
+    run(tmp_path, str(path))
+    lookups.clear()
+    CliRunner().invoke(
+        cli,
+        [
+            "--no-cache",
+            "--default-source",
+            "a/b",
+            "--incremental",
+            str(tmp_path / "manifest.json"),
+            str(path),
+        ],
+    )
+    assert lookups == [1]
+
+
+@pytest.mark.parametrize(
+    "manifest",
+    (
+        "{nope",
+        '{"version": 1, "options": {"default_source": "foo/bar", "markdown": true}, "files": [1]}',
+        "[]",
+    ),
+)
+def test_unreadable_manifests_start_afresh(tmp_path, lookups, manifest):
+    """A manifest that can't be read is reported, and replaced."""
+    (tmp_path / "manifest.json").write_text(manifest)
+    (tmp_path / "a.md").write_text("#1\n")
+    result = run(tmp_path, str(tmp_path / "a.md"))
+    assert f"Unable to read manifest {tmp_path / 'manifest.json'}, so starting afresh: " in result.output
+    assert lookups == [1]
+    assert "a.md" in json.loads((tmp_path / "manifest.json").read_text())["files"]
+
+
+def test_unwritable_manifest(tmp_path, lookups):
+    """If the manifest can't be written, we say so, but everything's still expanded."""
+    (tmp_path / "a.md").write_text("#1\n")
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--no-cache",
+            "--incremental",
+            str(tmp_path / "nowhere" / "manifest.json"),
+            str(tmp_path / "a.md"),
+        ],
+    )
+    assert result.exit_code == 0
+    assert result.output.startswith(
+        f"#1\nUnable to write manifest {tmp_path / 'nowhere' / 'manifest.json'}: "
+    )
+
+
+def test_missing_files(tmp_path):
+    """A file that's gone since the last time hasn't stayed the same."""
+    path = tmp_path / "a.md"
+    path.write_text("Nothing.\n")
+    manifest = incremental.Manifest(str(tmp_path / "manifest.json"), {})
+    manifest.record(str(path), {}, "Nothing.\n")
+    assert manifest.unchanged(str(path))
+    path.unlink()
+    assert not manifest.unchanged(str(path))
+
+
+@pytest.mark.parametrize(
+    "args,error",
+    (
+        (["-"], "--incremental needs files to expand, not - (stdin)"),
+        (["--connect", "x.sock", "a.md"], "--connect can't be used with"),
+        (["--list-refs", "a.md"], "--list-refs can't be used with"),
+    ),
+)
+def test_incremental_conflicts(args, error):
+    """--incremental only works with files, and doesn't make sense with --connect or --list-refs."""
+    result = CliRunner().invoke(cli, ["--incremental", "manifest.json"] + args)
+    assert result.exit_code == 1
+    assert result.output.startswith(f"Error: {error}")
@@ -0,0 +1,201 @@
+import asyncio
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import aio, client, stats
+from issue_expander.cache import Issue, IssueCache
+from issue_expander.expander import cli, useIssueCache, useIssueIndex
+from issue_expander.index import IssueIndex, readJSONL, writeIndex
+
+ISSUES = [
+    ("foo", "bar", 2, "Two", "https://github.com/foo/bar/issues/2"),
+    ("foo", "bar", 10, "Ten", "https://github.com/foo/bar/pull/10"),
+    ("foo", "bar", 1, "Üñíçødé", "https://github.com/foo/bar/issues/1"),
+    ("foo", "bar-baz", 1, "Moved", "https://github.com/elsewhere/else/issues/7"),
+    ("fo", "bar", 3, "Shorter owner", "https://github.com/fo/bar/issues/3"),
+    ("foo", "bar", 2, "Two, again", "https://github.com/foo/bar/issues/2"),
+]
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = tmp_path / "issues.idx"
+    assert writeIndex(path, ISSUES) == 5
+    return path
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    """Fail any test that tries to go to GitHub."""
+
+    def request(*args, **kwargs):
+        raise AssertionError("went to GitHub")
+
+    monkeypatch.setattr(client, "request", request)
+    monkeypatch.setattr(aio.AsyncHTTPClient, "request", request)
+
+
+def test_index_lookups(index_path):
+    """Issues are found by (owner, repository, number), and anything else isn't."""
+    index = IssueIndex(index_path)
+    assert len(index) == 5
+    assert index.get("foo", "bar", "1") == Issue("Üñíçødé", "https://github.com/foo/bar/issues/1")
+    assert index.get("foo", "bar", 2) == Issue("Two, again", "https://github.com/foo/bar/issues/2")
+    assert index.get("foo", "bar", "10") == Issue("Ten", "https://github.com/foo/bar/pull/10")
+    assert index.get("foo", "bar-baz", "1").html_url == "https://github.com/elsewhere/else/issues/7"
+    assert index.get("fo", "bar", "3").title == "Shorter owner"
+    for key in [("a", "b", "1"), ("foo", "bar", "3"), ("zzz", "z", "1"), ("foo", "bar", "9" * 30)]:
+        assert index.get(*key) is None
+    index.close()
+
+
+def test_index_is_compact(tmp_path):
+    """Usual URLs aren't stored, so an issue takes little more than its title."""
+    path = tmp_path / "issues.idx"
+    writeIndex(
+        path,
+        (
+            ("owner", "repository", n, "Title", f"https://github.com/owner/repository/issues/{n}")
+            for n in range(1000)
+        ),
+    )
+    assert path.stat().st_size < 1000 * 50
+    assert IssueIndex(path).get("owner", "repository", "999").title == "Title"
+
+
+def test_failed_index_writes(tmp_path):
+    """If an index can't be written, nothing is left behind."""
+    (tmp_path / "issues.idx").mkdir()
+    with pytest.raises(OSError):
+        writeIndex(tmp_path / "issues.idx", ISSUES)
+    assert [path.name for path in tmp_path.iterdir()] == ["issues.idx"]
+
+
+def test_empty_index(tmp_path):
+    """An index can be empty."""
+    writeIndex(tmp_path / "issues.idx", [])
+    assert IssueIndex(tmp_path / "issues.idx").get("foo", "bar", "1") is None
+
+
+@pytest.mark.parametrize("contents", [b"", b"not an index at all"])
+def test_not_an_index(tmp_path, contents):
+    """Other files are refused."""
+    (tmp_path / "other").write_bytes(contents)
+    with pytest.raises(ValueError, match="isn't an issue index"):
+        IssueIndex(tmp_path / "other")
+
+
+def test_read_jsonl(tmp_path):
+    """Dumps of GitHub's issue objects are read, taking the issue from the URL unless it's given."""
+    path = tmp_path / "dump.jsonl"
+    path.write_text(
+        json.dumps({"html_url": "https://github.com/foo/bar/pull/5", "title": "Five", "number": 5})
+        + "\n\n"
+        + json.dumps(
+            {"owner": "a", "repository": "b", "number": 1, "title": "One", "html_url": "https://x/1"}
+        )
+        + "\n"
+    )
+    assert list(readJSONL(path)) == [
+        ("foo", "bar", 5, "Five", "https://github.com/foo/bar/pull/5"),
+        ("a", "b", 1, "One", "https://x/1"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "line", ["nope", "[]", '{"title": "No URL"}', '{"title": "T", "html_url": "https://x/1"}']
+)
+def test_read_bad_jsonl(tmp_path, line):
+    """Lines that aren't issues are errors."""
+    path = tmp_path / "dump.jsonl"
+    path.write_text('{"title": "T", "html_url": "https://github.com/a/b/issues/1"}\n' + line + "\n")
+    with pytest.raises(ValueError, match="line 2"):
+        list(readJSONL(path))
+
+
+def test_offline_lookups(index_path, tmp_path, no_network):
+    """Offline, the index and the cache are used, stale or not, and anything else is left alone."""
+    cache = IssueCache(tmp_path / "cache", ttl=0)
+    cache.put("baz", "qux", "1", "Stale", "https://github.com/baz/qux/issues/1")
+    run_stats = stats.Stats()
+    index = IssueIndex(index_path)
+    offline = issue_expander.expander.useOffline()
+    with useIssueCache(cache), useIssueIndex(index), offline, stats.useSink(run_stats):
+        text = "foo/bar#10 baz/qux#1 baz/qux#2"
+        assert issue_expander.expander.expandRefsToMarkdown(text, None) == (
+            "[Ten #10](https://github.com/foo/bar/pull/10) [Stale #1](https://github.com/baz/qux/issues/1) "
+            "baz/qux#2"
+        )
+        issues = issue_expander.expander.resolveRefs(
+            [("foo", "bar", "1"), ("baz", "qux", "2")], "t", 1, True
+        )
+        assert issues == {
+            ("foo", "bar", "1"): Issue("Üñíçødé", "https://github.com/foo/bar/issues/1"),
+            ("baz", "qux", "2"): None,
+        }
+        assert asyncio.run(aio.expandRefsToMarkdownAsync("foo/bar#2 foo/bar#3", None)) == (
+            "[Two, again #2](https://github.com/foo/bar/issues/2) foo/bar#3"
+        )
+    assert run_stats.counters["index.hits"] == 3
+    assert run_stats.counters["index.misses"] == 4
+    assert issue_expander.expander.issue_index is None
+    assert not issue_expander.expander.offline
+
+
+def test_cli_build_and_use_an_index(tmp_path, no_network):
+    """An index can be built from the cache and from dumps, and then expanded from, offline."""
+    cache = IssueCache(tmp_path / "cache")
+    cache.put("foo", "bar", "1", "Cached", "https://github.com/foo/bar/issues/1")
+    cache.close()
+    dump = tmp_path / "dump.jsonl"
+    dump.write_text(json.dumps({"html_url": "https://github.com/baz/qux/pull/2", "title": "Dumped"}) + "\n")
+    index_path = tmp_path / "issues.idx"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "--build-index",
+            str(index_path),
+            "--from-jsonl",
+            str(dump),
+        ],
+    )
+    assert result.exit_code == 0
+    assert result.output == f"Wrote 2 issues to {index_path}.\n"
+
+    result = CliRunner().invoke(
+        cli,
+        ["--no-cache", "--offline", "--index", str(index_path), "-"],
+        input="foo/bar#1 baz/qux#2 baz/qux#3\n",
+    )
+    assert result.exit_code == 0
+    assert result.output == (
+        "[Cached #1](https://github.com/foo/bar/issues/1) [Dumped #2](https://github.com/baz/qux/pull/2) baz/qux#3\n"
+    )
+
+    result = CliRunner().invoke(cli, ["--no-cache", "--build-index", str(index_path)])
+    assert result.output == f"Wrote 0 issues to {index_path}.\n"
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (["--index", "{tmp}/bad", "-"], "Error: {tmp}/bad isn't an issue index\n"),
+        (["--offline", "--warm", "foo/bar"], "Error: --warm can't be used --offline\n"),
+        (
+            ["--no-cache", "--build-index", "{tmp}/out", "--from-jsonl", "{tmp}/bad"],
+            "Error: {tmp}/bad, line 1: not an issue with a title and a GitHub html_url\n",
+        ),
+    ],
+)
+def test_cli_index_errors(tmp_path, args, message):
+    """Bad indexes and dumps are errors, and so is warming up offline."""
+    (tmp_path / "bad").write_text("bad")
+    result = CliRunner().invoke(cli, [arg.format(tmp=tmp_path) for arg in args])
+    assert result.exit_code == 1
+    assert result.output == message.format(tmp=tmp_path)
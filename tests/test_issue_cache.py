@@ -1,21 +1,25 @@
-import io
 import json
+from email.message import Message
 from unittest.mock import patch
 
+from issue_expander.client import Response
 from issue_expander.expander import expandRefsToMarkdown
 
 
 def test_issue_lookups_are_cached_in_a_line():
     """A line with multiple references to the same issue should only make one API call."""
 
-    def mock_urlopen(*args, **kwargs):
-        return io.BytesIO(
+    def mock_request(method, url, headers=None, body=None):
+        return Response(
+            200,
+            Message(),
             json.dumps(
                 {"html_url": "https://example.com/pulls/101", "title": "Meow, meow, I'm a cow"}
-            ).encode("utf-8")
+            ).encode("utf-8"),
+            url,
         )
 
-    with patch("issue_expander.expander.urlopen", side_effect=mock_urlopen) as mock_urlopen:
+    with patch("issue_expander.client.request", side_effect=mock_request) as mock_request:
 
         expansion = expandRefsToMarkdown("adamwolf/geewhiz#101 adamwolf/geewhiz#101")
         expected = (
@@ -24,20 +28,23 @@ def test_issue_lookups_are_cached_in_a_line():
         )
 
         assert expansion == expected
-        assert mock_urlopen.call_count == 1
+        assert mock_request.call_count == 1
 
 
 def test_issue_lookups_are_cached_across_lines():
     """A line with multiple references to the same issue should only make one API call."""
 
-    def mock_urlopen(*args, **kwargs):
-        return io.BytesIO(
+    def mock_request(method, url, headers=None, body=None):
+        return Response(
+            200,
+            Message(),
             json.dumps(
                 {"html_url": "https://example.com/pulls/101", "title": "Meow, meow, I'm a cow"}
-            ).encode("utf-8")
+            ).encode("utf-8"),
+            url,
         )
 
-    with patch("issue_expander.expander.urlopen", side_effect=mock_urlopen) as mock_urlopen:
+    with patch("issue_expander.client.request", side_effect=mock_request) as mock_request:
 
         expansion = expandRefsToMarkdown("adamwolf/geewhiz#101\nadamwolf/geewhiz#101\nadamwolf/geewhiz#101")
         expected = (
@@ -47,4 +54,4 @@ def test_issue_lookups_are_cached_across_lines():
         )
 
         assert expansion == expected
-        assert mock_urlopen.call_count == 1
+        assert mock_request.call_count == 1
@@ -0,0 +1,213 @@
+import asyncio
+import io
+import re
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import aio
+from issue_expander.cache import Issue
+from issue_expander.expander import cli, expandRefsToMarkdown, expandStream, readChunks
+from issue_expander.markdown import MarkdownScanner, proseRegions
+
+DOCUMENT = """\
+# Fixes #1
+
+Fixed in #2, see `#3` and ``a ` #4``, and [#5](https://example.com/5) or ![#6](i.png "#6").
+Already expanded: [Issue 7 #7](https://github.com/foo/bar/issues/7), and <https://github.com/foo/bar/issues/8>.
+Reference links [#9][ref] and [#10][] stay, <a href="x">#11</a> and <code>#12</code> too, but <b>#13</b> doesn't.
+<!-- #14 -->
+
+```python
+# #15
+```
+
+> ~~~
+> #16
+> ~~~
+
+- ````
+  #17
+  ````
+
+[ref]: https://example.com/#18
+[#19] isn't a link, and `#20 isn't code, so they're expanded like #21.
+"""
+
+
+def mockIssue(owner, repository, number, token):
+    return Issue(f"Issue {number}", f"https://example.com/{owner}/{repository}/{number}")
+
+
+def expanded(text):
+    """The numbers of the references in DOCUMENT that were expanded in text."""
+    return [n for n in range(1, 22) if f"[Issue {n} #{n}](https://example.com/foo/bar/{n})" in text]
+
+
+def test_prose_regions():
+    """Code, links, HTML and comments are left out, and everything else is prose."""
+    text = "a `b` [c](d) <e>f</e> <a>g</a> h"
+    assert [text[start:end] for start, end in proseRegions(text)] == ["a ", " ", " ", "f", " ", " h"]
+
+
+def test_references_in_code_and_links_are_left_alone(monkeypatch):
+    """Only references in prose are looked up and expanded."""
+    looked_up = []
+
+    def getIssue(owner, repository, number, token):
+        looked_up.append(number)
+        return mockIssue(owner, repository, number, token)
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", getIssue)
+    result = expandRefsToMarkdown(DOCUMENT, None, "foo", "bar", concurrency=1)
+    assert expanded(result) == [1, 2, 13, 19, 20, 21]
+    assert sorted(looked_up, key=int) == ["1", "2", "13", "19", "20", "21"]
+    assert "[Issue 7 #7](https://github.com/foo/bar/issues/7)" in result
+
+    everything = expandRefsToMarkdown(DOCUMENT, None, "foo", "bar", concurrency=1, markdown=False)
+    assert "[Issue 15 #15]" in everything
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "``` #1\n#2\n",  # a fence that never closes
+        "```\n#2\n``` not a closing fence\n",
+        "````\n```\n#2\n",
+        "```\n#2\n~~~\n",
+    ],
+)
+def test_unclosed_fences_run_to_the_end(text):
+    """Everything after an opening fence is code, up to a closing fence at least as long."""
+    assert proseRegions(text) == []
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "an unmatched ` backtick #1",
+        "an unmatched ``` run #1 ` or two",
+        "a [bracket #1",
+        "a ]bracket #1",
+        "[not a link] #1",
+        "[not](a link because of the space) #1",
+        "an <!-- unclosed comment #1",
+        "an <a>unclosed element #1",
+        "a < less than #1",
+        r"escaped \`code\` and \[link](#1)",
+    ],
+)
+def test_unbalanced_markup_is_prose(text):
+    """Markup that isn't closed, or is escaped, doesn't hide the references after it."""
+    regions = proseRegions(text)
+    assert any(start <= text.index("#1") < end for start, end in regions)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "`" * 100_000,
+        "`a" * 50_000 + "``",
+        "".join("`" * n + "a" for n in range(1, 450)),
+        "[" * 100_000,
+        "[a](" * 50_000,
+        "]" * 100_000,
+        "<a>" * 50_000,
+        "<!--" * 50_000,
+        "<a href=" * 50_000,
+    ],
+    ids=lambda text: text[:8],
+)
+def test_pathological_markup_is_quick(text):
+    """However unbalanced the markup, scanning takes time in proportion to the text."""
+    start = time.perf_counter()
+    proseRegions(text)
+    assert time.perf_counter() - start < 2
+
+
+def test_scanner_over_chunks():
+    """A scanner carries fences from one chunk to the next, and knows when a chunk starts partway through a line."""
+    scanner = MarkdownScanner()
+    assert scanner.scan("#1 ") == [(0, 3)]
+    assert scanner.scan("```\n") == [(0, 4)]
+    assert scanner.scan("```\n#2\n") == []
+    assert scanner.scan("#3\n") == []
+    assert scanner.scan("```\n") == [(3, 4)]
+    assert scanner.scan("") == []
+    assert scanner.scan("#4\n") == [(0, 3)]
+
+
+def test_chunks_end_between_paragraphs():
+    """Streaming Markdown, chunks end just after blank lines, however the input is read."""
+    text = "a\nb\n\n  \n c\n \nd e"
+    assert list(readChunks(io.StringIO(text), 100, paragraphs=True)) == ["a\nb\n\n  \n c\n \n", "d e"]
+    for size in (1, 2, 3):
+        chunks = list(readChunks(io.StringIO(text), size, paragraphs=True))
+        assert "".join(chunks) == text
+        assert all(re.search(r"(^|\n)[ \t]*\n$", chunk) for chunk in chunks[:-1])
+        assert "a\nb\n" in chunks[0]
+
+
+def test_long_paragraphs_are_chunked_anyway(monkeypatch):
+    """A paragraph longer than MAX_PARAGRAPH is cut at whitespace, so it needn't all be held in memory."""
+    monkeypatch.setattr(issue_expander.expander, "MAX_PARAGRAPH", 4)
+    assert list(readChunks(io.StringIO("ab cd ef"), 2, paragraphs=True)) == ["ab cd ", "ef"]
+
+
+@pytest.mark.parametrize("size", (1, 3, 16, 10000))
+def test_streaming_markdown_matches_expanding_everything_at_once(monkeypatch, size):
+    """Streamed in chunks, Markdown is expanded just as it is all at once."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    output = io.StringIO()
+    expandStream(io.StringIO(DOCUMENT), output, None, "foo", "bar", chunk_size=size)
+    assert output.getvalue() == expandRefsToMarkdown(DOCUMENT, None, "foo", "bar")
+
+
+def test_async_expansion_skips_code(monkeypatch):
+    """Async expansion leaves code alone too."""
+
+    async def resolveRefsAsync(keys, token, concurrency):
+        return {key: mockIssue(*key, token) for key in keys}
+
+    monkeypatch.setattr(aio, "resolveRefsAsync", resolveRefsAsync)
+    text = "#1 `#2`"
+    assert asyncio.run(aio.expandRefsToMarkdownAsync(text, None, "foo", "bar")) == (
+        "[Issue 1 #1](https://example.com/foo/bar/1) `#2`"
+    )
+    assert asyncio.run(aio.expandRefsToMarkdownAsync(text, None, "foo", "bar", markdown=False)) == (
+        "[Issue 1 #1](https://example.com/foo/bar/1) `[Issue 2 #2](https://example.com/foo/bar/2)`"
+    )
+
+
+@pytest.mark.parametrize("in_file", [False, True])
+def test_cli_plain_text(monkeypatch, tmp_path, in_file):
+    """--plain-text expands references wherever they are, in files and streams alike."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    text = "#1 `#2`\n"
+    args = ["--default-source", "foo/bar", "--no-cache"]
+    if in_file:
+        for name in ("a.md", "b.md"):
+            (tmp_path / name).write_text(text)
+        args.append(str(tmp_path))
+    else:
+        args.append("-")
+
+    markdown = CliRunner().invoke(cli, args, input=text)
+    assert markdown.exit_code == 0
+    assert "[Issue 1 #1]" in markdown.output and "`#2`" in markdown.output
+    plain = CliRunner().invoke(cli, ["--plain-text"] + args, input=text)
+    assert "`[Issue 2 #2](https://example.com/foo/bar/2)`" in plain.output
+
+
+def test_scanner_skips_paragraphs_without_candidates():
+    """Given where references might be, only the paragraphs they're in are scanned, but fences still count."""
+    text = "a `b`\n\n```\nc\n\nd\n```\n\ne [f](g)\n"
+    scanner = MarkdownScanner()
+    everywhere = scanner.scan(text)
+    assert MarkdownScanner().scan(text, []) == []
+    assert MarkdownScanner().scan(text, [text.index("c"), text.index("e")]) == everywhere[-2:]
+    scanner = MarkdownScanner()
+    scanner.scan("```\n", [])
+    assert scanner.scan("#1\n", [0]) == []
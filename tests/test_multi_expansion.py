@@ -1,4 +1,5 @@
 import issue_expander
+from issue_expander.cache import Issue
 from issue_expander.expander import expandRefsToMarkdown
 
 
@@ -7,10 +8,10 @@ def test_gh_url_expansion(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "faux-expander" and number == "23" and token is None:
-            return {
-                "html_url": "https://github.com/adamwolf/faux-expander/issues/23",
-                "title": "Do not double expand references like adamwolf/faux-expander#100",
-            }
+            return Issue(
+                "Do not double expand references like adamwolf/faux-expander#100",
+                "https://github.com/adamwolf/faux-expander/issues/23",
+            )
 
     monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
 
@@ -26,11 +27,11 @@ def test_double_url_expansion(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "faux-expander" and number == "23" and token is None:
-            return {
-                "html_url": "https://github.com/adamwolf/faux-expander/issues/23",
-                "title": "Not https://github.com/adamwolf/faux-expander/issues/23 "
+            return Issue(
+                "Not https://github.com/adamwolf/faux-expander/issues/23 "
                 "nor https://github.com/adamwolf/faux-expander/issues/24",
-            }
+                "https://github.com/adamwolf/faux-expander/issues/23",
+            )
 
     monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
 
@@ -47,10 +48,7 @@ def test_double_gh_expansion(monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "faux-expander" and number == "23" and token is None:
-            return {
-                "html_url": "https://github.com/adamwolf/faux-expander/issues/23",
-                "title": "Refix GH-22",
-            }
+            return Issue("Refix GH-22", "https://github.com/adamwolf/faux-expander/issues/23")
 
     monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
 
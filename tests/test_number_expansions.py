@@ -1,6 +1,7 @@
 import pytest
 
 import issue_expander
+from issue_expander.cache import Issue
 from issue_expander.expander import expandRefsToMarkdown
 
 
@@ -17,10 +18,7 @@ def test_number_issue_expansion(input_text, expectation, monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "foo" and repository == "bar" and number == "100" and token is None:
-            return {
-                "html_url": "https://github.com/foo/bar/issues/100",
-                "title": "Example Issue",
-            }
+            return Issue("Example Issue", "https://github.com/foo/bar/issues/100")
         else:
             raise ValueError("Unexpected request")
 
@@ -0,0 +1,207 @@
+from email.message import Message
+
+import pytest
+from click.testing import CliRunner
+
+from issue_expander import client, graphql
+from issue_expander.client import Response
+from issue_expander.expander import cli, getIssue
+from issue_expander.ratelimit import RateLimiter, RateLimitExceeded
+
+
+class FakeTime:
+    """A clock, and a sleep that moves it forward instead of waiting."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def limiter(fake_time, **kwargs):
+    """Make a RateLimiter that runs on fake time, without jitter."""
+    kwargs.setdefault("min_interval", 0)
+    return RateLimiter(clock=fake_time.clock, sleep=fake_time.sleep, jitter=lambda: 0, **kwargs)
+
+
+def response(status, **headers):
+    """Make a Response with the given headers."""
+    message = Message()
+    for name, value in headers.items():
+        message[name.replace("_", "-")] = str(value)
+    return Response(status, message, b"", "")
+
+
+def test_requests_are_paced():
+    """Requests start at least min_interval apart."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time, min_interval=0.5)
+    for _ in range(3):
+        rate_limiter.acquire()
+    assert fake_time.slept == [0.5, 0.5]
+    # That's only our own pacing, and not GitHub's limits.
+    assert rate_limiter.deferred == 0
+
+
+def test_low_budgets_arent_waited_on():
+    """However few requests are left, they're made straight away, until there are none."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time, max_wait=3600)
+    rate_limiter.update(response(200, X_RateLimit_Remaining=20, X_RateLimit_Reset=4600))
+    for _ in range(20):
+        rate_limiter.acquire()
+    assert fake_time.slept == []
+    rate_limiter.acquire()
+    assert fake_time.slept == [3600]
+    assert rate_limiter.deferred == 1
+
+
+def test_pacing_is_never_given_up_on():
+    """Requests that only wait for their turn aren't dropped, however many are queued up."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time, min_interval=1, max_wait=2)
+    assert [rate_limiter.reserve() for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert rate_limiter.dropped == 0
+
+
+def test_exhausted_budget_waits_for_reset():
+    """A 403 with no requests remaining waits until X-RateLimit-Reset, then retries."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time)
+    assert rate_limiter.update(response(403, X_RateLimit_Remaining=0, X_RateLimit_Reset=1030))
+    rate_limiter.acquire()
+    assert fake_time.now == 1030
+    assert rate_limiter.deferred == 1
+
+
+def test_retry_after_is_honored():
+    """Secondary rate limits say how long to back off with Retry-After."""
+    fake_time = FakeTime()
+    rate_limiter = RateLimiter(
+        min_interval=0, clock=fake_time.clock, sleep=fake_time.sleep, jitter=lambda: 0.25
+    )
+    assert rate_limiter.update(response(403, Retry_After=5))
+    rate_limiter.acquire()
+    assert fake_time.slept == [5.25]
+    assert rate_limiter.deferred == 1
+
+
+def test_429s_back_off_exponentially():
+    """Without any hints, 429s back off for longer each time."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time)
+    assert rate_limiter.update(response(429), attempt=0)
+    assert rate_limiter.blocked_until == 1060
+    assert rate_limiter.update(response(429), attempt=1)
+    assert rate_limiter.blocked_until == 1120
+
+
+def test_other_403s_are_not_retried():
+    """A 403 that isn't about rate limits (like a private repository) isn't retried."""
+    rate_limiter = limiter(FakeTime())
+    assert not rate_limiter.update(response(403, X_RateLimit_Remaining=4000))
+    assert not rate_limiter.update(response(404))
+
+
+def test_waits_longer_than_max_wait_are_dropped():
+    """If we'd have to wait too long, give up, and count it."""
+    fake_time = FakeTime()
+    rate_limiter = limiter(fake_time, max_wait=10)
+    rate_limiter.update(response(403, X_RateLimit_Remaining=0, X_RateLimit_Reset=2000))
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.acquire()
+    assert rate_limiter.dropped == 1
+    assert fake_time.slept == []
+
+
+def test_malformed_headers_are_ignored():
+    """Headers that aren't numbers don't confuse us."""
+    rate_limiter = limiter(FakeTime())
+    assert not rate_limiter.update(response(403, X_RateLimit_Remaining="lots", Retry_After="soon"))
+    assert rate_limiter.remaining is None
+
+
+@pytest.fixture
+def github(github, monkeypatch):
+    """The fake GitHub, talked to through a shared client with a fake-time rate limiter."""
+    github.fake_time = FakeTime()
+    monkeypatch.setattr(client.sharedClient(), "rate_limiter", limiter(github.fake_time))
+    return github
+
+
+def test_rate_limited_lookups_are_retried(github):
+    """getIssue waits out the rate limit and tries again."""
+    reset = int(github.fake_time.now) + 30
+    github.canned.append((403, {"X-RateLimit-Remaining": 0, "X-RateLimit-Reset": reset}))
+    github.canned.append((429, {"Retry-After": 2}))
+    assert getIssue("foo", "bar", "1", None).title == "One"
+    assert len(github.requests) == 3
+    assert github.fake_time.slept == [30, 2]
+
+
+def test_retries_give_up_eventually(github, capsys):
+    """After a few retries, the rate limited response is what we get."""
+    github.canned.extend([(429, {"Retry-After": 1})] * 10)
+    assert getIssue("foo", "bar", "1", "token") is None
+    assert len(github.requests) == 4
+    assert capsys.readouterr().err == "Unable to look up issue due to rate limit error.\n"
+
+
+def test_dropped_lookups_are_not_expanded(github, capsys):
+    """If the rate limiter gives up, getIssue says so, and returns None."""
+    client.sharedClient().rate_limiter.max_wait = 1
+    github.canned.append((429, {"Retry-After": 60}))
+    assert getIssue("foo", "bar", "1", None) is None
+    assert capsys.readouterr().err == (
+        "Unable to look up issue due to rate limit error. Try providing a token with --token.\n"
+    )
+
+
+def test_dropped_graphql_batches(github, monkeypatch, capsys):
+    """If the rate limiter gives up on a GraphQL batch, nothing in it is found."""
+    monkeypatch.setattr(graphql, "GRAPHQL_URL", github.url + "/graphql")
+    client.sharedClient().rate_limiter.max_wait = 1
+    github.canned.append((429, {"Retry-After": 60}))
+    assert graphql.getIssues([("foo", "bar", "1")], "token") == {("foo", "bar", "1"): None}
+    assert capsys.readouterr().err == "Unable to look up issues due to rate limit error.\n"
+
+
+def test_cli_reports_rate_limiting(github):
+    """The CLI says how many requests were delayed or dropped, and honors --max-wait."""
+    github.canned.append((429, {"Retry-After": 3600}))
+
+    result = CliRunner().invoke(cli, ["--no-cache", "--max-wait", "5", "-"], input="foo/bar#1\n")
+    assert result.exit_code == 0
+    assert "foo/bar#1\n" in result.output
+    assert "Rate limits delayed 0 and dropped 1 GitHub requests.\n" in result.output
+
+
+def test_low_budgets_dont_hold_up_lookups(github):
+    """Without a token, GitHub only allows 60 requests an hour, but while some are left, lookups are all made
+    straight away."""
+    github.headers.update(
+        {"X-RateLimit-Remaining": 52, "X-RateLimit-Reset": int(github.fake_time.now) + 3600}
+    )
+    for number in range(3, 21):
+        github.addIssue("foo", "bar", number, f"Issue {number}")
+    text = " ".join(f"foo/bar#{number}" for number in range(1, 21)) + "\n"
+
+    result = CliRunner().invoke(cli, ["--no-cache", "-"], input=text)
+    assert result.exit_code == 0
+    assert "[Issue 20 #20]" in result.output
+    assert result.output.count("](https://github.com/foo/bar/issues/") == 20
+    assert github.fake_time.slept == []
+    assert "Rate limits" not in result.output
+
+
+def test_cli_says_nothing_about_pacing(github):
+    """Requests that only waited for their turn, and weren't held up by GitHub, aren't reported."""
+    result = CliRunner().invoke(cli, ["--no-cache", "-"], input="foo/bar#1 foo/bar#2\n")
+    assert result.exit_code == 0
+    assert "Rate limits" not in result.output
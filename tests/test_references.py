@@ -0,0 +1,111 @@
+import random
+import re
+import time
+
+import pytest
+
+from issue_expander.references import findReferences
+
+# The single regex references used to be found with. findReferences has to find just what it did.
+OLD_MEGAREGEX = re.compile(
+    "|".join(
+        [
+            r"https://github.com/(?P<owner_x>[a-zA-Z0-9.-]+)/(?P<repository_x>[a-zA-Z0-9.-]+)/(issues|pull)/"
+            r"(?P<number_x>\d+)",
+            r"(?<![a-zA-Z0-9#-])#(?P<number_y>\d+)(?![a-zA-Z0-9#])",
+            r"\bGH-(?P<number_z>\d+)",
+            r"(?P<owner_n>[a-zA-Z0-9.-]+)/(?P<repository_n>[a-zA-Z0-9.-]+)#(?P<number_n>\d+)",
+        ]
+    )
+)
+KINDS = {"number_x": "url", "number_y": "number", "number_z": "gh", "number_n": "repository"}
+
+PIECES = [
+    "a", "b", "G", "H", "-", ".", "/", "#", "1", "23", " ", "\n", "_", "é", "GH-", "x/y#3", "github.com",
+    "https://github.com/", "https://github.com/foo/bar/issues/", "/issues/", "/pull/",
+]  # fmt: skip
+
+
+def oldReferences(text, pos=0, endpos=None):
+    found = []
+    for match in OLD_MEGAREGEX.finditer(text, pos, len(text) if endpos is None else endpos):
+        groups = {
+            name.split("_")[0]: value for name, value in match.groupdict().items() if value is not None
+        }
+        found.append(
+            (
+                match.start(),
+                match.end(),
+                match.group(),
+                KINDS[match.lastgroup],
+                groups.get("owner"),
+                groups.get("repository"),
+                groups["number"],
+            )
+        )
+    return found
+
+
+def newReferences(text, pos=0, endpos=None):
+    return [tuple(reference) for reference in findReferences(text, pos, endpos)]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "#1 foo/bar#2 GH-3 https://github.com/foo/bar/issues/4 https://github.com/foo/bar/pull/5",
+        "x#1 #1a ##1 -#1 (#1) #1# #1-",
+        "GH-1 aGH-2 _GH-3 éGH-4 -GH-5 GH-6a",
+        "a/b/c#1 /b#2 a//b#3 a.b-c/d.e-f#4 é/b#5 a/b#c#6",
+        "https://github.com/foo/bar#1 https://githubXcom/a/b/issues/1 https://github.com/a/b/issue/1",
+        "foo/GH-1#2 GH-1/b#2 https://github.com/a/b#1/issues/2",
+    ],
+)
+def test_same_references_as_before(text):
+    """References are found just as the old regex found them."""
+    assert newReferences(text) == oldReferences(text)
+    for pos in range(len(text)):
+        assert newReferences(text, pos) == oldReferences(text, pos)
+        assert newReferences(text, 0, pos) == oldReferences(text, 0, pos)
+
+
+def test_same_references_as_before_at_random():
+    """Lots of text made up of pieces of references is scanned just as it was."""
+    rng = random.Random(0)
+    for _ in range(20000):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 12)))
+        pos = rng.randint(0, len(text))
+        endpos = rng.randint(pos, len(text))
+        assert newReferences(text, pos, endpos) == oldReferences(text, pos, endpos), (text, pos, endpos)
+
+
+@pytest.mark.parametrize(
+    "make",
+    [
+        lambda n: "a" * n,
+        lambda n: ("a" * 1000 + "/") * (n // 1001),
+        lambda n: "/" + "a" * n,
+        lambda n: "GH-" * (n // 3),
+        lambda n: "https://github.com/" + "a" * n,
+        lambda n: "a/" + "b" * n,
+    ],
+    ids=["run", "owners", "repositories", "gh", "url", "repository"],
+)
+def test_worst_cases_are_quick(make):
+    """Long runs of characters that might be part of a reference take linear time, not quadratic."""
+    text = make(1_000_000)
+    start = time.perf_counter()
+    assert newReferences(text) == []
+    assert time.perf_counter() - start < 1
+
+
+def test_bytes_references_are_the_same():
+    """In bytes, the same references are found, in the same places, as in the text they encode."""
+    rng = random.Random(25)
+    for _ in range(200):
+        text = "".join(rng.choice(PIECES).replace("é", "e") for _ in range(30))
+        data = text.encode("ascii")
+        assert [
+            (ref.start, ref.end, ref.text.decode(), ref.kind, ref.number.decode())
+            for ref in findReferences(data)
+        ] == [(ref.start, ref.end, ref.text, ref.kind, ref.number) for ref in findReferences(text)]
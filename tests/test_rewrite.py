@@ -0,0 +1,189 @@
+import io
+import os
+
+import pytest
+
+import issue_expander
+from issue_expander import rewrite
+from issue_expander.cache import Issue
+from issue_expander.expander import expandStream
+from issue_expander.references import findReferences
+
+DOCUMENT = (
+    "Fixes #1 and foo/bar#2, not `#3`.\r\n"
+    "\n"
+    "```\n"
+    "#4 is code\n"
+    "\n"
+    "```\n"
+    "Ünïcode, then https://github.com/baz/qux/issues/5, GH-6 and [#7](https://example.com) #404.\n"
+    "Not in bytes, but in text: éGH-8, and #9١.\n"
+    "\n"
+    "Nothing to see here.\n"
+    "\n"
+    "~~~\n"
+    "~~~\n"
+    "Not a reference: abc#1, #1a, or foo/bar#.\n"
+) * 3
+
+
+def mockIssue(owner, repository, number, token):
+    if number == "404":
+        return None
+    return Issue(f"Issue {number}", f"https://example.com/{owner}/{repository}/{number}")
+
+
+def expandText(text, markdown):
+    """Expand text with expandStream, the way the CLI used to."""
+    output = io.StringIO(newline="")
+    expandStream(io.StringIO(text, newline=""), output, None, "foo", "bar", markdown=markdown)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("paragraphs", (True, False))
+@pytest.mark.parametrize("size", (1, 2, 7, 64, 10000))
+def test_chunks_cover_the_input(paragraphs, size):
+    """Chunks, mapped or streamed, add up to the whole input, and only end just after whitespace."""
+    data = DOCUMENT.encode("utf-8")
+    for chunks in (
+        list(rewrite.mappedChunks(data, size, paragraphs)),
+        list(rewrite.streamChunks(io.BytesIO(data), size, paragraphs)),
+    ):
+        assert b"".join(chunk[start:end] for chunk, start, end in chunks) == data
+        assert all(chunk[end - 1 : end].isspace() for chunk, _, end in chunks[:-1])
+
+
+def test_streamed_chunks_wait_for_whitespace():
+    """A chunk can't end in the middle of something that might be a reference, or, with paragraphs, a paragraph."""
+    chunks = rewrite.streamChunks(io.BytesIO(b"foo/bar#123 abcdefghij"), 4)
+    assert [chunk[start:end] for chunk, start, end in chunks] == [b"foo/bar#123 ", b"abcdefghij"]
+    chunks = rewrite.streamChunks(io.BytesIO(b"a b\n\nc d"), 1, paragraphs=True)
+    assert [chunk[start:end] for chunk, start, end in chunks] == [b"a b\n\n", b"c d"]
+
+
+@pytest.mark.parametrize("paragraphs", (True, False))
+@pytest.mark.parametrize("size", (1, 2, 3, 5, 8))
+def test_streamed_chunks_end_where_mapped_ones_do(monkeypatch, paragraphs, size):
+    """However the input's read, chunks end in the same places, even where they can't end for a long way, or
+    blank lines are split between reads."""
+    monkeypatch.setattr(rewrite, "MAX_PARAGRAPH", 6)
+    data = b"abcdefghijklmnop qr\n \r\nst\n\nuvwxyzabcdefghij klmnopqrstuvwxyz\r\n\r\nab cd\n"
+    mapped = [end for _, _, end in rewrite.mappedChunks(data, size, paragraphs)]
+    offset, ends = 0, []
+    for _, start, end in rewrite.streamChunks(io.BytesIO(data), size, paragraphs):
+        offset += end - start
+        ends.append(offset)
+    assert ends == mapped
+
+
+def test_long_paragraphs_are_chunked_anyway(monkeypatch):
+    """A paragraph longer than MAX_PARAGRAPH is cut at whitespace, so it needn't all be held in memory."""
+    monkeypatch.setattr(rewrite, "MAX_PARAGRAPH", 4)
+    for chunks in (
+        rewrite.mappedChunks(b"ab cd ef", 2, True),
+        rewrite.streamChunks(io.BytesIO(b"ab cd ef"), 2, True),
+    ):
+        assert [chunk[start:end] for chunk, start, end in chunks] == [b"ab cd ", b"ef"]
+
+
+@pytest.mark.parametrize("markdown", (True, False))
+@pytest.mark.parametrize("size", (1, 5, 40, 10000))
+def test_matches_expanding_text(monkeypatch, tmp_path, markdown, size):
+    """Mapped or streamed, however the input is chunked, the output is just what expandStream writes."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    expected = expandText(DOCUMENT, markdown).encode("utf-8")
+    path = tmp_path / "a.md"
+    path.write_bytes(DOCUMENT.encode("utf-8"))
+
+    with open(path, "rb") as input:
+        output = io.BytesIO()
+        rewrite.expandBytes(input, output, None, "foo", "bar", chunk_size=size, window=2, markdown=markdown)
+    assert output.getvalue() == expected
+
+    output = io.BytesIO()
+    rewrite.expandBytes(
+        io.BytesIO(DOCUMENT.encode("utf-8")), output, None, "foo", "bar", chunk_size=size, markdown=markdown
+    )
+    assert output.getvalue() == expected
+
+
+def test_bytes_that_arent_utf8_are_left_as_they_are(monkeypatch):
+    """Bytes that aren't UTF-8 are copied through, and don't move the references after them."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    for markdown in (True, False):
+        output = io.BytesIO()
+        rewrite.expandBytes(
+            io.BytesIO(b"\xff\xfe `#1` #2\n"), output, None, "foo", "bar", markdown=markdown
+        )
+        one = b"#1" if markdown else b"[Issue 1 #1](https://example.com/foo/bar/1)"
+        assert output.getvalue() == b"\xff\xfe `" + one + b"` [Issue 2 #2](https://example.com/foo/bar/2)\n"
+
+
+def test_byteOffsets():
+    """References found in text are moved to where they are in its bytes."""
+    text = "é #1 ü\udcff #2"
+    references = rewrite.byteOffsets(text, findReferences(text), 10)
+    assert [(reference.start, reference.end, reference.number) for reference in references] == [
+        (13, 15, "1"),
+        (20, 22, "2"),
+    ]
+
+
+def test_references_without_a_repository_are_left_alone(monkeypatch):
+    """Without a default source, #1 isn't looked up, or expanded, and nothing else is started."""
+
+    def noIssue(owner, repository, number, token):
+        raise AssertionError("looked up an issue")
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", noIssue)
+    output = io.BytesIO()
+    rewrite.expandBytes(io.BytesIO(b"#1\n"), output)
+    assert output.getvalue() == b"#1\n"
+
+
+def test_mapFile(tmp_path):
+    """Only regular, non-empty files we're at the start of are memory-mapped."""
+    path = tmp_path / "a.md"
+    path.write_bytes(b"#1\n")
+    with open(path, "rb") as f:
+        mapped = rewrite.mapFile(f)
+        assert mapped[:] == b"#1\n"
+        mapped.close()
+        f.read(1)
+        assert rewrite.mapFile(f) is None
+
+    (tmp_path / "empty.md").write_bytes(b"")
+    with open(tmp_path / "empty.md", "rb") as f:
+        assert rewrite.mapFile(f) is None
+    assert rewrite.mapFile(io.BytesIO(b"#1\n")) is None
+
+    read, write = os.pipe()
+    with open(read, "rb") as r, open(write, "wb"):
+        assert rewrite.mapFile(r) is None
+
+
+def test_mapFile_falls_back_to_reading(monkeypatch, tmp_path):
+    """If a file can't be memory-mapped after all, it's read instead."""
+
+    def unmappable(*args, **kwargs):
+        raise OSError("no")
+
+    monkeypatch.setattr(rewrite.mmap, "mmap", unmappable)
+    path = tmp_path / "a.md"
+    path.write_bytes(b"#1\n")
+    with open(path, "rb") as f:
+        assert rewrite.mapFile(f) is None
+
+
+def test_failed_writes_let_go_of_the_map(monkeypatch, tmp_path):
+    """If the output can't be written, the map is still closed, and the error is the write's."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+
+    class Full(io.BytesIO):
+        def write(self, data):
+            raise OSError("full")
+
+    path = tmp_path / "a.md"
+    path.write_bytes(DOCUMENT.encode("utf-8"))
+    with open(path, "rb") as input, pytest.raises(OSError, match="full"):
+        rewrite.expandBytes(input, Full(), None, "foo", "bar")
@@ -0,0 +1,55 @@
+import concurrent.futures
+import io
+import subprocess
+import sys
+
+from issue_expander.expander import expandStream
+
+# what's slow to import, and only needed to look issues up
+NETWORK_MODULES = ("http.client", "ssl", "concurrent.futures", "socketserver")
+
+CHECK_IMPORTS = f"""
+import sys
+from issue_expander.expander import cli
+try:
+    cli(sys.argv[1:])
+except SystemExit:
+    pass
+print(*(module for module in {NETWORK_MODULES!r} if module in sys.modules), file=sys.stderr)
+"""
+
+
+def runCLI(args, text, tmp_path):
+    finished = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS] + args,
+        input=text.encode("utf-8"),
+        env={"XDG_CACHE_HOME": str(tmp_path), "PATH": ""},
+        capture_output=True,
+        check=True,
+    )
+    return finished.stdout.decode("utf-8"), finished.stderr.decode("utf-8").split()
+
+
+def test_no_references_no_network_stack(tmp_path):
+    """Expanding input without references doesn't import anything it'd only need to look issues up."""
+    (tmp_path / "a.md").write_text("Nothing to `#1` see here.\n")
+    assert runCLI(["-"], "Nothing to see here, `#1` or [#2](x).\n", tmp_path) == (
+        "Nothing to see here, `#1` or [#2](x).\n",
+        [],
+    )
+    assert runCLI([str(tmp_path / "a.md")], "", tmp_path) == ("Nothing to `#1` see here.\n", [])
+
+
+def test_offline_lookups_start_threads_only(tmp_path):
+    """References are looked up in threads, but offline, without importing anything to talk to GitHub."""
+    output, imported = runCLI(["--offline", "-"], "foo/bar#1\n", tmp_path)
+    assert output == "foo/bar#1\n"
+    assert imported == ["concurrent.futures"]
+
+
+def test_no_references_no_threads(monkeypatch):
+    """Streaming input without references through doesn't start any threads."""
+    monkeypatch.delattr(concurrent.futures, "ThreadPoolExecutor")
+    output = io.StringIO()
+    expandStream(io.StringIO("Nothing to see here.\n" * 100), output, chunk_size=64)
+    assert output.getvalue() == "Nothing to see here.\n" * 100
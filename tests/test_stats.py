@@ -0,0 +1,181 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import stats
+from issue_expander.cache import IssueCache
+from issue_expander.expander import cli, findRefs, useIssueCache
+from issue_expander.ratelimit import RateLimiter, RateLimitExceeded
+
+
+class ListSink:
+    """A sink that remembers everything it's told."""
+
+    def __init__(self):
+        self.measurements = []
+
+    def count(self, name, n):
+        self.measurements.append(("count", name, n))
+
+    def observe(self, name, seconds):
+        self.measurements.append(("observe", name, seconds))
+
+
+def test_sinks_get_measurements_while_in_use():
+    """Hooks see counts and timings made while they're installed, and nothing after."""
+    sink = ListSink()
+    with stats.useSink(sink):
+        assert stats.enabled()
+        stats.count("things", 2)
+        with stats.timer("work"):
+            pass
+    stats.count("things")
+    assert not stats.enabled()
+    assert [m[:2] for m in sink.measurements] == [("count", "things"), ("observe", "work")]
+    assert sink.measurements[0][2] == 2
+
+
+def test_no_sink():
+    """useSink(None) measures nothing, and timers without sinks still run their block."""
+    ran = []
+    with stats.useSink(None), stats.timer("work"):
+        ran.append(True)
+    assert ran == [True]
+    assert not stats.enabled()
+
+
+def test_histogram_summary():
+    """Timings are summarized with exact totals and extremes, and percentiles from buckets."""
+    histogram = stats.Histogram()
+    for seconds in [0.001] * 90 + [0.2] * 9 + [120]:
+        histogram.add(seconds)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["total"] == pytest.approx(0.09 + 1.8 + 120)
+    assert (summary["min"], summary["max"]) == (0.001, 120)
+    assert summary["p50"] == 0.001
+    assert summary["p95"] == 0.25
+    assert histogram.percentile(100) == 120
+
+
+def test_report_formats():
+    """Reports come as text for people, or as JSON."""
+    run_stats = stats.Stats()
+    run_stats.count("cache.hits", 3)
+    run_stats.count("cache.hits")
+    run_stats.observe("http.request", 0.5)
+    assert json.loads(run_stats.report("json")) == {
+        "counters": {"cache.hits": 4},
+        "timings": {
+            "http.request": {
+                "count": 1,
+                "total": 0.5,
+                "mean": 0.5,
+                "min": 0.5,
+                "p50": 0.5,
+                "p95": 0.5,
+                "max": 0.5,
+            }
+        },
+    }
+    report = run_stats.report()
+    assert "cache.hits" in report and "4" in report
+    assert "http.request" in report and "500.00" in report
+    assert stats.Stats().report() == "Counters:"
+
+
+def test_matches_are_counted_by_kind():
+    """Each regex alternative's matches are counted separately."""
+    run_stats = stats.Stats()
+    with stats.useSink(run_stats):
+        findRefs("#1 #2 GH-3 foo/bar#4 https://github.com/foo/bar/issues/5 x/y#6", "foo", "bar")
+    assert run_stats.counters == {
+        "matches.number": 2,
+        "matches.gh": 1,
+        "matches.repository": 2,
+        "matches.url": 1,
+    }
+
+
+def test_expansion_stats(github, tmp_path):
+    """Expanding counts cache hits and misses, responses by status, bytes and timings."""
+    cache = IssueCache(tmp_path)
+    cache.put("foo", "bar", "1", "Cached one", "https://example.com/1")
+    cache.put("foo", "bar", "2", "Old two", "https://example.com/2", etag="nope")
+    with cache._db:
+        cache._db.execute("UPDATE issues SET fetched_at = 0 WHERE number = '2'")
+
+    run_stats = stats.Stats()
+    with useIssueCache(cache), stats.useSink(run_stats):
+        issue_expander.expander.expandRefsToMarkdown("#1 #2 baz/qux#3 #9", None, "foo", "bar")
+
+    counters = run_stats.counters
+    assert counters["keys.unique"] == 4
+    assert (counters["cache.hits"], counters["cache.stale"], counters["cache.misses"]) == (1, 1, 2)
+    assert counters["http.requests"] == 3
+    assert (counters["http.status.200"], counters["http.status.404"]) == (2, 1)
+    assert counters["http.bytes"] > 0
+    assert counters["http.connections.new"] + counters.get("http.connections.reused", 0) == 3
+    assert run_stats.histograms["http.request"].count == 3
+    assert run_stats.histograms["json.parse"].count == 2
+    for name in ("scan", "resolve", "substitute"):
+        assert run_stats.histograms[name].count == 1
+
+
+def test_revalidation_is_counted(github, tmp_path):
+    """A 304 for a stale entry counts as a revalidation."""
+    cache = IssueCache(tmp_path, ttl=0)
+    cache.put("foo", "bar", "1", "One", "https://github.com/foo/bar/issues/1", etag='"v1"')
+    github.canned = [(304, {})]
+    run_stats = stats.Stats()
+    with useIssueCache(cache), stats.useSink(run_stats):
+        issue_expander.expander.expandRefsToMarkdown("#1", None, "foo", "bar")
+    assert run_stats.counters["cache.revalidated"] == 1
+    assert run_stats.counters["http.status.304"] == 1
+
+
+def test_rate_limiting_is_counted():
+    """Waits, retries and dropped requests are measured."""
+    now = [1000.0]
+    limiter = RateLimiter(
+        max_wait=10, min_interval=5, clock=lambda: now[0], sleep=lambda s: None, jitter=lambda: 0
+    )
+    run_stats = stats.Stats()
+
+    class Response:
+        status = 429
+        headers = {"Retry-After": "60"}
+
+    with stats.useSink(run_stats):
+        limiter.acquire()
+        limiter.acquire()
+        assert limiter.update(Response())
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire()
+    assert run_stats.histograms["ratelimit.wait"].total == 5
+    assert run_stats.counters == {"ratelimit.retries": 1, "ratelimit.dropped": 1}
+
+
+def test_cli_stats(github):
+    """--stats prints a report to stderr after expanding."""
+    result = CliRunner().invoke(cli, ["--stats", "--no-cache", "-"], input="foo/bar#1\n")
+    assert result.exit_code == 0
+    assert result.output.startswith("[One #1](https://github.com/foo/bar/issues/1)\nCounters:\n")
+    assert "http.status.200" in result.output
+    assert "stream.chunks" in result.output
+
+
+def test_cli_stats_json(github):
+    """--stats-format json prints the report as JSON, and implies --stats."""
+    result = CliRunner().invoke(
+        cli, ["--stats-format", "json", "--no-cache", "-"], input="foo/bar#1 foo/bar#404\n"
+    )
+    assert result.exit_code == 0
+    assert result.output.startswith("[One #1](https://github.com/foo/bar/issues/1) foo/bar#404\n")
+    # the report comes last, after any other messages
+    report = json.loads(result.output[result.output.index("{") :])
+    assert report["counters"]["matches.repository"] == 2
+    assert report["counters"]["http.status.404"] == 1
+    assert report["timings"]["run"]["count"] == 1
@@ -0,0 +1,135 @@
+import io
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import graphql
+from issue_expander.cache import Issue
+from issue_expander.expander import cli, expandStream, readChunks
+
+TEXT = (
+    "Fixes #1 and foo/bar#2.\n"
+    "See https://github.com/baz/qux/issues/3, GH-4 and #404.\n"
+    "Not a reference: abc#1, #1a, or foo/bar#.\n"
+    "#1 again, and again: GH-1\n"
+) * 5
+
+
+def mockIssue(owner, repository, number, token):
+    if number == "404":
+        return None
+    return Issue(f"Issue {number}", f"https://example.com/{owner}/{repository}/{number}")
+
+
+@pytest.mark.parametrize("size", (1, 2, 7, 64, 10000))
+def test_chunks_cover_the_input(size):
+    """Chunks add up to the whole input, and only end just after whitespace."""
+    chunks = list(readChunks(io.StringIO(TEXT), size))
+    assert "".join(chunks) == TEXT
+    assert all(chunk[-1].isspace() for chunk in chunks[:-1])
+
+
+def test_runs_without_whitespace_are_kept_whole():
+    """A chunk can't end in the middle of something that might be a reference."""
+    assert list(readChunks(io.StringIO("foo/bar#123 abcdefghij"), 4)) == ["foo/bar#123 ", "abcdefghij"]
+
+
+@pytest.mark.parametrize("size", (1, 5, 40, 10000))
+def test_streaming_matches_expanding_everything_at_once(monkeypatch, size):
+    """However the input is chunked, the output is the same as expanding it in one go."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    output = io.StringIO()
+    expandStream(io.StringIO(TEXT), output, None, "foo", "bar", chunk_size=size, window=2)
+    assert output.getvalue() == issue_expander.expander.expandRefsToMarkdown(TEXT, None, "foo", "bar")
+
+
+def test_lookups_are_shared_between_chunks(monkeypatch):
+    """A reference in several chunks in flight at once is only looked up once."""
+    calls = []
+    looking_up = threading.Event()
+
+    def slowIssue(owner, repository, number, token):
+        calls.append(number)
+        looking_up.wait(1)
+        return mockIssue(owner, repository, number, token)
+
+    monkeypatch.setattr(issue_expander.expander, "getIssue", slowIssue)
+    output = io.StringIO()
+
+    class Input(io.StringIO):
+        def read(self, size=-1):
+            block = super().read(size)
+            if not block:
+                looking_up.set()
+            return block
+
+    expandStream(Input("#1 " * 20), output, None, "foo", "bar", chunk_size=3, window=100)
+    assert calls == ["1"]
+    assert output.getvalue() == "[Issue 1 #1](https://example.com/foo/bar/1) " * 20
+
+
+def test_reading_ahead_is_bounded(monkeypatch):
+    """Only `window` chunks are read ahead of the one being written, and output keeps the input's order."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    events = []
+
+    class Input(io.StringIO):
+        def read(self, size=-1):
+            block = super().read(size)
+            if block:
+                events.append("read")
+            return block
+
+    class Output(io.StringIO):
+        def write(self, text):
+            events.append("write")
+            return super().write(text)
+
+    lines = "".join(f"foo/bar#{n}\n" for n in range(50))
+    output = Output()
+    expandStream(Input(lines), output, chunk_size=len("foo/bar#10\n"), window=3, markdown=False)
+
+    ahead = 0
+    for event in events:
+        ahead += 1 if event == "read" else -1
+        assert ahead <= 4
+    assert output.getvalue() == "".join(
+        f"[Issue {n} #{n}](https://example.com/foo/bar/{n})\n" for n in range(50)
+    )
+
+
+def test_streaming_with_graphql(fake_github, monkeypatch):
+    """With GraphQL, each chunk's new references are looked up together."""
+    monkeypatch.setattr(graphql, "GRAPHQL_URL", fake_github.url + "/graphql")
+    fake_github.addIssue("foo", "bar", 1, "One")
+    fake_github.addIssue("foo", "bar", 2, "Two")
+    output = io.StringIO()
+    expandStream(
+        io.StringIO("#1 #2\n\n#1\n\n#2 #9\n"),
+        output,
+        "sekrit",
+        "foo",
+        "bar",
+        use_graphql=True,
+        chunk_size=7,
+    )
+    assert output.getvalue() == (
+        "[One #1](https://github.com/foo/bar/issues/1) [Two #2](https://github.com/foo/bar/issues/2)\n\n"
+        "[One #1](https://github.com/foo/bar/issues/1)\n\n"
+        "[Two #2](https://github.com/foo/bar/issues/2) #9\n"
+    )
+    assert len(fake_github.requests) == 2
+
+
+def test_cli_streams_crlf_input(monkeypatch):
+    """The CLI streams its input, and references at the ends of Windows-style lines still expand, and the line
+    endings are left as they are."""
+    monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
+    result = CliRunner().invoke(cli, ["--default-source", "foo/bar", "-"], input="#1\r\nfoo/bar#2\r\n")
+    # (result.output has \r\n turned into \n)
+    assert result.stdout_bytes == (
+        b"[Issue 1 #1](https://example.com/foo/bar/1)\r\n[Issue 2 #2](https://example.com/foo/bar/2)\r\n"
+    )
+    assert result.exit_code == 0
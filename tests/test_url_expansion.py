@@ -1,6 +1,7 @@
 import pytest
 
 import issue_expander
+from issue_expander.cache import Issue
 from issue_expander.expander import expandRefsToMarkdown
 
 
@@ -50,10 +51,7 @@ def test_url_expansion(input_text, expectation, monkeypatch):
 
     def mockIssue(owner, repository, number, token):
         if owner == "adamwolf" and repository == "faux-expander" and number == "23" and token is None:
-            return {
-                "html_url": "https://github.com/adamwolf/faux-expander/issues/23",
-                "title": "Detect url references",
-            }
+            return Issue("Detect url references", "https://github.com/adamwolf/faux-expander/issues/23")
 
     monkeypatch.setattr(issue_expander.expander, "getIssue", mockIssue)
 
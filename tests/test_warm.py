@@ -0,0 +1,196 @@
+import io
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import issue_expander
+from issue_expander import client, rewrite
+from issue_expander.cache import Issue, IssueCache
+from issue_expander.expander import cli, useIssueCache, warmRepository
+from issue_expander.ratelimit import RateLimitExceeded
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def github(github, monkeypatch):
+    """The fake GitHub, with five issues in foo/bar and one in baz/qux instead, listed two to a page."""
+    monkeypatch.setattr(issue_expander.expander, "WARM_PAGE_SIZE", 2)
+    github.issues.clear()
+    for number in range(1, 6):
+        github.addIssue("foo", "bar", number, f"Issue {number}")
+    github.addIssue("baz", "qux", 1, "Elsewhere")
+    return github
+
+
+def test_warm_repository(github, tmp_path):
+    """Warming pages through a repository's issues and caches them all, so looking them up is free."""
+    cache = IssueCache(tmp_path)
+    with useIssueCache(cache):
+        assert warmRepository("foo", "bar") == 5
+        assert [request[1] for request in github.requests] == [
+            "/repos/foo/bar/issues?state=all&per_page=2",
+            "/repos/foo/bar/issues?state=all&per_page=2&page=2",
+            "/repos/foo/bar/issues?state=all&per_page=2&page=3",
+        ]
+        assert issue_expander.expander.getIssue("foo", "bar", "3", None) == Issue(
+            "Issue 3", "https://github.com/foo/bar/issues/3"
+        )
+        assert len(github.requests) == 3
+        assert cache.warmedAt("foo", "bar") is not None
+        assert cache.warmedAt("baz", "qux") is None
+
+
+def test_incremental_warm(github, tmp_path):
+    """After the first time, only changed issues are asked for, and what we already had is fresh again."""
+    clock = Clock()
+    cache = IssueCache(tmp_path, ttl=60, clock=clock)
+    with useIssueCache(cache):
+        warmRepository("foo", "bar")
+        clock.now += 30
+        cache.put("foo", "bar", "99", "Looked up since", "https://github.com/foo/bar/issues/99")
+        cache.put("foo", "bar", "2", "Changed since", "https://github.com/foo/bar/issues/2")
+        clock.now += 3600
+        github.requests.clear()
+
+        github.issues = {key: issue for key, issue in github.issues.items() if key[2] == 2}
+        assert warmRepository("foo", "bar") == 1
+        since = time.strftime("%Y-%m-%dT%H%%3A%M%%3A%SZ", time.gmtime(1_000_000 - 5 * 60))
+        assert github.requests[0][1] == f"/repos/foo/bar/issues?state=all&per_page=2&since={since}"
+
+        for number in ("1", "2", "99"):
+            assert cache.isFresh(cache.get("foo", "bar", number))
+        assert cache.get("foo", "bar", "2").title == "Issue 2"
+        assert cache.warmedAt("foo", "bar") == clock.now
+
+
+def test_warmed_issues_are_evicted_first(github, tmp_path):
+    """Issues cached by warming, but never looked up, are the first to go."""
+    cache = IssueCache(tmp_path, max_entries=2)
+    cache.put("baz", "qux", "1", "Used", "https://github.com/baz/qux/issues/1")
+    with useIssueCache(cache):
+        warmRepository("foo", "bar")
+        cache.get("foo", "bar", "4")
+    cache = IssueCache(tmp_path)
+    assert cache.get("baz", "qux", "1") and cache.get("foo", "bar", "4")
+    assert len(cache) == 2
+
+
+def test_warm_failures(github, tmp_path, capsys):
+    """If GitHub won't list a repository's issues, it isn't marked warm."""
+    cache = IssueCache(tmp_path)
+    with useIssueCache(cache):
+        assert warmRepository("nobody", "here") == 0
+        github.canned = [(403, {"X-RateLimit-Remaining": "0"})]
+        assert warmRepository("foo", "bar") == 0
+        assert cache.warmedAt("nobody", "here") is None
+        assert cache.warmedAt("foo", "bar") is None
+    err = capsys.readouterr().err
+    assert "Unable to list issues in nobody/here (404)" in err
+    assert "Unable to look up issue due to rate limit error." in err
+    assert warmRepository("foo", "bar") is None
+
+
+def test_warm_bad_responses(tmp_path, monkeypatch, capsys):
+    """Unparseable pages, and running out of rate limit, stop a warm-up."""
+    responses = [client.Response(200, {}, b"nope", "https://example.com"), RateLimitExceeded("slow down")]
+
+    def mockRequest(method, url, headers=None, body=None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(client, "request", mockRequest)
+    with useIssueCache(IssueCache(tmp_path)):
+        assert warmRepository("foo", "bar") == 0
+        assert warmRepository("foo", "bar") == 0
+    err = capsys.readouterr().err
+    assert "Unable to parse response from https://example.com" in err
+    assert "rate limit" in err
+
+
+def test_busy_repositories_are_warmed(github, tmp_path):
+    """With warm_over, repositories with enough references are warmed, and the rest looked up one by one."""
+    text = "foo/bar#1 foo/bar#2 foo/bar#1 baz/qux#1\nfoo/bar#3\n"
+    path = tmp_path / "a.md"
+    path.write_text(text)
+
+    with useIssueCache(IssueCache(tmp_path / "files")):
+        output = io.StringIO()
+        issue_expander.expander.expandFiles([str(path)], output, warm_over=2)
+    files_requests = sorted(request[1] for request in github.requests)
+
+    github.requests.clear()
+    issue_expander.expander.getIssue.cache_clear()
+    with useIssueCache(IssueCache(tmp_path / "stream")):
+        output = io.StringIO()
+        issue_expander.expander.expandStream(io.StringIO(text), output, chunk_size=1, warm_over=2)
+    assert "[Issue 3 #3](https://github.com/foo/bar/issues/3)" in output.getvalue()
+    stream_requests = [request[1] for request in github.requests]
+
+    github.requests.clear()
+    issue_expander.expander.getIssue.cache_clear()
+    with useIssueCache(IssueCache(tmp_path / "bytes")):
+        output = io.BytesIO()
+        rewrite.expandBytes(io.BytesIO(text.encode("utf-8")), output, chunk_size=1, warm_over=2)
+    assert b"[Issue 3 #3](https://github.com/foo/bar/issues/3)" in output.getvalue()
+    bytes_requests = [request[1] for request in github.requests]
+
+    for requests in (files_requests, stream_requests, bytes_requests):
+        assert "/repos/baz/qux/issues/1" in requests
+        assert "/repos/foo/bar/issues/3" not in requests
+        assert sum(request.startswith("/repos/foo/bar/issues?") for request in requests) == 3
+
+
+def test_cli_warm(github, tmp_path):
+    """--warm caches a repository's issues, with or without anything to expand."""
+    result = CliRunner().invoke(
+        cli, ["--cache-dir", str(tmp_path), "--warm", "foo/bar", "--warm", "baz/qux"]
+    )
+    assert result.exit_code == 0
+    assert result.output.startswith("Cached 5 issues from foo/bar.\nCached 1 issues from baz/qux.\n")
+
+    github.requests.clear()
+    issue_expander.expander.getIssue.cache_clear()
+    result = CliRunner().invoke(cli, ["--cache-dir", str(tmp_path), "-"], input="foo/bar#5\n")
+    assert result.output == "[Issue 5 #5](https://github.com/foo/bar/issues/5)\n"
+    assert github.requests == []
+
+
+def test_cli_warm_without_a_cache(github, tmp_path):
+    """If the cache can't be opened, there's nowhere to warm up."""
+    (tmp_path / "file").write_text("")
+    result = CliRunner().invoke(cli, ["--cache-dir", str(tmp_path / "file" / "cache"), "--warm", "foo/bar"])
+    assert result.exit_code == 0
+    assert result.output.startswith("Unable to open issue cache")
+    assert github.requests == []
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (["--warm", "foo"], "Error: --warm must be in the format 'owner/repository'\n"),
+        (["--no-cache", "--warm", "foo/bar"], "Error: --warm and --warm-over need the issue cache\n"),
+        (["--no-cache", "--warm-over", "5", "-"], "Error: --warm and --warm-over need the issue cache\n"),
+    ],
+)
+def test_cli_warm_errors(args, message):
+    """--warm needs a repository and the cache."""
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 1
+    assert result.output == message
+
+
+def test_cli_needs_something_to_do():
+    """Without --warm, a FILE is required."""
+    result = CliRunner().invoke(cli, [])
+    assert result.exit_code == 2
+    assert "Missing argument 'FILE...'" in result.output